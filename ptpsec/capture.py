@@ -0,0 +1,201 @@
+"""
+Binary columnar captures of the measurement logs.
+
+A capture holds the same columns as the text log (see measurements.py), each one as a contiguous array
+of little endian int64, so that it is opened with np.memmap without parsing and only the pages that are
+accessed are read. Layout:
+    header     HEADER (magic, version, format, index stride, rows, capacity, index offset, index blocks)
+    columns    one array of capacity values per column, the first rows values are valid
+    index      min and max of INDEX_FIELD of every block of index stride rows
+The index allows to read a time range without touching the rest of the capture.
+
+Usage: python3 capture.py convert TEXT_FILE [CAPTURE_FILE]
+       python3 capture.py info CAPTURE_FILE...
+"""
+
+from typing import Iterator
+import argparse
+import os
+import struct
+import sys
+
+import numpy as np
+
+import measurements
+
+MAGIC = b'PTPSMEAS'
+VERSION = 1
+HEADER = struct.Struct('<8sHHIQQQQ')
+HEADER_SIZE = 64
+VALUE = np.dtype('<i8')
+
+FORMATS = {0: measurements.SLAVE_DTYPE, 1: measurements.MASTER_DTYPE}
+INDEX_FIELD = 't1'
+INDEX_STRIDE = 4096
+
+
+def is_capture(path: str) -> bool:
+    with open(path, 'rb') as file:
+        return file.read(len(MAGIC)) == MAGIC
+
+
+def _format_of(dtype: np.dtype) -> int:
+    return next(f for (f, d) in FORMATS.items() if d == dtype)
+
+
+def _count_lines(path: str, block: int = 1 << 24) -> int:
+    # upper bound of the number of measurements, counting newlines is much faster than parsing
+    lines = 0
+    last = b'\n'
+    with open(path, 'rb') as file:
+        while data := file.read(block):
+            lines += data.count(b'\n')
+            last = data[-1:]
+    return lines + (last != b'\n')
+
+
+def convert(text_path: str, capture_path: str, index_stride: int = INDEX_STRIDE) -> int:
+    """
+    Converts a text log into a capture, chunk by chunk. Returns the number of measurements
+    """
+    with open(text_path, 'r') as file:
+        dtype = measurements.detect_format(file)
+    capacity = max(_count_lines(text_path) - measurements.HEADER_LINES, 0)
+    columns = len(dtype)
+    blocks = -(-capacity // index_stride)
+    index_offset = HEADER_SIZE + columns * capacity * VALUE.itemsize
+
+    with open(capture_path, 'wb') as file:
+        file.truncate(index_offset + 2 * blocks * VALUE.itemsize)
+
+    rows = 0
+    if capacity:
+        data = np.memmap(capture_path, dtype=VALUE, mode='r+', offset=HEADER_SIZE, shape=(columns, capacity))
+        for chunk in measurements.iter_chunks(text_path):
+            for (i, field) in enumerate(dtype.names):
+                data[i, rows:rows + len(chunk)] = chunk[field]
+            rows += len(chunk)
+        data.flush()
+
+        # NOTE: blocks are built from the final rows, a chunk does not need to end at a block boundary
+        blocks = -(-rows // index_stride)
+        if blocks:
+            values = data[dtype.names.index(INDEX_FIELD), :rows]
+            starts = np.arange(0, rows, index_stride)
+            index = np.memmap(capture_path, dtype=VALUE, mode='r+', offset=index_offset, shape=(blocks, 2))
+            index[:, 0] = np.minimum.reduceat(values, starts)
+            index[:, 1] = np.maximum.reduceat(values, starts)
+            index.flush()
+
+    with open(capture_path, 'r+b') as file:
+        file.write(HEADER.pack(MAGIC, VERSION, _format_of(dtype), index_stride, rows, capacity, index_offset, blocks))
+    return rows
+
+
+class Capture:
+    """
+    A capture opened with np.memmap, columns are read lazily, e.g. Capture(path)['asymmetry'][1000:2000]
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as file:
+            header = file.read(HEADER.size)
+        if len(header) < HEADER.size or header[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not a measurement capture")
+        (_, version, fmt, self.index_stride, self.rows, capacity, index_offset, blocks) = HEADER.unpack(header)
+        if version != VERSION or fmt not in FORMATS:
+            raise ValueError(f"unsupported capture version {version} or format {fmt}")
+        self.dtype: np.dtype = FORMATS[fmt]
+
+        self.columns: dict[str, np.ndarray] = {}
+        for (i, field) in enumerate(self.dtype.names):
+            if self.rows:
+                self.columns[field] = np.memmap(path, dtype=VALUE, mode='r', shape=(self.rows,),
+                                                offset=HEADER_SIZE + i * capacity * VALUE.itemsize)
+            else:
+                self.columns[field] = np.empty(0, dtype=VALUE)
+        self.index = (np.memmap(path, dtype=VALUE, mode='r', offset=index_offset, shape=(blocks, 2))
+                      if blocks else np.empty((0, 2), dtype=VALUE))
+
+    def __len__(self) -> int:
+        return self.rows
+
+    def __getitem__(self, field: str) -> np.ndarray:
+        return self.columns[field]
+
+    def read(self, start: int = 0, stop: int = None) -> np.ndarray:
+        """
+        Rows start to stop as structured array like measurements.load
+        """
+        (start, stop, _) = slice(start, stop).indices(self.rows)
+        result = np.empty(max(stop - start, 0), dtype=self.dtype)
+        for field in self.dtype.names:
+            result[field] = self.columns[field][start:stop]
+        return result
+
+    def iter_chunks(self, chunk_rows: int = measurements.CHUNK_ROWS) -> Iterator[np.ndarray]:
+        for start in range(0, self.rows, chunk_rows):
+            yield self.read(start, start + chunk_rows)
+
+    def time_range(self, start_ns: int, end_ns: int) -> np.ndarray:
+        """
+        Measurements with start_ns <= INDEX_FIELD < end_ns, only the blocks that can contain them are read
+        """
+        blocks = np.flatnonzero((self.index[:, 1] >= start_ns) & (self.index[:, 0] < end_ns))
+        if not len(blocks):
+            return np.empty(0, dtype=self.dtype)
+
+        # read consecutive blocks at once
+        parts = []
+        runs = np.split(blocks, np.flatnonzero(np.diff(blocks) != 1) + 1)
+        for run in runs:
+            rows = self.read(run[0] * self.index_stride, (run[-1] + 1) * self.index_stride)
+            parts.append(rows[(rows[INDEX_FIELD] >= start_ns) & (rows[INDEX_FIELD] < end_ns)])
+        return np.concatenate(parts)
+
+
+def iter_chunks(path: str, chunk_rows: int = measurements.CHUNK_ROWS) -> Iterator[np.ndarray]:
+    """
+    Chunks of a text log or a capture
+    """
+    if is_capture(path):
+        return Capture(path).iter_chunks(chunk_rows)
+    return measurements.iter_chunks(path, chunk_rows)
+
+
+def load(path: str) -> np.ndarray:
+    """
+    All measurements of a text log or a capture
+    """
+    if is_capture(path):
+        return Capture(path).read()
+    return measurements.load(path)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Binary captures of ptpsec measurement logs")
+    commands = parser.add_subparsers(dest='command', required=True)
+    convert_parser = commands.add_parser('convert', help="convert a text log into a capture")
+    convert_parser.add_argument('text_file')
+    convert_parser.add_argument('capture_file', nargs='?', help="defaults to the text file with suffix .bin")
+    info_parser = commands.add_parser('info', help="print the format and size of captures")
+    info_parser.add_argument('capture_files', nargs='+')
+    args = parser.parse_args(argv)
+
+    if args.command == 'convert':
+        capture_file = args.capture_file or os.path.splitext(args.text_file)[0] + '.bin'
+        rows = convert(args.text_file, capture_file)
+        print(f"{args.text_file} -> {capture_file}: {rows} measurements")
+    else:
+        for path in args.capture_files:
+            capture = Capture(path)
+            fmt = 'slave' if capture.dtype == measurements.SLAVE_DTYPE else 'master'
+            t = capture[INDEX_FIELD]
+            span = f", {INDEX_FIELD} {t.min()} to {t.max()}" if len(capture) else ""
+            print(f"{path}: {fmt}, {len(capture)} measurements{span}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,239 @@
+"""
+Filtering and change-point detection on the measurement series.
+
+The asymmetry and offset series are noisy, a slow delay attack only shows as a small shift of their
+level. The stages are
+    median_filter / savgol      smoothing with scipy.signal (medfilt, savgol_filter)
+    cusum                       two-sided CUSUM statistic of the deviation from a baseline
+    change_points               onsets of alarms of a CUSUM statistic and the estimated start of the change
+    window_scores               attack score of fixed windows, the mean deviation in units of the noise
+All of them work on whole arrays. StreamingFilter and ChangeDetector apply them to a series that is
+read chunk by chunk (see capture.iter_chunks) and give the same result as on the whole array.
+
+Usage: python3 detection.py [-h] [--field FIELD] [--window N] [--drift NS] [--threshold NS ...] FILE...
+"""
+
+from typing import Callable
+import argparse
+import sys
+
+import numpy as np
+import scipy.signal
+
+import capture
+import stream_stats
+
+# factor between the median absolute deviation and the standard deviation of normally distributed values
+MAD_SCALE = 1.4826
+
+
+def _odd_window(window: int, length: int) -> int:
+    # filters need an odd window that is not longer than the series
+    window = min(window, length if length % 2 else length - 1)
+    return max(window - (1 - window % 2), 1)
+
+
+def median_filter(values: np.ndarray, window: int) -> np.ndarray:
+    if not len(values):
+        return values.astype(np.float64)
+    return scipy.signal.medfilt(values.astype(np.float64), _odd_window(window, len(values)))
+
+
+def savgol(values: np.ndarray, window: int, order: int = 2) -> np.ndarray:
+    if not len(values):
+        return values.astype(np.float64)
+    window = _odd_window(window, len(values))
+    return scipy.signal.savgol_filter(values.astype(np.float64), window, min(order, window - 1))
+
+
+class StreamingFilter:
+    """
+    Applies a centered filter (e.g. median_filter) chunk by chunk. Every sample is returned once the
+    window around it is complete, the last ones by flush
+    """
+
+    def __init__(self, filter: Callable[[np.ndarray, int], np.ndarray], window: int):
+        self.filter = filter
+        self.window = _odd_window(window, window)
+        self.half = self.window // 2
+        # the last window samples are kept for the context of the next chunk and for the end of the series
+        self.tail = np.empty(0, dtype=np.float64)
+        self.seen = 0
+        self.emitted = 0
+
+    def process(self, values: np.ndarray) -> np.ndarray:
+        buffer = np.concatenate((self.tail, values.astype(np.float64)))
+        start = self.seen - len(self.tail)
+        self.seen += len(values)
+        self.tail = buffer[-self.window:]
+
+        # NOTE: until a full window was seen, the start of the series is filtered like a short series
+        if self.seen < self.window:
+            return np.empty(0, dtype=np.float64)
+        stop = self.seen - self.half
+        filtered = self.filter(buffer, self.window)[self.emitted - start:stop - start]
+        self.emitted = stop
+        return filtered
+
+    def flush(self) -> np.ndarray:
+        start = self.seen - len(self.tail)
+        filtered = self.filter(self.tail, self.window)[self.emitted - start:]
+        self.emitted = self.seen
+        return filtered
+
+
+def calibrate(values: np.ndarray) -> tuple[float, float]:
+    """
+    Robust baseline and noise level of a series: its median and the scaled median absolute deviation
+    """
+    if not len(values):
+        return (0.0, 1.0)
+    values = values.astype(np.float64)
+    median = float(np.median(values))
+    scale = MAD_SCALE * float(np.median(np.abs(values - median)))
+    return (median, scale or 1.0)
+
+
+def _lindley(steps: np.ndarray, initial: float) -> np.ndarray:
+    # S_n = max(0, S_n-1 + y_n) without a loop: S_n = C_n - min(-S_0, C_1, ..., C_n) for the partial sums C
+    sums = np.cumsum(steps)
+    return sums - np.minimum(np.minimum.accumulate(sums), -initial)
+
+
+def cusum(values: np.ndarray, target: float, drift: float, state: tuple[float, float] = (0.0, 0.0)
+          ) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Upper and lower CUSUM statistic of values: the accumulated deviation above (below) target that
+    exceeds drift per sample. state holds the statistics before the first value
+    """
+    deviation = values.astype(np.float64) - target
+    return (_lindley(deviation - drift, state[0]), _lindley(-deviation - drift, state[1]))
+
+
+def change_points(statistic: np.ndarray, threshold: float, previous: float = 0.0,
+                  last_zero: int = -1) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Indices at which statistic rises above threshold and, for each of them, the index of the sample after
+    the last zero of the statistic before, the estimated start of the change. previous and last_zero are
+    the value before the first sample and the index of the last zero before it (negative)
+    """
+    above = statistic > threshold
+    onsets = np.flatnonzero(above & ~np.concatenate(([previous > threshold], above[:-1])))
+    resets = np.where(statistic <= 0, np.arange(len(statistic)), last_zero)
+    starts = np.maximum.accumulate(resets)[onsets] + 1 if len(onsets) else onsets
+    return (onsets, starts)
+
+
+def window_scores(values: np.ndarray, window: int, baseline: float, scale: float) -> np.ndarray:
+    """
+    Mean absolute deviation from baseline in units of scale of every window of window samples, the last
+    window may be shorter
+    """
+    deviation = np.abs(values.astype(np.float64) - baseline) / scale
+    starts = np.arange(0, len(deviation), window)
+    if not len(starts):
+        return deviation
+    return np.add.reduceat(deviation, starts) / np.diff(np.append(starts, len(deviation)))
+
+
+class ChangeDetector:
+    """
+    Median filter, CUSUM and change points of a series that is processed chunk by chunk. An alarm is a
+    rise of max(upper, lower) CUSUM statistic above a threshold, like change_points. The change points
+    are reported with the id of their measurement (the index in the whole series without ids). counter
+    counts the alarms for every threshold of a sweep
+    """
+
+    def __init__(self, target: float, drift: float, threshold: float, window: int = 1, sweep=()):
+        self.target = target
+        self.drift = drift
+        self.threshold = threshold
+        self.filter = StreamingFilter(median_filter, window)
+        self.state = (0.0, 0.0)
+        self.position = 0
+        self.last_zero = -1
+        # ids of the values the filter did not return yet and id of the sample after the last zero of the
+        # statistic if it was in an earlier chunk
+        self.pending_ids = np.empty(0, dtype=np.int64)
+        self.start_id = None
+        self.onsets: list[np.ndarray] = []
+        self.starts: list[np.ndarray] = []
+        self.counter = stream_stats.ThresholdCounter(sweep)
+
+    def _detect(self, filtered: np.ndarray):
+        (ids, self.pending_ids) = (self.pending_ids[:len(filtered)], self.pending_ids[len(filtered):])
+        if not len(filtered):
+            return
+        (upper, lower) = cusum(filtered, self.target, self.drift, self.state)
+        statistic = np.maximum(upper, lower)
+        (onsets, starts) = change_points(statistic, self.threshold, max(self.state), self.last_zero - self.position)
+        self.onsets.append(ids[onsets])
+        self.starts.append(np.array([ids[i] if i >= 0 else self.start_id for i in starts], dtype=np.int64))
+        self.counter.update(statistic)
+
+        zeros = np.flatnonzero(statistic <= 0)
+        if len(zeros):
+            self.last_zero = self.position + zeros[-1]
+            self.start_id = ids[zeros[-1] + 1] if zeros[-1] + 1 < len(ids) else None
+        elif self.start_id is None:
+            self.start_id = ids[0]
+        self.state = (float(upper[-1]), float(lower[-1]))
+        self.position += len(filtered)
+
+    def process(self, values: np.ndarray, ids: np.ndarray = None):
+        if ids is None:
+            start = self.position + len(self.pending_ids)
+            ids = np.arange(start, start + len(values))
+        self.pending_ids = np.concatenate((self.pending_ids, ids.astype(np.int64)))
+        self._detect(self.filter.process(values))
+
+    def flush(self) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Processes the end of the series and returns the ids of all change points (onset, start)
+        """
+        self._detect(self.filter.flush())
+        onsets = np.concatenate(self.onsets) if self.onsets else np.empty(0, dtype=np.int64)
+        starts = np.concatenate(self.starts) if self.starts else np.empty(0, dtype=np.int64)
+        return (onsets, starts)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Change-point detection on ptpsec measurement logs")
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('--field', default='asymmetry', help="series to analyse (rt for master logs)")
+    parser.add_argument('--window', type=int, default=5, help="median filter window")
+    parser.add_argument('--drift', type=float, default=None,
+                        help="deviation per measurement (ns) that is tolerated, defaults to the noise level")
+    parser.add_argument('--threshold', type=float, action='append', default=[],
+                        help="alarm level of the CUSUM statistic (ns), repeatable to sweep thresholds")
+    parser.add_argument('--calibration', type=int, default=100,
+                        help="measurements at the start that give the baseline and the noise level")
+    args = parser.parse_args(argv)
+    thresholds = sorted(args.threshold) or [10000.0]
+
+    for path in args.files:
+        chunks = capture.iter_chunks(path)
+        first = next(chunks, None)
+        if first is None:
+            print(f"{path}: empty")
+            continue
+        if args.field not in first.dtype.names:
+            parser.error(f"{path} has no field {args.field}, choose one of {', '.join(first.dtype.names)}")
+        (target, scale) = calibrate(first[args.field][:args.calibration])
+        drift = scale if args.drift is None else args.drift
+        detector = ChangeDetector(target, drift, thresholds[0], args.window, thresholds)
+        detector.process(first[args.field], first['id'])
+        for chunk in chunks:
+            detector.process(chunk[args.field], chunk['id'])
+        (onsets, starts) = detector.flush()
+
+        print(f"{path}: baseline {target:.6g} ns, noise {scale:.6g} ns, drift {drift:.6g} ns")
+        print(f"  {len(onsets)} changes above {thresholds[0]:g} ns (measurement ids start-onset): "
+              + ", ".join(f"{s}-{o}" for (s, o) in zip(starts, onsets)))
+        for (t, alarms) in zip(detector.counter.thresholds, detector.counter.crossings):
+            print(f"  threshold {t:g} ns: {alarms} alarms")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,202 @@
+"""
+Loading and analysis of the measurement logs written by the detection clocks.
+
+A log starts with two header lines and contains one measurement per line, either in the slave format
+    id, asymmetry, rt_m, rt_s, t1, t2, tm1, tm2, offset, delay
+or in the master format
+    id, rt, t1, t2, tm1, tm2
+All values are integers (timestamps and durations in ns). Logs are returned as structured arrays with
+one field per column, e.g. load('measurements.txt')['asymmetry'].
+
+Usage: python3 measurements.py [-h] [--skip N] [--threshold NS] [--min-length N] FILE...
+"""
+
+from itertools import islice
+from typing import Iterator, TextIO
+import argparse
+import sys
+
+import numpy as np
+
+SLAVE_FIELDS = ('id', 'asymmetry', 'rt_m', 'rt_s', 't1', 't2', 'tm1', 'tm2', 'offset', 'delay')
+MASTER_FIELDS = ('id', 'rt', 't1', 't2', 'tm1', 'tm2')
+
+SLAVE_DTYPE = np.dtype([(field, np.int64) for field in SLAVE_FIELDS])
+MASTER_DTYPE = np.dtype([(field, np.int64) for field in MASTER_FIELDS])
+
+HEADER_LINES = 2
+CHUNK_ROWS = 1 << 20
+
+
+def dtype_of(columns: int) -> np.dtype:
+    if columns == len(SLAVE_FIELDS):
+        return SLAVE_DTYPE
+    if columns == len(MASTER_FIELDS):
+        return MASTER_DTYPE
+    raise ValueError(f"unknown measurement format with {columns} columns")
+
+
+def is_slave(data: np.ndarray) -> bool:
+    return data.dtype == SLAVE_DTYPE
+
+
+def detect_format(file: TextIO) -> np.dtype:
+    # the format is given by the number of columns of the first measurement
+    position = file.tell()
+    for _ in range(HEADER_LINES):
+        file.readline()
+    line = file.readline()
+    while line and (line.startswith('#') or not line.strip()):
+        line = file.readline()
+    file.seek(position)
+    if not line:
+        return SLAVE_DTYPE
+    return dtype_of(line.count(',') + 1)
+
+
+def _parse(lines, dtype: np.dtype) -> np.ndarray:
+    rows = np.loadtxt(lines, dtype=np.int64, delimiter=',', comments='#', ndmin=2)
+    if rows.shape[1] != len(dtype):
+        raise ValueError(f"expected {len(dtype)} columns, got {rows.shape[1]}")
+    # NOTE: a row of int64 columns has the same memory layout as a record of dtype
+    return np.ascontiguousarray(rows).view(dtype).reshape(-1)
+
+
+def iter_chunks(path: str, chunk_rows: int = CHUNK_ROWS, skip: int = 0) -> Iterator[np.ndarray]:
+    """
+    Yields the measurements of a log in structured arrays of at most chunk_rows rows, so that logs of
+    any length are processed with bounded memory. The first skip measurements are dropped
+    """
+    with open(path, 'r') as file:
+        dtype = detect_format(file)
+        lines = islice(file, HEADER_LINES + skip, None)
+        while True:
+            chunk = list(islice(lines, chunk_rows))
+            if not chunk:
+                return
+            data = _parse(chunk, dtype)
+            if len(data):
+                yield data
+
+
+def load(path: str, skip: int = 0) -> np.ndarray:
+    """
+    Loads a whole log into one structured array, the first skip measurements are dropped
+    """
+    with open(path, 'r') as file:
+        dtype = detect_format(file)
+    chunks = list(iter_chunks(path, skip=skip))
+    if not chunks:
+        return np.empty(0, dtype=dtype)
+    return chunks[0] if len(chunks) == 1 else np.concatenate(chunks)
+
+
+def distribution(values: np.ndarray, percentiles=(1, 5, 25, 50, 75, 95, 99)) -> dict:
+    """
+    Summary of the distribution of a column
+    """
+    if not len(values):
+        return {'count': 0}
+    values = values.astype(np.float64)
+    result = {'count': len(values),
+              'mean': float(values.mean()),
+              'std': float(values.std(ddof=1)) if len(values) > 1 else 0.0,
+              'min': float(values.min()),
+              'max': float(values.max())}
+    for (p, value) in zip(percentiles, np.percentile(values, percentiles)):
+        result[f'p{p}'] = float(value)
+    return result
+
+
+def drift(ids: np.ndarray, values: np.ndarray) -> float:
+    """
+    Slope of the least squares line through values, i.e. their change per measurement
+    """
+    if len(values) < 2:
+        return 0.0
+    x = ids.astype(np.float64)
+    y = values.astype(np.float64)
+    x -= x.mean()
+    denominator = np.dot(x, x)
+    return float(np.dot(x, y - y.mean()) / denominator) if denominator else 0.0
+
+
+def attack_windows(data: np.ndarray, threshold: float, min_length: int = 1, field: str = 'asymmetry') -> np.ndarray:
+    """
+    Runs of at least min_length consecutive measurements whose field exceeds threshold in magnitude.
+    Returns a structured array with the first and last id, the length and the peak of every run
+    """
+    result = np.empty(0, dtype=[('start', np.int64), ('end', np.int64), ('length', np.int64), ('peak', np.int64)])
+    if not len(data):
+        return result
+
+    values = data[field]
+    above = np.abs(values) > threshold
+    # run boundaries are where above changes, padded so that runs at the edges are closed
+    edges = np.flatnonzero(np.diff(np.concatenate(([False], above, [False])).astype(np.int8)))
+    (starts, ends) = (edges[0::2], edges[1::2])
+    if not len(starts):
+        return result
+
+    # NOTE: the segments of reduceat also contain the gap after every run, but values in the gaps are
+    # smaller in magnitude than any value of a run
+    high = np.maximum.reduceat(values, starts)
+    low = np.minimum.reduceat(values, starts)
+    peaks = np.where(high >= -low, high, low)
+
+    keep = ends - starts >= min_length
+    result = np.empty(np.count_nonzero(keep), dtype=result.dtype)
+    result['start'] = data['id'][starts[keep]]
+    result['end'] = data['id'][ends[keep] - 1]
+    result['length'] = (ends - starts)[keep]
+    result['peak'] = peaks[keep]
+    return result
+
+
+def summarize(data: np.ndarray, threshold: float = 1000, min_length: int = 3) -> dict:
+    """
+    Headless statistics of a log: the distributions of the asymmetry (slave) or the round trip (master),
+    the drift of offset and delay and the attack windows
+    """
+    if not is_slave(data):
+        return {'format': 'master', 'rt': distribution(data['rt']), 'rt_drift': drift(data['id'], data['rt'])}
+
+    return {'format': 'slave',
+            'asymmetry': distribution(data['asymmetry']),
+            'rt_m': distribution(data['rt_m']),
+            'rt_s': distribution(data['rt_s']),
+            'offset_drift': drift(data['id'], data['offset']),
+            'delay_drift': drift(data['id'], data['delay']),
+            'attack_windows': attack_windows(data, threshold, min_length)}
+
+
+def format_summary(path: str, summary: dict) -> str:
+    lines = [f"{path} ({summary['format']})"]
+    for (name, value) in summary.items():
+        if isinstance(value, dict):
+            lines.append(f"  {name}: " + ", ".join(f"{k}={v:.6g}" for (k, v) in value.items()))
+        elif isinstance(value, np.ndarray):
+            lines.append(f"  {name}: {len(value)}")
+            lines += [f"    id {w['start']}-{w['end']} ({w['length']} measurements), peak {w['peak']} ns" for w in value]
+        elif isinstance(value, float):
+            lines.append(f"  {name}: {value:.6g} ns per measurement")
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Statistics of ptpsec measurement logs")
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('--skip', type=int, default=0, help="measurements to drop at the start of every log")
+    parser.add_argument('--threshold', type=float, default=1000,
+                        help="asymmetry (ns) above which a measurement is part of an attack window")
+    parser.add_argument('--min-length', type=int, default=3,
+                        help="measurements an attack window has to span at least")
+    args = parser.parse_args(argv)
+
+    for path in args.files:
+        print(format_summary(path, summarize(load(path, args.skip), args.threshold, args.min_length)))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,226 @@
+"""
+Headless rendering of measurement logs to image files.
+
+The figures are the ones of plot.py, drawn without a display (matplotlib Figure objects, no pyplot), so
+the rendering works over SSH and in cron jobs. Every series is decimated to at most max_points points
+before it is drawn, either by keeping the minimum and maximum of equally sized buckets (minmax, keeps
+spikes) or with Largest-Triangle-Three-Buckets (lttb, keeps the shape). Many logs are rendered in
+parallel worker processes.
+
+Usage: python3 render.py [-h] [-o DIR] [--format png|svg ...] [--workers N] [--max-points N]
+                         [--method minmax|lttb] [--skip N] FILE_OR_DIR...
+"""
+
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import glob
+import os
+import sys
+
+import numpy as np
+from matplotlib.figure import Figure
+
+import capture
+import detection
+import measurements
+
+DEFAULT_MAX_POINTS = 2000
+LOG_PATTERNS = ('measurements*.txt', '*.bin')
+
+
+def _us(values: np.ndarray) -> np.ndarray:
+    return values / 10**3                   # ns -> us
+
+
+def _timestamp_us(values: np.ndarray) -> np.ndarray:
+    return values % 10**12 / 10**3          # Only keep interesting part (~1000s), ns -> us
+
+
+def minmax_indices(y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of the minimum and maximum of max_points / 2 equally sized buckets, plus the first and last
+    point, in ascending order
+    """
+    n = len(y)
+    if n <= max_points:
+        return np.arange(n)
+    size = -(-n // max(max_points // 2, 1))
+    full = n - n % size
+    buckets = y[:full].reshape(-1, size)
+    offsets = np.arange(0, full, size)
+    indices = [offsets + buckets.argmin(axis=1), offsets + buckets.argmax(axis=1), [0, n - 1]]
+    if full < n:
+        rest = y[full:]
+        indices.append([full + rest.argmin(), full + rest.argmax()])
+    return np.unique(np.concatenate(indices))
+
+
+def lttb_indices(x: np.ndarray, y: np.ndarray, max_points: int) -> np.ndarray:
+    """
+    Indices of the points selected by Largest-Triangle-Three-Buckets: the first and last point and from
+    every bucket in between the point that spans the largest triangle with the previously selected point
+    and the mean of the next bucket
+    """
+    n = len(y)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+
+    # max_points - 2 buckets between the first and the last point
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+    counts = np.diff(edges)
+    mean_x = np.add.reduceat(x[:-1], edges[:-1]) / counts
+    mean_y = np.add.reduceat(y[:-1], edges[:-1]) / counts
+    # the last bucket is followed by the last point
+    next_x = np.append(mean_x[1:], x[-1])
+    next_y = np.append(mean_y[1:], y[-1])
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(max_points - 2):
+        (lo, hi) = (edges[i], edges[i + 1])
+        area = np.abs((x[a] - next_x[i]) * (y[lo:hi] - y[a]) - (x[a] - x[lo:hi]) * (next_y[i] - y[a]))
+        a = lo + int(np.argmax(area))
+        selected[i + 1] = a
+    return selected
+
+
+def decimate(x: np.ndarray, y: np.ndarray, max_points: int, method: str = 'minmax') -> tuple[np.ndarray, np.ndarray]:
+    if method == 'lttb':
+        indices = lttb_indices(x, y, max_points)
+    elif method == 'minmax':
+        indices = minmax_indices(y, max_points)
+    else:
+        raise ValueError(f"unknown decimation method {method}")
+    return (x[indices], y[indices])
+
+
+def draw(fig: Figure, data: np.ndarray, max_points: int = DEFAULT_MAX_POINTS, method: str = 'minmax'):
+    """
+    Draws the columns of a log into fig: asymmetry, round trips, timestamps, offset and delay (slave) or
+    round trip and timestamps (master), in us. The asymmetry and offset of a slave are also drawn filtered
+    and changes of the asymmetry level are marked
+    """
+    time = data['id']
+    filtered = {}
+    changes = np.empty(0, dtype=np.int64)
+    if measurements.is_slave(data):
+        (plot_h, plot_w) = (3, 3)
+        series = [_us(data['asymmetry']), _us(data['rt_m']), _us(data['rt_s']),
+                  _timestamp_us(data['t1']), _timestamp_us(data['t2']), _timestamp_us(data['tm1']),
+                  _timestamp_us(data['tm2']), _us(data['offset']), _us(data['delay'])]
+        labels = ["Asymmetry", "RT Master", "RT Slave", "t1", "t2", "tm1", "tm2", "Offset", "Delay"]
+
+        asym = series[0]
+        filtered[0] = detection.savgol(detection.median_filter(asym, 5), 21)
+        filtered[7] = detection.median_filter(series[7], 5)
+        (baseline, noise) = detection.calibrate(asym[:100])
+        (upper, lower) = detection.cusum(detection.median_filter(asym, 5), baseline, noise)
+        (changes, _) = detection.change_points(np.maximum(upper, lower), 10)    # us
+    else:
+        (plot_h, plot_w) = (3, 2)
+        series = [_us(data['rt']), _timestamp_us(data['t1']), _timestamp_us(data['t2']),
+                  _timestamp_us(data['tm1']), _timestamp_us(data['tm2'])]
+        labels = ["RT Master", "t1", "t2", "tm1", "tm2"]
+
+    ax = fig.subplots(plot_h, plot_w, squeeze=False)
+    for (i, values) in enumerate(series):
+        axis = ax[i // plot_w, i % plot_w]
+        axis.plot(*decimate(time, values, max_points, method), label=labels[i])
+        if i in filtered:
+            axis.plot(*decimate(time, filtered[i], max_points, method), label=labels[i] + " (filtered)")
+        if i == 0:
+            for change in time[changes]:
+                axis.axvline(change, color='r', linestyle='--', linewidth=0.8)
+        axis.set_xlabel("Measurement Id")
+        axis.grid(True, 'major', 'y')
+        axis.legend()
+
+    fig.tight_layout(pad=0)
+    fig.subplots_adjust(left=0.05, bottom=0.05, right=0.95, top=0.95, wspace=0.25, hspace=0.45)
+
+
+def render(path: str, out_dir: str, formats=('png',), max_points: int = DEFAULT_MAX_POINTS,
+           method: str = 'minmax', skip: int = 0) -> list[str]:
+    """
+    Renders a text log or capture into out_dir, one file per format named after the log including its
+    extension (measurements.txt.png), so a log and its capture do not overwrite each other. Returns the
+    written files
+    """
+    data = capture.load(path)[skip:]
+    fig = Figure(figsize=(19.2, 10.8))
+    draw(fig, data, max_points, method)
+    fig.suptitle(os.path.basename(path))
+
+    name = os.path.basename(path)
+    written = []
+    for fmt in formats:
+        out_path = os.path.join(out_dir, f'{name}.{fmt}')
+        fig.savefig(out_path, format=fmt, dpi=100)
+        written.append(out_path)
+    return written
+
+
+def find_logs(paths) -> list[str]:
+    """
+    The given files and the logs and captures in the given directories
+    """
+    logs = []
+    for path in paths:
+        if os.path.isdir(path):
+            logs += sorted({f for pattern in LOG_PATTERNS for f in glob.glob(os.path.join(path, pattern))})
+        else:
+            logs.append(path)
+    return logs
+
+
+def _render(args: tuple) -> tuple[str, list[str], str]:
+    path = args[0]
+    try:
+        return (path, render(*args), None)
+    except (OSError, ValueError) as e:
+        return (path, [], str(e))
+
+
+def render_all(paths, out_dir: str, formats=('png',), workers: int = None, max_points: int = DEFAULT_MAX_POINTS,
+               method: str = 'minmax', skip: int = 0):
+    """
+    Renders all logs in parallel worker processes and yields (path, written files, error) per log
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    jobs = [(path, out_dir, tuple(formats), max_points, method, skip) for path in find_logs(paths)]
+    if workers == 1 or len(jobs) <= 1:
+        yield from map(_render, jobs)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        yield from executor.map(_render, jobs)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Render ptpsec measurement logs to image files")
+    parser.add_argument('paths', nargs='+', metavar='FILE_OR_DIR')
+    parser.add_argument('-o', '--output', default='plots', help="output directory")
+    parser.add_argument('--format', action='append', choices=['png', 'svg', 'pdf'],
+                        help="output format, repeatable (default png)")
+    parser.add_argument('--workers', type=int, default=None, help="worker processes (default: one per cpu)")
+    parser.add_argument('--max-points', type=int, default=DEFAULT_MAX_POINTS, help="points per drawn series")
+    parser.add_argument('--method', choices=['minmax', 'lttb'], default='minmax', help="decimation method")
+    parser.add_argument('--skip', type=int, default=0, help="measurements to drop at the start of every log")
+    args = parser.parse_args(argv)
+
+    failed = 0
+    for (path, written, error) in render_all(args.paths, args.output, args.format or ['png'], args.workers,
+                                             args.max_points, args.method, args.skip):
+        if error is not None:
+            failed += 1
+            print(f"{path}: {error}", file=sys.stderr)
+        else:
+            print(f"{path} -> {', '.join(written)}")
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,248 @@
+"""
+Statistics over measurement logs of any length with bounded memory.
+
+The log (text or capture, see capture.py) is read in chunks of fixed size and every chunk is folded into
+accumulators whose size does not depend on the number of measurements:
+    Moments          count, mean and variance (Welford/Chan), min and max
+    LogHistogram     quantiles with a bounded relative error, buckets grow logarithmically with the value
+    ThresholdCounter measurements above thresholds (in magnitude) and the number of crossings into them
+All accumulators can be merged, e.g. the results of several captures or of parallel workers.
+
+Usage: python3 stream_stats.py [-h] [--fields FIELD,...] [--threshold NS ...] [--chunk-rows N] FILE...
+"""
+
+import argparse
+import math
+import sys
+
+import numpy as np
+
+import capture
+import measurements
+
+
+class Moments:
+    """
+    Count, mean, variance, min and max, chunks are merged with the parallel variant of Welford's algorithm
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+    def _merge(self, count: int, mean: float, m2: float, low: float, high: float):
+        if not count:
+            return
+        total = self.count + count
+        delta = mean - self.mean
+        self.mean += delta * count / total
+        self.m2 += m2 + delta * delta * self.count * count / total
+        self.count = total
+        self.min = min(self.min, low)
+        self.max = max(self.max, high)
+
+    def update(self, values: np.ndarray):
+        if not len(values):
+            return
+        values = values.astype(np.float64)
+        mean = values.mean()
+        self._merge(len(values), float(mean), float(np.square(values - mean).sum()),
+                    float(values.min()), float(values.max()))
+
+    def merge(self, other: 'Moments'):
+        self._merge(other.count, other.mean, other.m2, other.min, other.max)
+
+    @property
+    def variance(self) -> float:
+        return self.m2 / (self.count - 1) if self.count > 1 else 0.0
+
+    @property
+    def std(self) -> float:
+        return math.sqrt(self.variance)
+
+
+class LogHistogram:
+    """
+    Histogram with buckets whose width is a fixed fraction of their value, so quantiles have a relative
+    error of at most relative_error over the whole int64 range with a few thousand buckets per sign
+    """
+
+    MAX_VALUE = 2.0 ** 63
+
+    def __init__(self, relative_error: float = 0.01):
+        self.relative_error = relative_error
+        self.gamma = (1 + relative_error) / (1 - relative_error)
+        self.log_gamma = math.log(self.gamma)
+        self.buckets = int(math.ceil(math.log(self.MAX_VALUE) / self.log_gamma)) + 1
+        self.positive = np.zeros(self.buckets, dtype=np.int64)
+        self.negative = np.zeros(self.buckets, dtype=np.int64)
+        # values with a magnitude below 1 (i.e. 0 for integers)
+        self.zero = 0
+
+    def _keys(self, magnitudes: np.ndarray) -> np.ndarray:
+        return np.ceil(np.log(magnitudes) / self.log_gamma).astype(np.int64)
+
+    def update(self, values: np.ndarray):
+        values = values.astype(np.float64)
+        magnitude = np.abs(values)
+        small = magnitude < 1
+        self.zero += int(np.count_nonzero(small))
+        for (counts, selected) in ((self.positive, (values > 0) & ~small), (self.negative, (values < 0) & ~small)):
+            counts += np.bincount(self._keys(magnitude[selected]), minlength=self.buckets)[:self.buckets]
+
+    def merge(self, other: 'LogHistogram'):
+        if other.relative_error != self.relative_error:
+            raise ValueError("histograms with different relative errors can not be merged")
+        self.positive += other.positive
+        self.negative += other.negative
+        self.zero += other.zero
+
+    @property
+    def count(self) -> int:
+        return int(self.positive.sum() + self.negative.sum()) + self.zero
+
+    def _value(self, key: int) -> float:
+        # the middle of bucket key in terms of relative error
+        return 2 * self.gamma ** key / (self.gamma + 1)
+
+    def quantiles(self, qs) -> list[float]:
+        """
+        Approximate q-quantiles (0 to 1) of all values
+        """
+        # values in ascending order: negative buckets from large to small magnitude, zero, positive buckets
+        counts = np.concatenate((self.negative[::-1], [self.zero], self.positive))
+        cumulative = np.cumsum(counts)
+        total = cumulative[-1] if len(cumulative) else 0
+        result = []
+        for q in qs:
+            if not total:
+                result.append(math.nan)
+                continue
+            i = int(np.searchsorted(cumulative, q * (total - 1), side='right'))
+            if i < self.buckets:
+                result.append(-self._value(self.buckets - 1 - i))
+            elif i == self.buckets:
+                result.append(0.0)
+            else:
+                result.append(self._value(i - self.buckets - 1))
+        return result
+
+
+class ThresholdCounter:
+    """
+    Number of values above every threshold (in magnitude) and number of crossings from below to above,
+    in the order of the chunks. The values start below, so a run above at the first value is a crossing
+    too. Merging assumes that the other counter covers the values after this one
+    """
+
+    def __init__(self, thresholds):
+        self.thresholds = np.asarray(sorted(thresholds), dtype=np.float64)
+        self.above = np.zeros(len(self.thresholds), dtype=np.int64)
+        self.crossings = np.zeros(len(self.thresholds), dtype=np.int64)
+        # whether the first and the last value seen were above every threshold, None without values
+        self.first: np.ndarray = None
+        self.last: np.ndarray = None
+
+    def _merge(self, above, crossings, first, last):
+        if first is None:
+            return
+        if self.last is None:
+            self.first = first
+        else:
+            # a run that continues from the values before was counted already
+            crossings = crossings - (self.last & first)
+        self.above += above
+        self.crossings += crossings
+        self.last = last
+
+    def update(self, values: np.ndarray):
+        if not len(values) or not len(self.thresholds):
+            return
+        # one row per threshold, one column per value
+        above = np.abs(values.astype(np.float64))[np.newaxis, :] > self.thresholds[:, np.newaxis]
+        crossings = np.count_nonzero(above[:, 1:] & ~above[:, :-1], axis=1) + above[:, 0]
+        self._merge(np.count_nonzero(above, axis=1), crossings, above[:, 0], above[:, -1])
+
+    def merge(self, other: 'ThresholdCounter'):
+        if not np.array_equal(other.thresholds, self.thresholds):
+            raise ValueError("counters with different thresholds can not be merged")
+        self._merge(other.above, other.crossings, other.first, other.last)
+
+
+class ColumnStats:
+    """
+    All accumulators of one column
+    """
+
+    QUANTILES = (0.01, 0.05, 0.25, 0.5, 0.75, 0.95, 0.99)
+
+    def __init__(self, thresholds=(), relative_error: float = 0.01):
+        self.moments = Moments()
+        self.histogram = LogHistogram(relative_error)
+        self.thresholds = ThresholdCounter(thresholds)
+
+    def update(self, values: np.ndarray):
+        self.moments.update(values)
+        self.histogram.update(values)
+        self.thresholds.update(values)
+
+    def merge(self, other: 'ColumnStats'):
+        self.moments.merge(other.moments)
+        self.histogram.merge(other.histogram)
+        self.thresholds.merge(other.thresholds)
+
+    def report(self) -> dict:
+        m = self.moments
+        result = {'count': m.count, 'mean': m.mean, 'std': m.std, 'min': m.min, 'max': m.max}
+        for (q, value) in zip(self.QUANTILES, self.histogram.quantiles(self.QUANTILES)):
+            result[f'p{round(q * 100)}'] = value
+        for (t, above, crossings) in zip(self.thresholds.thresholds, self.thresholds.above, self.thresholds.crossings):
+            result[f'>{t:g}'] = int(above)
+            result[f'crossings>{t:g}'] = int(crossings)
+        return result
+
+
+def stream_stats(path: str, fields=None, thresholds=(), chunk_rows: int = measurements.CHUNK_ROWS,
+                 skip: int = 0) -> dict[str, ColumnStats]:
+    """
+    Statistics of the given fields (all except id by default) of a text log or capture, read in chunks of
+    chunk_rows measurements. Thresholds are only counted for asymmetry and rt. The first skip
+    measurements are dropped
+    """
+    stats: dict[str, ColumnStats] = None
+    for chunk in capture.iter_chunks(path, chunk_rows):
+        if skip:
+            (chunk, skip) = (chunk[skip:], max(skip - len(chunk), 0))
+        if stats is None:
+            # NOTE: fields that the format of the log does not have are skipped
+            names = ([name for name in fields if name in chunk.dtype.names] if fields
+                     else [name for name in chunk.dtype.names if name != 'id'])
+            stats = {name: ColumnStats(thresholds if name in ('asymmetry', 'rt') else ()) for name in names}
+        for (name, column) in stats.items():
+            column.update(chunk[name])
+    return stats or {}
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Bounded memory statistics of ptpsec measurement logs")
+    parser.add_argument('files', nargs='+', metavar='FILE')
+    parser.add_argument('--fields', help="comma separated columns, all by default")
+    parser.add_argument('--threshold', type=float, action='append', default=[],
+                        help="count asymmetries (or master round trips) above this value (ns), repeatable")
+    parser.add_argument('--chunk-rows', type=int, default=measurements.CHUNK_ROWS)
+    parser.add_argument('--skip', type=int, default=0, help="measurements to drop at the start of every log")
+    args = parser.parse_args(argv)
+
+    fields = args.fields.split(',') if args.fields else None
+    for path in args.files:
+        print(path)
+        for (name, column) in stream_stats(path, fields, args.threshold, args.chunk_rows, args.skip).items():
+            print(f"  {name}: " + ", ".join(f"{k}={v:.6g}" for (k, v) in column.report().items()))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+"""
+Joined timeline of the master and the slave measurement logs of a detection clock pair.
+
+Every slave measurement is matched with a master measurement, either on equal keys (by default rt_m of
+the slave with rt of the master, the master round trip the slave used) or on the latest master timestamp
+at or before a slave timestamp (as-of). The ids of both logs are counted independently, so they do not
+identify the same cycle. Both logs may have dropped and reordered measurements. The joined table has
+the master columns prefixed with m_, the slave columns prefixed with s_ and the derived columns
+    asymmetry         m_rt - s_rt_s, the cyclic path asymmetry recomputed from the joined master round trip
+    asymmetry_error   asymmetry - s_asymmetry, nonzero if the slave used another master round trip
+    mean_rt           (m_rt + s_rt_s) / 2, the mean round trip of both cycles
+
+Usage: python3 timeline.py [-h] [--on MASTER_FIELD[:SLAVE_FIELD]] [--tolerance NS] [-o OUT.npy] MASTER SLAVE
+"""
+
+import argparse
+import sys
+
+import numpy as np
+
+import capture
+import measurements
+
+DERIVED = [('asymmetry', np.int64), ('asymmetry_error', np.int64), ('mean_rt', np.float64)]
+
+
+def match(master_keys: np.ndarray, slave_keys: np.ndarray, tolerance: int = None) -> np.ndarray:
+    """
+    Index of the matching master row of every slave row, -1 if there is none. Without tolerance the keys
+    have to be equal, otherwise the master key is the largest one at most tolerance before the slave key.
+    If a key occurs more than once, the last master row with it is taken
+    """
+    if not len(master_keys):
+        return np.full(len(slave_keys), -1, dtype=np.intp)
+
+    # NOTE: logs are mostly sorted already, sorting is skipped for them
+    if len(master_keys) > 1 and np.any(master_keys[1:] < master_keys[:-1]):
+        order = np.argsort(master_keys, kind='stable')
+        sorted_keys = master_keys[order]
+    else:
+        order = None
+        sorted_keys = master_keys
+
+    position = np.searchsorted(sorted_keys, slave_keys, side='right') - 1
+    clipped = np.maximum(position, 0)
+    found = position >= 0
+    if tolerance is None:
+        found &= sorted_keys[clipped] == slave_keys
+    else:
+        found &= slave_keys - sorted_keys[clipped] <= tolerance
+
+    index = clipped if order is None else order[clipped]
+    return np.where(found, index, -1)
+
+
+def join(master: np.ndarray, slave: np.ndarray, on=('rt', 'rt_m'), tolerance: int = None) -> np.ndarray:
+    """
+    Joined table of all slave measurements that have a matching master measurement, see match. on is the
+    pair (master field, slave field) that is matched
+    """
+    (master_field, slave_field) = on
+    index = match(master[master_field], slave[slave_field], tolerance)
+    matched = index >= 0
+    (m, s) = (master[index[matched]], slave[matched])
+
+    dtype = np.dtype([(f'm_{name}', master.dtype[name]) for name in master.dtype.names]
+                     + [(f's_{name}', slave.dtype[name]) for name in slave.dtype.names]
+                     + DERIVED)
+    result = np.empty(len(s), dtype=dtype)
+    for name in master.dtype.names:
+        result[f'm_{name}'] = m[name]
+    for name in slave.dtype.names:
+        result[f's_{name}'] = s[name]
+
+    result['asymmetry'] = m['rt'] - s['rt_s']
+    result['asymmetry_error'] = result['asymmetry'] - s['asymmetry']
+    result['mean_rt'] = (m['rt'] + s['rt_s']) / 2
+    return result
+
+
+def _split(on: str) -> tuple[str, str]:
+    (master_field, _, slave_field) = on.partition(':')
+    return (master_field, slave_field or master_field)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Join the master and slave measurement logs")
+    parser.add_argument('master_file')
+    parser.add_argument('slave_file')
+    parser.add_argument('--on', default='rt:rt_m', metavar='MASTER_FIELD[:SLAVE_FIELD]',
+                        help="fields that are matched (default rt:rt_m), e.g. tm2:t1 with --tolerance")
+    parser.add_argument('--tolerance', type=int, default=None,
+                        help="match the latest master value at most this far before the slave value")
+    parser.add_argument('-o', '--output', help="save the joined table as .npy")
+    args = parser.parse_args(argv)
+
+    master = capture.load(args.master_file)
+    slave = capture.load(args.slave_file)
+    if measurements.is_slave(master) or not measurements.is_slave(slave):
+        parser.error("expected a master log and a slave log")
+
+    joined = join(master, slave, _split(args.on), args.tolerance)
+    print(f"{len(joined)} of {len(slave)} slave measurements matched "
+          f"({len(master)} master measurements)")
+    for name in ('asymmetry', 'asymmetry_error', 'mean_rt'):
+        stats = measurements.distribution(joined[name])
+        print(f"  {name}: " + ", ".join(f"{k}={v:.6g}" for (k, v) in stats.items()))
+
+    if args.output:
+        np.save(args.output, joined)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,275 @@
+import heapq
+
+import networkx as nx
+
+INF = float('inf')
+
+
+class CompactGraph:
+    """
+    Adjacency lists of a graph whose nodes are mapped to consecutive integers. It is built once per
+    graph and can then be used for the paths of all (source, target) pairs
+    """
+
+    def __init__(self, G: nx.DiGraph, weight: str = 'delay'):
+        self.nodes: list = list(G.nodes)
+        self.index: dict = {n: i for (i, n) in enumerate(self.nodes)}
+
+        # adj[u] holds (v, cost) for every edge u -> v, edges without weight cost 1 like in networkx
+        self.adj: list[list[tuple[int, float]]] = [[] for _ in self.nodes]
+        for (u, v, cost) in G.edges(data=weight, default=1):
+            if u == v:
+                continue
+            # NOTE: negative delays are measurement errors and would break the reduced costs
+            self.adj[self.index[u]].append((self.index[v], max(cost, 0)))
+            if not G.is_directed():
+                self.adj[self.index[v]].append((self.index[u], max(cost, 0)))
+
+    @classmethod
+    def from_snapshot(cls, snapshot) -> 'CompactGraph':
+        """
+        Builds the adjacency lists from a GraphSnapshot instead of a networkx graph
+        """
+        G = cls.__new__(cls)
+        G.nodes = list(snapshot.nodes)
+        G.index = snapshot.index
+        (indptr, indices, delays) = (snapshot.indptr.tolist(), snapshot.indices.tolist(), snapshot.delays.tolist())
+        G.adj = [[(indices[e], max(delays[e], 0)) for e in range(indptr[u], indptr[u + 1]) if indices[e] != u]
+                 for u in range(len(G.nodes))]
+        return G
+
+    def __contains__(self, n) -> bool:
+        return n in self.index
+
+
+class _FlowNetwork:
+    """
+    Residual network for node-disjoint paths: the in node of u is 2u and its out node is 2u + 1, they
+    are connected by an arc of capacity 1. Arc a and its reverse arc a ^ 1 are stored next to each other.
+    Without t, the network can be reused for several targets of the same source (see set_target)
+    """
+
+    def __init__(self, G: CompactGraph, s, t=None, nodes: int = None):
+        if s not in G:
+            raise nx.NodeNotFound(f"source node {s} not in graph")
+        if t is not None and t not in G:
+            raise nx.NodeNotFound(f"target node {t} not in graph")
+
+        nodes = len(G.nodes) if nodes is None else nodes
+        self.G = G
+        self.si: int = G.index[s]
+        self.ti: int = None if t is None else G.index[t]
+
+        self.arcs_at: list[list[int]] = [[] for _ in range(2 * nodes)]
+        self.to: list[int] = []
+        self.cap: list[int] = []
+        self.cost: list[float] = []
+
+        for u in range(len(G.nodes)):
+            if u != self.si and u != self.ti:
+                self.add_arc(2 * u, 2 * u + 1, 0)
+        for u in range(len(G.nodes)):
+            if u == self.ti:
+                continue
+            for (v, c) in G.adj[u]:
+                if v != self.si:
+                    self.add_arc(2 * u + 1, 2 * v, c)
+
+        self.source: int = 2 * self.si + 1
+        self.sink: int = None if t is None else 2 * self.ti
+        self.potential: list[float] = [0.0] * (2 * nodes)
+        self.flow: int = 0
+
+    def add_arc(self, u: int, v: int, c: float, cap: int = 1):
+        self.arcs_at[u].append(len(self.to))
+        self.to.append(v)
+        self.cap.append(cap)
+        self.cost.append(c)
+        self.arcs_at[v].append(len(self.to))
+        self.to.append(u)
+        self.cap.append(0)
+        self.cost.append(-c)
+
+    def set_target(self, t, initial_cap: list[int]):
+        """
+        Removes all flow and makes t the sink. The arcs leaving t stay in the network, but an augmenting
+        path never uses them, because it would have to visit the in node of t twice
+        """
+        self.ti = self.G.index[t]
+        self.sink = 2 * self.ti
+        self.cap[:] = initial_cap
+        self.potential[:] = [0.0] * len(self.potential)
+        self.flow = 0
+
+    def shortest_paths(self, stop_at_sink: bool = True) -> tuple[list[float], list[int]]:
+        """
+        Dijkstra on the reduced costs, which are never negative thanks to the potentials.
+        Returns the distance of every node and the arc it is reached by
+        """
+        (arcs_at, to, cap, cost, potential) = (self.arcs_at, self.to, self.cap, self.cost, self.potential)
+        sink = self.sink if stop_at_sink else None
+
+        dist = [INF] * len(arcs_at)
+        via: list[int] = [-1] * len(arcs_at)
+        dist[self.source] = 0
+        queue = [(0, self.source)]
+        while queue:
+            (d, u) = heapq.heappop(queue)
+            if d > dist[u]:
+                continue
+            if u == sink:
+                break
+            for a in arcs_at[u]:
+                if cap[a] == 0:
+                    continue
+                v = to[a]
+                nd = d + cost[a] + potential[u] - potential[v]
+                if nd < dist[v]:
+                    dist[v] = nd
+                    via[v] = a
+                    heapq.heappush(queue, (nd, v))
+
+        return (dist, via)
+
+    def augment(self, k: int = None, tree: tuple[list[float], list[int]] = None):
+        """
+        Adds shortest augmenting paths until k units flow or the sink is not reachable anymore.
+        tree are the shortest paths of the network without flow, they are the same for all targets
+        """
+        (to, cap, potential) = (self.to, self.cap, self.potential)
+
+        while k is None or self.flow < k:
+            if tree is not None and self.flow == 0:
+                (dist, via) = tree
+            else:
+                (dist, via) = self.shortest_paths()
+
+            if dist[self.sink] == INF:
+                break
+
+            # nodes that were not settled are at least as far away as the sink
+            dist_sink = dist[self.sink]
+            for v in range(len(potential)):
+                potential[v] += min(dist[v], dist_sink)
+
+            v = self.sink
+            while v != self.source:
+                a = via[v]
+                cap[a] -= 1
+                cap[a ^ 1] += 1
+                v = to[a ^ 1]
+            self.flow += 1
+
+    def decompose(self) -> list[list[tuple[int, int, float]]]:
+        """
+        Splits the flow into paths, given as their (u, v, cost) hops. Used arcs of the original network
+        (even index) have less capacity left than they started with
+        """
+        (arcs_at, to, cap, cost) = (self.arcs_at, self.to, self.cap, self.cost)
+
+        def next_arc(x: int) -> int:
+            for b in arcs_at[x]:
+                if not b & 1 and cap[b ^ 1] > 0:
+                    # every unit of flow is only used by one path
+                    cap[b ^ 1] -= 1
+                    return b
+
+        hops = []
+        a = next_arc(self.source)
+        while a is not None:
+            path = []
+            u = self.si
+            while True:
+                v = to[a] // 2
+                path.append((u, v, cost[a]))
+                if v == self.ti:
+                    break
+                u = v
+                a = next_arc(2 * v + 1)
+            hops.append(path)
+            a = next_arc(self.source)
+        return hops
+
+
+def disjoint_paths(G: CompactGraph, s, t, k: int = None,
+                   max_delay_difference: float = None) -> list[tuple[float, list]]:
+    """
+    Computes node-disjoint paths from s to t with minimal total delay (Suurballe/Bhandari): As many
+    paths as possible are found, or at most k. Each node is split into an in and an out node connected
+    by an edge of capacity 1, then the shortest augmenting paths are added one after another.
+    Returns (delay, path) tuples ordered by delay. Paths whose delay exceeds the one of the shortest
+    path by more than max_delay_difference are dropped
+    """
+    network = _FlowNetwork(G, s, t)
+    network.augment(k)
+    return _paths_of(network, s, max_delay_difference)
+
+
+def disjoint_paths_from(G: CompactGraph, s, targets: list, k: int = None,
+                        max_delay_difference: float = None) -> dict:
+    """
+    Like disjoint_paths for every target in targets, but the flow network and the first shortest path
+    search are shared by all targets of the source s. Returns a map from target to its paths
+    """
+    network = _FlowNetwork(G, s)
+    initial_cap = list(network.cap)
+    tree = network.shortest_paths(stop_at_sink=False)
+
+    paths = {}
+    for t in targets:
+        if t not in G:
+            raise nx.NodeNotFound(f"target node {t} not in graph")
+        network.set_target(t, initial_cap)
+        network.augment(k, tree)
+        paths[t] = _paths_of(network, s, max_delay_difference)
+    return paths
+
+
+def _paths_of(network: _FlowNetwork, s, max_delay_difference: float) -> list[tuple[float, list]]:
+    paths = []
+    for hops in network.decompose():
+        paths.append((sum(c for (_, _, c) in hops), [s] + [network.G.nodes[v] for (_, v, _) in hops]))
+
+    paths.sort(key=lambda p: (p[0], len(p[1])))
+
+    if max_delay_difference is not None and paths:
+        paths = [p for p in paths if p[0] - paths[0][0] <= max_delay_difference]
+
+    return paths
+
+
+def recommend_links(G: CompactGraph, s, t, n: int, link_delay: float = 1) -> list[tuple[float, tuple]]:
+    """
+    Computes the fewest links (between nodes other than s and t) that have to be added so that there
+    are n node-disjoint paths from s to t, among those the ones with minimal total delay.
+    All candidate links are modelled at once by a hub node that every node can reach and that reaches
+    every node. Using the hub costs more than any path without it, so the min-cost flow only uses it
+    if the existing links do not suffice. Each new link is assumed to have a delay of link_delay.
+    Returns (delay of the new path, link) tuples ordered by delay
+    """
+    N = len(G.nodes)
+    network = _FlowNetwork(G, s, t, N + 1)
+
+    penalty = sum(c for adj in G.adj for (_, c) in adj) + n * link_delay + 1
+    hub = N
+    network.add_arc(2 * hub, 2 * hub + 1, 0, cap=n)
+    for u in range(N):
+        if u != network.si and u != network.ti:
+            network.add_arc(2 * u + 1, 2 * hub, 0)
+            network.add_arc(2 * hub + 1, 2 * u, penalty + link_delay)
+
+    network.augment(n)
+
+    recommendations = []
+    for hops in network.decompose():
+        links = [(G.nodes[u], G.nodes[w]) for ((u, v, _), (_, w, _)) in zip(hops, hops[1:]) if v == hub]
+        if links:
+            delay = sum(c for (_, _, c) in hops) - len(links) * penalty
+            recommendations.extend((delay, link) for link in links)
+
+    recommendations.sort(key=lambda r: r[0])
+    return recommendations
+
+
+def path_delay(G: nx.DiGraph, path: list, weight: str = 'delay') -> float:
+    return sum(max(G[u][v].get(weight, 1), 0) for (u, v) in zip(path, path[1:]))
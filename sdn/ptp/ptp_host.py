@@ -1,16 +1,57 @@
 from os_ken.lib import stringify
 
+import networkx as nx
+
+import util
+import logging
+logger = util.get_logger(__name__, logging.INFO, False)
+
 # TODO: both classes can be simplified because we now use PTP on L2 instead of UDP
 
-class PtpPath(stringify.StringifyMixin):
-    def __init__(self, path: list):
+class PtpPath:
+    """
+    A path from the master (first element) over switches to a slave (last element). The out ports of
+    every switch in both directions are resolved against the clock graph once when the path is built
+    """
+
+    __slots__ = ('path', 'fwd_ports', 'rev_ports')
+
+    def __init__(self, path: list, clock_graph: nx.DiGraph):
         self.path = path
-        # ipv4 identification number to next index in path and how the index changes (1 or -1)
-        self.id_to_idx: dict[int, (int, int)] = {}
+        # dpid -> out port towards the slave / towards the master
+        self.fwd_ports: dict[int, int] = {}
+        self.rev_ports: dict[int, int] = {}
+
+        for idx in range(1, len(path) - 1):
+            dpid = path[idx]
+            for (ports, next) in [(self.fwd_ports, path[idx + 1]), (self.rev_ports, path[idx - 1])]:
+                if not clock_graph.has_edge(dpid, next):
+                    logger.error(f"NO EDGE {dpid} -- {next}\n{util.nx_to_graphviz(clock_graph)}")
+                    continue
+                ports[dpid] = clock_graph[dpid][next]['ports'][dpid]
+
+    def out_port(self, dpid: int, from_master: bool) -> int:
+        return (self.fwd_ports if from_master else self.rev_ports).get(dpid, None)
+
+    def __repr__(self):
+        return f"PtpPath({self.path})"
 
 class PtpHost(stringify.StringifyMixin):
     def __init__(self, clockIdentity: int):
         self.clock_identity = clockIdentity
         self.mac_to_portid = {}
+        # all redundant paths to the master, main_path and meas_paths are taken from these
+        self.paths: list[list] = None
         self.meas_paths: list[PtpPath] = []
         self.main_path: PtpPath = None
+        # map from dpid to the measurement path that contains this switch
+        self.meas_path_at: dict[int, PtpPath] = {}
+
+    def set_paths(self, main_path: PtpPath, meas_paths: list[PtpPath]):
+        self.main_path = main_path
+        self.meas_paths = meas_paths
+
+        self.meas_path_at = {}
+        for p in meas_paths:
+            for dpid in p.path[1:-1]:
+                self.meas_path_at.setdefault(dpid, p)
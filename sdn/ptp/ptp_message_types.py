@@ -1,5 +1,5 @@
 from enum import Enum
-import bitstruct
+import struct
 
 from os_ken.lib import stringify
 
@@ -19,72 +19,94 @@ class MessageType(Enum):
     MEASUREMENT = 0x4
 
 
-class AnnounceMsg(stringify.StringifyMixin):
-    _PACK_STR = ">"     \
-                "u80"   \
-                "s16"   \
-                "r8"    \
-                "u8"    \
-                "u32"   \
-                "u8"    \
-                "u64"   \
-                "u16"   \
-                "u8"
-
-    def __init__(self, data: bytes):
-        (self.originTimeStamp,
-         self.currentUtcOffset,
-         _,  # reserved
-         self.grandmasterPriority1,
-         self.grandmasterClockQuality,
-         self.grandmasterPriority2,
-         self.grandmasterIdentity,
-         self.stepsRemoved,
-         self.timeSource) = bitstruct.unpack(AnnounceMsg._PACK_STR, data)
-
-class SyncMsg(stringify.StringifyMixin):
-    _PACK_STR = ">u80"
-
-    def __init__(self, data: bytes):
-        self.originTimestamp = bitstruct.unpack(SyncMsg._PACK_STR, data)[0]
-
-class DelayReqMsg(stringify.StringifyMixin):
-    _PACK_STR = ">u80"
-
-    def __init__(self, data: bytes):
-        self.originTimestamp = bitstruct.unpack(DelayReqMsg._PACK_STR, data)[0]
-
-class FollowUpMsg(stringify.StringifyMixin):
-    _PACK_STR = ">u80"
-
-    def __init__(self, data: bytes):
-        self.originTimestamp = bitstruct.unpack(FollowUpMsg._PACK_STR, data)[0]
-
-class DelayRespMsg(stringify.StringifyMixin):
-    _PACK_STR = ">"     \
-                "u80"   \
-                "u64"   \
-                "u16"
-
-    def __init__(self, data: bytes):
-        (self.receiveTimestamp,
-         self.requestingClockIdentity,
-         self.requestingPortNumber) = bitstruct.unpack(DelayRespMsg._PACK_STR, data)
+def _timestamp(seconds_hi: int, seconds_lo: int, nanoseconds: int) -> int:
+    # PTP timestamps are 80 bit wide (48 bit seconds, 32 bit nanoseconds) and are kept as one integer
+    return (((seconds_hi << 32) | seconds_lo) << 32) | nanoseconds
+
+def timestamp_to_ns(timestamp: int) -> int:
+    return (timestamp >> 32) * 1_000_000_000 + (timestamp & 0xFFFFFFFF)
+
+TIMESTAMP_FMT = ">HII"
+
+
+class PtpField:
+    """
+    A field of a PTP message that is decoded lazily. On first access the value is unpacked with a
+    precompiled struct layout at a fixed offset of the underlying buffer and then cached on the instance
+    """
+
+    def __init__(self, fmt: str, offset: int, convert=None):
+        self.struct = struct.Struct(fmt)
+        self.offset = offset
+        self.size = self.struct.size
+        self.convert = convert
+        self.name = None
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        if obj is None:
+            return self
+
+        values = self.struct.unpack_from(obj._buf, obj._offset + self.offset)
+        value = self.convert(*values) if self.convert is not None else values[0]
+
+        # instance attributes take precedence over this (non-data) descriptor, so we only decode once
+        obj.__dict__[self.name] = value
+        return value
+
+
+class PtpMessage(stringify.StringifyMixin):
+    """
+    Base class of all PTP messages. The message keeps a memoryview of the received data and only
+    decodes the fields (see PtpField) which are actually accessed
+    """
+
+    _opt_attributes = []
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # list the lazy fields so that they still show up in the str representation
+        cls._opt_attributes = cls._opt_attributes + [k for k, v in vars(cls).items()
+                                                     if isinstance(v, PtpField)]
+
+    def __init__(self, data, offset: int = 0):
+        self._buf = data if isinstance(data, memoryview) else memoryview(data)
+        self._offset = offset
+
+
+class AnnounceMsg(PtpMessage):
+    originTimeStamp = PtpField(TIMESTAMP_FMT, 0, _timestamp)
+    currentUtcOffset = PtpField(">h", 10)
+    # 1 byte reserved
+    grandmasterPriority1 = PtpField(">B", 13)
+    grandmasterClockQuality = PtpField(">I", 14)
+    grandmasterPriority2 = PtpField(">B", 18)
+    grandmasterIdentity = PtpField(">Q", 19)
+    stepsRemoved = PtpField(">H", 27)
+    timeSource = PtpField(">B", 29)
+
+class SyncMsg(PtpMessage):
+    originTimestamp = PtpField(TIMESTAMP_FMT, 0, _timestamp)
+
+class DelayReqMsg(PtpMessage):
+    originTimestamp = PtpField(TIMESTAMP_FMT, 0, _timestamp)
+
+class FollowUpMsg(PtpMessage):
+    originTimestamp = PtpField(TIMESTAMP_FMT, 0, _timestamp)
+
+class DelayRespMsg(PtpMessage):
+    receiveTimestamp = PtpField(TIMESTAMP_FMT, 0, _timestamp)
+    requestingClockIdentity = PtpField(">Q", 10)
+    requestingPortNumber = PtpField(">H", 18)
 
 class MeasurementType(Enum):
     MEAS_MEASUREMENT = 0
     MEAS_FOLLOW_UP = 1
     MEAS_TRANSPORT = 2
 
-class MeasurementMsg(stringify.StringifyMixin):
-    _PACK_STR = ">"     \
-                "u80"   \
-                "u64"   \
-                "u16"
-
-    def __init__(self, data: bytes):
-        (self.timestamp,
-         self.targetClockIdentity,
-         self.measType) = bitstruct.unpack(MeasurementMsg._PACK_STR, data)
-
-        self.measType = MeasurementType(self.measType)
+class MeasurementMsg(PtpMessage):
+    timestamp = PtpField(TIMESTAMP_FMT, 0, _timestamp)
+    targetClockIdentity = PtpField(">Q", 10)
+    measType = PtpField(">H", 18, MeasurementType)
@@ -1,26 +1,28 @@
-import bitstruct
-from os_ken.lib import stringify
+from functools import cached_property
 
-from ptp.ptp_message_types import MessageType, SyncMsg, DelayReqMsg, FollowUpMsg, DelayRespMsg, AnnounceMsg, MeasurementMsg
+from ptp.ptp_message_types import PtpField, PtpMessage, MessageType, SyncMsg, DelayReqMsg, FollowUpMsg, DelayRespMsg, AnnounceMsg, MeasurementMsg
 
 
-class PtpPacket(stringify.StringifyMixin):
-    _PACK_STR = ">"     \
-                "u4"    \
-                "u4"    \
-                "u4"    \
-                "u4"    \
-                "u16"   \
-                "u8"    \
-                "u8"    \
-                "r16"   \
-                "s64"   \
-                "r32"   \
-                "u64"   \
-                "u16"   \
-                "u16"   \
-                "u8"    \
-                "s8"
+class PtpPacket(PtpMessage):
+    HEADER_LENGTH = 34
+
+    majorSdoId = PtpField(">B", 0, lambda b: b >> 4)
+    messageType = PtpField(">B", 0, lambda b: MessageType(b & 0x0F))
+    minorVersionPTP = PtpField(">B", 1, lambda b: b >> 4)
+    versionPTP = PtpField(">B", 1, lambda b: b & 0x0F)
+    messageLength = PtpField(">H", 2)
+    domainNumber = PtpField(">B", 4)
+    minorSdoId = PtpField(">B", 5)
+    flagField = PtpField(">2s", 6)
+    correctionField = PtpField(">q", 8)
+    messageTypeSpecific = PtpField(">4s", 16)
+    sourceClockIdentity = PtpField(">Q", 20)
+    sourcePortNumber = PtpField(">H", 28)
+    sequenceId = PtpField(">H", 30)
+    controlField = PtpField(">B", 32)
+    logMessageInterval = PtpField(">b", 33)
+
+    _opt_attributes = ['msg']
 
     SUPPORTED_MSG_TYPES = {MessageType.SYNC: SyncMsg,
                            MessageType.DELAY_REQ: DelayReqMsg,
@@ -29,28 +31,10 @@ class PtpPacket(stringify.StringifyMixin):
                            MessageType.ANNOUNCE: AnnounceMsg,
                            MessageType.MEASUREMENT: MeasurementMsg}
 
-    def __init__(self, data: bytes):
-        (self.majorSdoId,
-         messageType,
-         self.minorVersionPTP,
-         self.versionPTP,
-         self.messageLength,
-         self.domainNumber,
-         self.minorSdoId,
-         self.flagField,
-         self.correctionField,
-         self.messageTypeSpecific,
-         self.sourceClockIdentity,
-         self.sourcePortNumber,
-         self.sequenceId,
-         self.controlField,
-         self.logMessageInterval) = bitstruct.unpack(PtpPacket._PACK_STR, data)
-
-        self.messageType = MessageType(messageType)
-
-        data = data[34:]
-
-        self.msg = None
-
-        if self.messageType in PtpPacket.SUPPORTED_MSG_TYPES:
-            self.msg = PtpPacket.SUPPORTED_MSG_TYPES[self.messageType](data)
+    @cached_property
+    def msg(self) -> PtpMessage:
+        # the body shares the buffer of the header, it is only decoded if it is accessed
+        msg_cls = PtpPacket.SUPPORTED_MSG_TYPES.get(self.messageType, None)
+        if msg_cls is None:
+            return None
+        return msg_cls(self._buf, self._offset + PtpPacket.HEADER_LENGTH)
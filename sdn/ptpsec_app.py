@@ -1,24 +1,40 @@
 from os_ken.base import app_manager
+from os_ken.controller import ofp_event
+from os_ken.controller.handler import MAIN_DISPATCHER, set_ev_cls
+from os_ken.ofproto import ofproto_v1_3
 
 from sdn_controllers.topology_data import TopologyData
+from sdn_controllers.flow_manager import FlowManager
 from sdn_controllers.delay_monitor import DelayMonitor
 from sdn_controllers.regular_switch import RegularSwitch
 from sdn_controllers.ptpsec_controller import PTPSecController
+from sdn_controllers.packet_in import ParsedPacket, EventPacketIn
 
 class PTPSecApp(app_manager.OSKenApp):
     _CONTEXTS = {
         'topology_data': TopologyData,
+        'flow_manager': FlowManager,
         'delay_monitor': DelayMonitor,
         'regular_switch': RegularSwitch,
         'ptpsec_controller': PTPSecController,
     }
 
+    # packet-ins are parsed once here and then published to the other apps
+    _EVENTS = [EventPacketIn]
+
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
     def __init__(self, *args, **kwargs):
         super(PTPSecApp, self).__init__(*args, **kwargs)
         self.name = 'ptpsec_app'
 
         # External Apps - Load order: start TopologyData first since the other apps depend on it:
         self.topology_data: TopologyData = kwargs['topology_data']
+        self.flow_manager: FlowManager = kwargs['flow_manager']
         self.delay_monitor: DelayMonitor = kwargs['delay_monitor']
         self.regular_switch: RegularSwitch = kwargs['regular_switch']
         self.ptpsec_controller: PTPSecController = kwargs['ptpsec_controller']
+
+    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
+    def _packet_in_handler(self, ev):
+        self.send_event_to_observers(EventPacketIn(ParsedPacket(ev.msg)), MAIN_DISPATCHER)
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""
+Offline redundancy audit: computes the disjoint paths, their delay asymmetry and the links that should be
+added for every (grandmaster, slave) pair of a topology, without starting a controller.
+
+Usage: ./redundancy_audit.py [topology] [-n paths] [-o report.json]
+"""
+
+import argparse
+import json
+import re
+import sys
+from collections import Counter
+from typing import Callable
+
+import networkx as nx
+
+from disjoint_paths import CompactGraph, disjoint_paths_from, recommend_links, path_delay
+from settings import REQUIRED_REDUNDANT_PATHS, MAX_PATH_DELAY_DIFFERENCE
+
+
+class _TopologyRecorder:
+    """
+    Stands in for the Mininet object passed to the topologies of topologies.py and records the graph
+    that TopologyData would build for it, with link delays in ms
+    """
+
+    DEFAULT_DELAY = 1
+
+    def __init__(self):
+        self.graph: nx.DiGraph = nx.DiGraph()
+
+    def addHost(self, name: str, **kwargs) -> str:
+        self.graph.add_node(name, is_switch=False)
+        return name
+
+    def addSwitch(self, name: str, **kwargs) -> str:
+        self.graph.add_node(name, is_switch=True)
+        return name
+
+    def addLink(self, node1: str, node2: str, params1: dict = None, params2: dict = None, **kwargs):
+        # the delay of an interface applies to the packets it sends
+        self.graph.add_edge(node1, node2, delay=self._delay(params1))
+        self.graph.add_edge(node2, node1, delay=self._delay(params2))
+
+    def _delay(self, params: dict) -> float:
+        if not params or 'delay' not in params:
+            return self.DEFAULT_DELAY
+
+        m = re.fullmatch(r"([0-9.]+)\s*(us|ms|s)?", str(params['delay']))
+        if not m:
+            raise ValueError(f"invalid delay {params['delay']}")
+        return float(m.group(1)) * {'us': 1e-3, 'ms': 1, 's': 1e3}[m.group(2) or 'us']
+
+
+def topology_graph(topo: Callable) -> nx.DiGraph:
+    """
+    Builds the graph of a topology function of topologies.py (e.g. topologies.eval_topo)
+    """
+    recorder = _TopologyRecorder()
+    topo(recorder)
+    return recorder.graph
+
+
+def _path_report(G: nx.DiGraph, delay: float, path: list) -> dict:
+    # half of the difference between both directions is the offset error ptp makes on this path
+    reverse = path[::-1]
+    asymmetry = None
+    if all(G.has_edge(u, v) for (u, v) in zip(reverse, reverse[1:])):
+        asymmetry = (delay - path_delay(G, reverse)) / 2
+    return {'path': path, 'delay': delay, 'asymmetry': asymmetry}
+
+
+def audit(G: nx.DiGraph, grandmasters: list = None, slaves: list = None, n: int = REQUIRED_REDUNDANT_PATHS,
+          max_delay_difference: float = MAX_PATH_DELAY_DIFFERENCE) -> dict:
+    """
+    Audits all (grandmaster, slave) pairs of G, which can be TopologyData.graph, the clock graph of the
+    PTPSecController (ptp clocks with several ports merged into one node) or the result of
+    topology_graph. By default every host is a candidate grandmaster and slave.
+    All slaves of a grandmaster share one flow network and shortest path tree.
+    Returns a json serializable report
+    """
+    hosts = [node for (node, is_switch) in G.nodes(data='is_switch', default=False) if not is_switch]
+    grandmasters = hosts if grandmasters is None else grandmasters
+    slaves = hosts if slaves is None else slaves
+
+    compact = CompactGraph(G)
+    pairs = []
+    link_counts = Counter()
+    for gm in grandmasters:
+        targets = [slave for slave in slaves if slave != gm]
+        for (slave, paths) in disjoint_paths_from(compact, gm, targets,
+                                                  max_delay_difference=max_delay_difference).items():
+            path_reports = [_path_report(G, delay, path) for (delay, path) in paths]
+            asymmetries = [p['asymmetry'] for p in path_reports if p['asymmetry'] is not None]
+
+            recommendations = []
+            if len(paths) < n:
+                recommendations = [{'link': list(link), 'delay': delay}
+                                   for (delay, link) in recommend_links(compact, gm, slave, n)]
+                link_counts.update(tuple(r['link']) for r in recommendations)
+
+            pairs.append({
+                'grandmaster': gm,
+                'slave': slave,
+                'disjoint_paths': len(paths),
+                'sufficient': len(paths) >= n,
+                'paths': path_reports,
+                'delay_spread': paths[-1][0] - paths[0][0] if paths else None,
+                'asymmetry_bounds': [min(asymmetries), max(asymmetries)] if asymmetries else None,
+                'recommended_links': recommendations,
+            })
+
+    return {
+        'required_paths': n,
+        'pairs': pairs,
+        'summary': {
+            'pairs': len(pairs),
+            'insufficient_pairs': sum(not p['sufficient'] for p in pairs),
+            # links that are recommended for many pairs help the most
+            'recommended_links': [{'link': list(link), 'pairs': count}
+                                  for (link, count) in link_counts.most_common()],
+        },
+    }
+
+
+if '__main__' == __name__:
+    parser = argparse.ArgumentParser(description="Audits the path redundancy of a topology of topologies.py")
+    parser.add_argument('topology', nargs='?', default='A')
+    parser.add_argument('-n', type=int, default=REQUIRED_REDUNDANT_PATHS, help="required redundant paths")
+    parser.add_argument('-o', '--output', help="report file, default is stdout")
+    args = parser.parse_args()
+
+    from topologies import topos
+
+    if args.topology not in topos:
+        sys.exit(f"{args.topology} is an invalid topology name, valid names are {list(topos)}")
+
+    report = audit(topology_graph(topos[args.topology]), n=args.n)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        print()
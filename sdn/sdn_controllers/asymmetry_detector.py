@@ -0,0 +1,219 @@
+from collections import OrderedDict, deque
+from typing import Callable
+import math
+
+from os_ken.controller.event import EventBase
+
+from ptp.ptp_packet import PtpPacket
+from ptp.ptp_message_types import MessageType, MeasurementType, timestamp_to_ns
+
+import util
+import logging
+logger = util.get_logger(__name__, logging.INFO, False)
+
+
+class EventAsymmetryAlarm(EventBase):
+    """
+    Published by PTPSecController when a measurement of a (master, slave, path) deviates from its
+    history (active) and when it is back to normal (not active)
+    """
+
+    def __init__(self, master: int, slave: int, path: tuple, quantity: str, value_ns: float,
+                 baseline_ns: float, active: bool):
+        super(EventAsymmetryAlarm, self).__init__()
+        self.master = master
+        self.slave = slave
+        self.path = path
+        self.quantity = quantity
+        self.value_ns = value_ns
+        self.baseline_ns = baseline_ns
+        self.active = active
+
+
+class StreamingWindow:
+    """
+    The last size samples together with their running sum and sum of squares, so that adding a sample
+    and reading the mean and standard deviation are O(1)
+    """
+
+    __slots__ = ('samples', 'sum', 'sum_sq')
+
+    def __init__(self, size: int):
+        self.samples: deque[float] = deque(maxlen=size)
+        self.sum: float = 0.0
+        self.sum_sq: float = 0.0
+
+    def __len__(self) -> int:
+        return len(self.samples)
+
+    def add(self, x: float):
+        if len(self.samples) == self.samples.maxlen:
+            old = self.samples[0]
+            self.sum -= old
+            self.sum_sq -= old * old
+        self.samples.append(x)
+        self.sum += x
+        self.sum_sq += x * x
+
+    @property
+    def mean(self) -> float:
+        return self.sum / len(self.samples)
+
+    @property
+    def std(self) -> float:
+        n = len(self.samples)
+        if n < 2:
+            return 0.0
+        # NOTE: the running sums can make the variance slightly negative
+        return math.sqrt(max(self.sum_sq - self.sum * self.sum / n, 0.0) / (n - 1))
+
+
+class _PathState:
+
+    __slots__ = ('windows', 'alarms', 'streaks', 'outliers')
+
+    def __init__(self, size: int):
+        self.windows: dict[str, StreamingWindow] = {q: StreamingWindow(size) for q in AsymmetryDetector.QUANTITIES}
+        self.alarms: set[str] = set()
+        # number of consecutive deviating samples and the last of them
+        self.streaks: dict[str, int] = {q: 0 for q in AsymmetryDetector.QUANTITIES}
+        self.outliers: dict[str, deque[float]] = {q: deque(maxlen=size) for q in AsymmetryDetector.QUANTITIES}
+
+
+class AsymmetryDetector:
+    """
+    Checks the ptpsec round trip measurements while they pass through the controller. A measurement
+    cycle of sequence id n consists of
+     - the follow up of sync n from the master: t1
+     - the measurement message of the slave over its measurement path: t2' (t2 corrected by the slave)
+     - the transport message of the master over the measurement path: rt = (t2' - t1) + (tm2' - tm1'),
+       i.e. the round trip over the main path to the slave and the measurement path back
+    From these, the round trip, its forward half t2' - t1 and its backward half rt - (t2' - t1) are
+    compared to the last window samples of the same (master, slave, path). A delay attack on any of
+    the paths shifts at least one of them, as the slave corrects its clock by half of the asymmetry of
+    the main path. The round trip of the slave itself is only known to the slave.
+    If a quantity deviates for rebaseline cycles in a row, the change is taken as the new normal (e.g. a
+    rerouted link) and the window is rebuilt from the deviating samples
+    """
+
+    QUANTITIES = ('round_trip', 'forward', 'backward')
+
+    # samples needed before a window is used as baseline
+    MIN_SAMPLES = 8
+    # deviations must exceed this many standard deviations of the window (and threshold_ns)
+    SIGMAS = 4
+    # incomplete cycles that are kept, e.g. if a message was lost
+    MAX_PENDING = 1024
+
+    def __init__(self, window: int, threshold_ns: float, rebaseline: int = None,
+                 on_alarm: Callable[[EventAsymmetryAlarm], None] = None):
+        self.window = window
+        self.threshold_ns = threshold_ns
+        self.rebaseline = rebaseline
+        self.on_alarm = on_alarm
+
+        # (master, sequence id) -> t1
+        self.sync_times: OrderedDict[tuple, int] = OrderedDict()
+        # (master, slave, path, sequence id) -> [t2', rt]
+        self.pending: OrderedDict[tuple, list] = OrderedDict()
+        self.paths: dict[tuple, _PathState] = {}
+
+    @staticmethod
+    def _put(d: OrderedDict, key, value):
+        d[key] = value
+        if len(d) > AsymmetryDetector.MAX_PENDING:
+            d.popitem(last=False)
+
+    def observe(self, ptp_pkt: PtpPacket, master: int, slave: int = None, path: tuple = None):
+        """
+        Takes the timestamps of a follow up of the master, a measurement of a slave or a transport
+        message of the master to a slave. path identifies the main and measurement path of the slave
+        """
+        seq = ptp_pkt.sequenceId
+        if ptp_pkt.messageType == MessageType.FOLLOW_UP:
+            self._put(self.sync_times, (master, seq), timestamp_to_ns(ptp_pkt.msg.originTimestamp))
+            return
+
+        if ptp_pkt.messageType != MessageType.MEASUREMENT:
+            return
+
+        meas_type = ptp_pkt.msg.measType
+        key = (master, slave, path, seq)
+        cycle = self.pending.get(key, None)
+        if cycle is None:
+            cycle = [None, None]
+            self._put(self.pending, key, cycle)
+
+        # NOTE: the correctionField of a measurement only holds the port asymmetry of the sender, the
+        # receiver replaces it by its own and applies it to its ingress timestamp tm2, which is not part of
+        # the quantities here. t2' already includes the corrections of sync and follow up
+        if meas_type == MeasurementType.MEAS_MEASUREMENT:
+            cycle[0] = timestamp_to_ns(ptp_pkt.msg.timestamp)
+        elif meas_type == MeasurementType.MEAS_TRANSPORT:
+            cycle[1] = timestamp_to_ns(ptp_pkt.msg.timestamp)
+        else:
+            return
+
+        t1 = self.sync_times.get((master, seq), None)
+        if None in cycle or t1 is None:
+            return
+
+        del self.pending[key]
+        (t2, rt) = cycle
+        self.add_cycle(master, slave, path, rt, t2 - t1)
+
+    def add_cycle(self, master: int, slave: int, path: tuple, round_trip: float, forward: float):
+        state = self.paths.get((master, slave, path), None)
+        if state is None:
+            state = _PathState(self.window)
+            self.paths[(master, slave, path)] = state
+
+        values = {'round_trip': round_trip, 'forward': forward, 'backward': round_trip - forward}
+        for (quantity, value) in values.items():
+            window = state.windows[quantity]
+            deviating = (len(window) >= self.MIN_SAMPLES
+                         and abs(value - window.mean) > max(self.threshold_ns, self.SIGMAS * window.std))
+
+            # NOTE: deviating samples are kept out of the baseline, so that the alarm lasts as long as the attack,
+            # unless it lasts long enough to be the new normal
+            if deviating:
+                state.streaks[quantity] += 1
+                state.outliers[quantity].append(value)
+                if self.rebaseline is not None and state.streaks[quantity] >= self.rebaseline:
+                    window = self._rebaseline(master, slave, path, quantity, state)
+                    deviating = False
+            else:
+                state.streaks[quantity] = 0
+                state.outliers[quantity].clear()
+                window.add(value)
+
+            if deviating != (quantity in state.alarms):
+                state.alarms.symmetric_difference_update({quantity})
+                self._alarm(EventAsymmetryAlarm(master, slave, path, quantity, value, window.mean, deviating))
+
+    def _rebaseline(self, master: int, slave: int, path: tuple, quantity: str, state: _PathState) -> StreamingWindow:
+        window = StreamingWindow(self.window)
+        for value in state.outliers[quantity]:
+            window.add(value)
+        logger.warning(f"{quantity} between master {master} and slave {slave} over {path} deviated for "
+                       f"{state.streaks[quantity]} cycles, {window.mean:.0f} ns is the new baseline")
+        state.windows[quantity] = window
+        state.streaks[quantity] = 0
+        state.outliers[quantity].clear()
+        return window
+
+    def _alarm(self, alarm: EventAsymmetryAlarm):
+        if alarm.active:
+            logger.warning(f"{alarm.quantity} between master {alarm.master} and slave {alarm.slave} over "
+                           f"{alarm.path} deviates: {alarm.value_ns:.0f} ns instead of {alarm.baseline_ns:.0f} ns")
+        else:
+            logger.info(f"{alarm.quantity} between master {alarm.master} and slave {alarm.slave} is back to normal")
+        if self.on_alarm is not None:
+            self.on_alarm(alarm)
+
+    def forget(self, slave: int):
+        """
+        Drops the history of a slave, e.g. because its paths changed
+        """
+        for key in [key for key in self.paths if key[1] == slave]:
+            del self.paths[key]
@@ -0,0 +1,167 @@
+import networkx as nx
+
+from sdn_controllers.topology_data import TopologyDelta
+from sdn_controllers.graph_snapshot import GraphSnapshot
+
+import util
+import logging
+logger = util.get_logger(__name__, logging.INFO, False)
+
+
+class ClockGraphChanges:
+    """
+    Summary of the changes of the clock graph since the consumer last looked at it
+    """
+
+    __slots__ = ('rebuilt', 'grown', 'removed_nodes', 'added_edges', 'removed_edges', 'updated_edges')
+
+    def __init__(self):
+        # the whole graph was replaced, nothing of the previous state can be trusted
+        self.rebuilt: bool = False
+        # nodes or edges were added
+        self.grown: bool = False
+        self.removed_nodes: set = set()
+        self.added_edges: set[tuple] = set()
+        self.removed_edges: set[tuple] = set()
+        # edges whose delay or ports changed, with their delay before the first change
+        self.updated_edges: dict[tuple, float] = {}
+
+    def __bool__(self):
+        return (self.rebuilt or self.grown or bool(self.removed_nodes) or bool(self.removed_edges)
+                or bool(self.updated_edges))
+
+
+class ClockGraph:
+    """
+    Maintains the clock graph, i.e. the topology graph in which all mac addresses of a ptp clock are
+    merged into a single node labeled with the clock identity.
+    Instead of relabeling the whole topology graph, only the nodes that are affected by a topology
+    delta or by a newly learned mac address are synchronized with the topology graph
+    """
+
+    def __init__(self):
+        # the graph is only ever updated in place so that references to it stay valid
+        self.graph: nx.DiGraph = nx.DiGraph()
+
+        self.mac_to_clockid: dict[str, int] = {}
+        self.clockid_to_macs: dict[int, set[str]] = {}
+
+        # version of the topology graph this clock graph corresponds to
+        self.version: int = 0
+
+        self.changes: ClockGraphChanges = ClockGraphChanges()
+
+        # array copy of the graph, dropped whenever the graph changes
+        self._snapshot: GraphSnapshot = None
+        self._modifications: int = 0
+
+    def pop_changes(self) -> ClockGraphChanges:
+        changes, self.changes = self.changes, ClockGraphChanges()
+        return changes
+
+    def snapshot(self) -> GraphSnapshot:
+        """
+        Read-only array copy of the clock graph, it is only rebuilt if the graph changed
+        """
+        if self._snapshot is None or self._snapshot.version != self._modifications:
+            self._snapshot = GraphSnapshot(self.graph, self._modifications, self.mac_to_clockid)
+        return self._snapshot
+
+    def label(self, n):
+        return self.mac_to_clockid.get(n, n)
+
+    def _members(self, label) -> set:
+        # all nodes of the topology graph that are merged into this node of the clock graph
+        if label in self.clockid_to_macs:
+            return self.clockid_to_macs[label]
+        if label in self.mac_to_clockid:
+            return set()
+        return {label}
+
+    def set_clock(self, mac: str, clock_id: int, topology: nx.DiGraph):
+        """
+        Merges the node of mac into the node of clock_id
+        """
+        old_label = self.label(mac)
+        if old_label == clock_id:
+            return
+
+        if mac in self.mac_to_clockid:
+            self.clockid_to_macs[old_label].discard(mac)
+        self.mac_to_clockid[mac] = clock_id
+        self.clockid_to_macs.setdefault(clock_id, set()).add(mac)
+
+        self.sync_node(old_label, topology)
+        self.sync_node(clock_id, topology)
+
+    def sync_node(self, label, topology: nx.DiGraph):
+        """
+        Recomputes the node label and all of its edges from the topology graph
+        """
+        self._modifications += 1
+        old_edges = {}
+        existed = label in self.graph
+        if existed:
+            old_edges.update((((label, v), attrs) for (_, v, attrs) in self.graph.out_edges(label, data=True)))
+            old_edges.update((((u, label), attrs) for (u, _, attrs) in self.graph.in_edges(label, data=True)))
+            self.graph.remove_node(label)
+
+        members = [n for n in self._members(label) if n in topology]
+        if not members:
+            if existed:
+                self.changes.removed_nodes.add(label)
+            self.changes.removed_edges.update(old_edges)
+            return
+
+        for n in members:
+            self.graph.add_node(label, **topology.nodes[n])
+
+        for n in members:
+            for (_, v, attrs) in topology.out_edges(n, data=True):
+                self.graph.add_edge(label, self.label(v), **attrs)
+            for (u, _, attrs) in topology.in_edges(n, data=True):
+                self.graph.add_edge(self.label(u), label, **attrs)
+
+        self._record_edge_changes(label, existed, old_edges)
+
+    def _record_edge_changes(self, label, existed: bool, old_edges: dict):
+        new_edges = {}
+        new_edges.update((((label, v), attrs) for (_, v, attrs) in self.graph.out_edges(label, data=True)))
+        new_edges.update((((u, label), attrs) for (u, _, attrs) in self.graph.in_edges(label, data=True)))
+
+        for (edge, attrs) in old_edges.items():
+            if edge not in new_edges:
+                self.changes.removed_edges.add(edge)
+            elif new_edges[edge] != attrs:
+                self.changes.updated_edges.setdefault(edge, attrs.get('delay', 1))
+
+        added = [edge for edge in new_edges if edge not in old_edges]
+        self.changes.added_edges.update(added)
+        if not existed or added:
+            self.changes.grown = True
+
+    def apply_deltas(self, deltas: list[TopologyDelta], topology: nx.DiGraph):
+        labels = set()
+        for delta in deltas:
+            # an edge is restored completely by synchronizing either of its nodes
+            labels.add(self.label(delta.u))
+
+        for label in labels:
+            self.sync_node(label, topology)
+
+        if deltas:
+            self.version = deltas[-1].version
+
+    def rebuild(self, topology: nx.DiGraph, version: int):
+        self.changes.rebuilt = True
+        self._modifications += 1
+        self.graph.clear()
+        self.graph.add_nodes_from(topology.nodes(data=True))
+        self.graph.add_edges_from(topology.edges(data=True))
+        for label in self.clockid_to_macs:
+            for mac in self.clockid_to_macs[label]:
+                if mac in self.graph:
+                    self.graph.remove_node(mac)
+            self.sync_node(label, topology)
+
+        self.version = version
@@ -1,16 +1,26 @@
-import time
-
 from os_ken.base import app_manager
 from os_ken.base.app_manager import lookup_service_brick
 from os_ken.controller import ofp_event
-from os_ken.controller.handler import MAIN_DISPATCHER, set_ev_cls
+from os_ken.controller.controller import Datapath
+from os_ken.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER, set_ev_cls
 from os_ken.ofproto import ofproto_v1_3
-from os_ken.lib.packet.packet import Packet
+from os_ken.lib import hub
 from os_ken.lib.packet.lldp import lldp
-from os_ken.topology.switches import Switches
+from os_ken.topology import event
+from os_ken.topology.switches import Switches, Port
 from os_ken.topology.api import get_switch
 
-from sdn_controllers.topology_data import TopologyData
+from sdn_controllers.topology_data import TopologyData, DeltaType
+from sdn_controllers.delay_store import DelayStore
+from sdn_controllers.delay_probes import DelayProbe, ProbeScheduler
+from sdn_controllers.packet_in import EventPacketIn, ParsedPacket
+
+from settings import LINK_DELAY_WINDOW, LINK_DELAY_ESTIMATOR, CONTROL_CHANNEL_ECHO_INTERVAL, DELAY_PROBES, \
+    DELAY_PROBE_MIN_INTERVAL, DELAY_PROBE_MAX_INTERVAL, DELAY_PROBE_MAX_RATE
+
+import math
+import struct
+import time
 
 import util
 import logging
@@ -18,12 +28,29 @@ logger = util.get_logger(__name__, logging.INFO)
 
 class DelayMonitor(app_manager.OSKenApp):
     """
-    This controller manages all regular (i.e. non ptp-related) packages and acts as a regular learning
-    switch but also uses the minimum spanning tree of TopologyData to avoid loops
+    This controller measures the delay of every link with its own delay probes (see DELAY_PROBES) and
+    the LLDP packets of the topology discovery.
+    The samples of each link are kept in a DelayStore, the link delay in TopologyData is an estimate
+    over all of them (see LINK_DELAY_ESTIMATOR).
+    An LLDP packet also travels from the controller to the sending switch and from the receiving switch
+    back to the controller, so the round trip times of the control channels are measured with echo
+    requests as well and half of them is subtracted at both ends
     """
 
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
+    # smaller changes of the estimate are not written to the topology, as every write invalidates paths
+    MIN_DELAY_CHANGE_MS = 0.01
+
+    # round trip times of the control channel of a switch are stored as samples of the link (CONTROLLER, dpid)
+    CONTROLLER = 'controller'
+    # echo requests of this app carry this prefix and their send time, the ones of os_ken are empty
+    ECHO_MAGIC = b'ptpsecrt'
+    # confidence level of the link delay intervals, 1.96 standard errors are 95%
+    CONFIDENCE_Z = 1.96
+    # the probe loop sleeps at most this long (s) so that it notices new links
+    PROBE_LOOP_MAX_SLEEP = 1
+
     def __init__(self, *args, **kwargs):
         super(DelayMonitor, self).__init__(*args, **kwargs)
         self.name = 'delay_monitor'
@@ -31,15 +58,204 @@ class DelayMonitor(app_manager.OSKenApp):
         self.topology_data: TopologyData = lookup_service_brick('topology_data')
         self.switches_module: Switches = lookup_service_brick('switches')
 
-    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
-    def packet_in_handler(self, ev):
+        self.delays: DelayStore = DelayStore(LINK_DELAY_WINDOW)
+
+        # port objects of all switches, LLDP packets only carry the dpid and port number
+        self.ports: dict[tuple[int, int], Port] = {}
+
+        self.datapaths: dict[int, Datapath] = {}
+        if CONTROL_CHANNEL_ECHO_INTERVAL is not None:
+            self.echo_thread = hub.spawn(self._echo_loop)
+
+        self.probe_scheduler = ProbeScheduler(DELAY_PROBE_MIN_INTERVAL, DELAY_PROBE_MAX_INTERVAL,
+                                              DELAY_PROBE_MAX_RATE)
+        self.probe_seq: int = 0
+        self.probe_topology_version: int = None
+        if DELAY_PROBES:
+            self.probe_thread = hub.spawn(self._probe_loop)
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev: ofp_event.EventOFPStateChange):
+        datapath: Datapath = ev.datapath
+        if datapath.id is None:
+            return
+
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[datapath.id] = datapath
+        elif ev.state == DEAD_DISPATCHER:
+            self.datapaths.pop(datapath.id, None)
+            # a reconnected switch might use another control channel
+            self.delays.clear(self.CONTROLLER, datapath.id)
+
+    def _echo_loop(self):
+        while True:
+            hub.sleep(CONTROL_CHANNEL_ECHO_INTERVAL)
+            for datapath in list(self.datapaths.values()):
+                parser = datapath.ofproto_parser
+                data = self.ECHO_MAGIC + struct.pack('!Q', time.time_ns())
+                datapath.send_msg(parser.OFPEchoRequest(datapath, data=data))
+
+    @set_ev_cls(ofp_event.EventOFPEchoReply, MAIN_DISPATCHER)
+    def _echo_reply_handler(self, ev: ofp_event.EventOFPEchoReply):
+        # NOTE: taken at the same point of the event handling as the receive time of LLDP packets
         recv_timestamp_ns = time.time_ns()
-        recv_timestamp_s = time.time()
+        data = ev.msg.data
+        if not data or not data.startswith(self.ECHO_MAGIC):
+            return
+
+        (sent_timestamp_ns,) = struct.unpack_from('!Q', data, len(self.ECHO_MAGIC))
+        rtt_ms = (recv_timestamp_ns - sent_timestamp_ns) / 1e6
+        self.delays.add(self.CONTROLLER, ev.msg.datapath.id, rtt_ms)
+        logger.debug(f"control channel rtt of {ev.msg.datapath.id}: {rtt_ms}")
+
+    def _probe_loop(self):
+        while True:
+            now = time.time()
+            if self._links_changed():
+                graph = self.topology_data.graph
+                links = {(u, v) for (u, v, ports) in graph.edges(data='ports', default={})
+                         if u in ports and v in ports and graph.nodes[u].get('is_switch', False)}
+                self.probe_scheduler.sync(links, now)
+
+            for (src, dst) in self.probe_scheduler.pop_due(now):
+                self.send_probe(src, dst)
+
+            next_due = self.probe_scheduler.next_due()
+            sleep = self.PROBE_LOOP_MAX_SLEEP if next_due is None else next_due - time.time()
+            hub.sleep(min(max(sleep, 0), self.PROBE_LOOP_MAX_SLEEP))
+
+    def _links_changed(self) -> bool:
+        # NOTE: every delay update is an EDGE_UPDATED delta, only added or removed nodes and edges change the
+        # links that are probed
+        version = self.topology_data.topology_version
+        if self.probe_topology_version == version:
+            return False
+        deltas = (self.topology_data.get_deltas(self.probe_topology_version)
+                  if self.probe_topology_version is not None else None)
+        self.probe_topology_version = version
+        return deltas is None or any(delta.type != DeltaType.EDGE_UPDATED for delta in deltas)
+
+    def send_probe(self, src: int, dst: int):
+        datapath = self.datapaths.get(src, None)
+        edge = self.topology_data.graph.get_edge_data(src, dst)
+        if datapath is None or edge is None:
+            return
+
+        port_no = edge['ports'][src]
+        port = self.get_port(src, port_no)
+        if port is None:
+            return
+
+        ofproto: ofproto_v1_3 = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        self.probe_seq = (self.probe_seq + 1) & 0xFFFFFFFF
+        probe = DelayProbe(src, port_no, self.probe_seq, time.time_ns())
+        out = parser.OFPPacketOut(datapath=datapath,
+                                  buffer_id=ofproto.OFP_NO_BUFFER,
+                                  in_port=ofproto.OFPP_CONTROLLER,
+                                  actions=[parser.OFPActionOutput(port_no)],
+                                  data=probe.serialize(port.hw_addr))
+        datapath.send_msg(out)
+
+    def add_link_sample(self, src: int, dst: int, delay_ms: float):
+        """
+        Adds a delay sample of the link src -> dst (including the control channel latencies) and
+        updates its delay in the topology and its probe interval
+        """
+        if not self.topology_data.graph.has_edge(src, dst):
+            return
+
+        self.delays.add(src, dst, delay_ms)
+        (estimate, error) = self.link_delay(src, dst)
+        logger.debug(f"{src} -> {dst}: {delay_ms}, estimate {estimate} +- {error}")
+
+        if abs(estimate - self.topology_data.graph[src][dst].get('delay', 0)) >= self.MIN_DELAY_CHANGE_MS:
+            self.topology_data.set_link_delay(src, dst, estimate)
+
+        (reverse, _) = self.link_delay(dst, src)
+        asymmetry = abs(estimate - reverse) if reverse is not None else 0
+        self.probe_scheduler.update((src, dst), self.delays.variance(src, dst), asymmetry)
+
+    def link_delay(self, src: int, dst: int) -> tuple[float, float]:
+        """
+        Estimated delay of the link src -> dst without the control channel latencies and the half
+        width of its confidence interval (None if there are too few samples)
+        """
+        delay = self.delays.estimate(src, dst, LINK_DELAY_ESTIMATOR)
+        if delay is None:
+            return (None, None)
+
+        channels = [(self.CONTROLLER, dpid) for dpid in (src, dst)]
+        rtts = [self.delays.estimate(*c, LINK_DELAY_ESTIMATOR) for c in channels]
+        if CONTROL_CHANNEL_ECHO_INTERVAL is None or None in rtts:
+            # not measured (yet), the channel latencies stay in the delay
+            channels = []
+        else:
+            delay = max(delay - sum(rtts) / 2, 0)
+
+        # the errors of the link and of half of both round trip times add up
+        errors = [self.delays.standard_error(src, dst)]
+        for c in channels:
+            error = self.delays.standard_error(*c)
+            errors.append(None if error is None else error / 2)
+        if None in errors:
+            return (delay, None)
+        return (delay, self.CONFIDENCE_Z * math.sqrt(sum(e * e for e in errors)))
+
+    @set_ev_cls(event.EventSwitchEnter, MAIN_DISPATCHER)
+    def _switch_enter_handler(self, ev: event.EventSwitchEnter):
+        for port in ev.switch.ports:
+            self.ports[(port.dpid, port.port_no)] = port
+
+    @set_ev_cls(event.EventSwitchLeave, MAIN_DISPATCHER)
+    def _switch_leave_handler(self, ev: event.EventSwitchLeave):
+        for port in ev.switch.ports:
+            self.ports.pop((port.dpid, port.port_no), None)
+
+    @set_ev_cls([event.EventPortAdd, event.EventPortModify], MAIN_DISPATCHER)
+    def _port_add_handler(self, ev: event.EventPortAdd):
+        self.ports[(ev.port.dpid, ev.port.port_no)] = ev.port
+
+    @set_ev_cls(event.EventPortDelete, MAIN_DISPATCHER)
+    def _port_delete_handler(self, ev: event.EventPortDelete):
+        self.ports.pop((ev.port.dpid, ev.port.port_no), None)
+
+    @set_ev_cls(event.EventLinkDelete, MAIN_DISPATCHER)
+    def _link_delete_handler(self, ev: event.EventLinkDelete):
+        # a link that comes back might have a different delay
+        self.delays.clear(ev.link.src.dpid, ev.link.dst.dpid)
+
+    def get_port(self, dpid: int, port_no: int) -> Port:
+        port = self.ports.get((dpid, port_no), None)
+        if port is None:
+            # NOTE: only happens if the switch entered before this app was started
+            for switch in get_switch(self, dpid=dpid):
+                for p in switch.ports:
+                    self.ports[(p.dpid, p.port_no)] = p
+            port = self.ports.get((dpid, port_no), None)
+        return port
+
+    @set_ev_cls(EventPacketIn, MAIN_DISPATCHER)
+    def packet_in_handler(self, ev: EventPacketIn):
+        pkt: ParsedPacket = ev.pkt
+
+        if pkt.is_delay_probe:
+            probe: DelayProbe = pkt.delay_probe
+            if probe is not None:
+                self.add_link_sample(probe.dpid, ev.msg.datapath.id,
+                                     (pkt.recv_timestamp_ns - probe.sent_timestamp_ns) / 1e6)
+            return
+
+        if not pkt.is_lldp:
+            return
+
+        recv_timestamp_ns = pkt.recv_timestamp_ns
+        recv_timestamp_s = recv_timestamp_ns / 1e9
 
         msg = ev.msg
 
-        pkt: Packet = Packet(msg.data)
-        lldp_pkt: lldp = pkt.get_protocol(lldp)
+        lldp_pkt: lldp = pkt.lldp
 
         if not lldp_pkt:
             return
@@ -62,19 +278,14 @@ class DelayMonitor(app_manager.OSKenApp):
         dst = msg.datapath.id
         logger.debug(f"LLDP packet recieved at {dst}")
 
-        src_switch = get_switch(self, dpid=src)
-        if src_switch is None or len(src_switch) < 1:
+        port = self.get_port(src, src_port)
+        if port is None:
             return
 
-        src_switch = src_switch[0]
-        for port in src_switch.ports:
-            if port.port_no == src_port:
-                if not custom_pkt:
-                    sent_timestamp_s = self.switches_module.ports[port].timestamp
-                    if sent_timestamp_s:
-                        delay_ms = (recv_timestamp_s - sent_timestamp_s) * 1000
-
-                if delay_ms is not None and self.topology_data.graph.has_edge(src, dst):
-                    # NOTE: this does not take the delay between the switch and the controller into account
-                    self.topology_data.graph[src][dst]['delay'] = delay_ms
-                    logger.debug(f"{src} -> {dst}: {delay_ms}")
+        if not custom_pkt:
+            port_data = self.switches_module.ports.get(port, None)
+            if port_data is not None and port_data.timestamp:
+                delay_ms = (recv_timestamp_s - port_data.timestamp) * 1000
+
+        if delay_ms is not None:
+            self.add_link_sample(src, dst, delay_ms)
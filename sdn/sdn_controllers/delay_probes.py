@@ -0,0 +1,136 @@
+import heapq
+import struct
+
+from os_ken.lib import addrconv
+
+# IEEE 802 local experimental ethertype
+DELAY_PROBE_ETH_TYPE = 0x88B5
+# like LLDP, probes are not forwarded by regular bridges
+DELAY_PROBE_DST = '01:80:c2:00:00:0e'
+
+# payload after the ethernet header: magic, dpid and port of the sending switch, sequence number and
+# the time the probe was sent by the controller (ns since the epoch)
+_PROBE = struct.Struct('!4sQIIQ')
+_PROBE_MAGIC = b'dlyp'
+_ETH_HEADER = struct.Struct('!6s6sH')
+_MIN_FRAME_LEN = 60
+
+
+class DelayProbe:
+    """
+    A frame that the controller sends out of a switch port to measure the delay of the link behind it
+    """
+
+    __slots__ = ('dpid', 'port_no', 'seq', 'sent_timestamp_ns')
+
+    def __init__(self, dpid: int, port_no: int, seq: int, sent_timestamp_ns: int):
+        self.dpid = dpid
+        self.port_no = port_no
+        self.seq = seq
+        self.sent_timestamp_ns = sent_timestamp_ns
+
+    def serialize(self, src_mac: str) -> bytes:
+        frame = (_ETH_HEADER.pack(addrconv.mac.text_to_bin(DELAY_PROBE_DST), addrconv.mac.text_to_bin(src_mac),
+                                  DELAY_PROBE_ETH_TYPE)
+                 + _PROBE.pack(_PROBE_MAGIC, self.dpid, self.port_no, self.seq, self.sent_timestamp_ns))
+        return frame.ljust(_MIN_FRAME_LEN, b'\0')
+
+    @classmethod
+    def parse(cls, data: bytes, offset: int = _ETH_HEADER.size) -> 'DelayProbe':
+        """
+        Returns None if data is not a delay probe
+        """
+        if len(data) < offset + _PROBE.size:
+            return None
+        (magic, dpid, port_no, seq, sent_timestamp_ns) = _PROBE.unpack_from(data, offset)
+        if magic != _PROBE_MAGIC:
+            return None
+        return cls(dpid, port_no, seq, sent_timestamp_ns)
+
+
+class ProbeScheduler:
+    """
+    Decides when each link is probed next. The interval of a link is halved whenever the variance or the
+    asymmetry of its delay rises and grows slowly while both are stable, between min_interval and
+    max_interval. If all links together would exceed max_rate probes per second, all intervals are
+    stretched by the same factor
+    """
+
+    # the interval grows by this factor per stable sample
+    BACKOFF = 1.25
+    # variance or asymmetry rise if they exceed the previous value by this factor, changes below the
+    # noise level (ms) are ignored
+    RISE = 1.5
+    NOISE_MS = 0.01
+
+    def __init__(self, min_interval: float, max_interval: float, max_rate: float):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.max_rate = max_rate
+
+        self.intervals: dict[tuple, float] = {}
+        self.rate: float = 0
+        # (variance, asymmetry) of every link at its last sample
+        self.scores: dict[tuple, tuple[float, float]] = {}
+        # (time, link) of the next probe of every link, outdated entries are skipped lazily
+        self.queue: list[tuple[float, tuple]] = []
+        self.due_at: dict[tuple, float] = {}
+
+    def sync(self, links: set, now: float):
+        """
+        Starts probing new links right away and stops probing links that are not in links anymore
+        """
+        for link in links - self.intervals.keys():
+            self._set_interval(link, self.min_interval)
+            self._schedule(link, now)
+        for link in self.intervals.keys() - links:
+            self._set_interval(link, None)
+            self.scores.pop(link, None)
+            self.due_at.pop(link, None)
+
+    def _schedule(self, link: tuple, time: float):
+        self.due_at[link] = time
+        heapq.heappush(self.queue, (time, link))
+
+    def _set_interval(self, link: tuple, interval: float):
+        old = self.intervals.pop(link, None)
+        if old is not None:
+            self.rate -= 1 / old
+        if interval is not None:
+            self.intervals[link] = interval
+            self.rate += 1 / interval
+
+    def next_due(self) -> float:
+        return self.queue[0][0] if self.queue else None
+
+    def pop_due(self, now: float) -> list[tuple]:
+        """
+        Returns the links that have to be probed now and schedules their next probe
+        """
+        stretch = max(1, self.rate / self.max_rate)
+        due = []
+        while self.queue and self.queue[0][0] <= now:
+            (time, link) = heapq.heappop(self.queue)
+            if self.due_at.get(link, None) != time:
+                continue
+            due.append(link)
+            self._schedule(link, now + self.intervals[link] * stretch)
+        return due
+
+    def update(self, link: tuple, variance: float, asymmetry: float):
+        """
+        Adapts the interval of link to a new sample, asymmetry is the absolute difference between the
+        delays of both directions (0 if unknown)
+        """
+        interval = self.intervals.get(link, None)
+        if interval is None:
+            return
+
+        (old_variance, old_asymmetry) = self.scores.get(link, (variance, asymmetry))
+        self.scores[link] = (variance, asymmetry)
+        if (variance > old_variance * self.RISE + self.NOISE_MS ** 2
+                or asymmetry > old_asymmetry * self.RISE + self.NOISE_MS):
+            interval = max(interval / 2, self.min_interval)
+        else:
+            interval = min(interval * self.BACKOFF, self.max_interval)
+        self._set_interval(link, interval)
@@ -0,0 +1,138 @@
+import numpy as np
+
+
+class DelayStore:
+    """
+    The last window delay samples (ms) of every link in one ring buffer per link. All buffers are rows of
+    a single array, so that the statistics of all links are computed at once. Rows of links without
+    samples (yet) are nan
+    """
+
+    def __init__(self, window: int = 32, alpha: float = 0.2, capacity: int = 64):
+        self.window = window
+        # weight of a new sample in the exponentially weighted moving average
+        self.alpha = alpha
+
+        # row of every link and the link of every row
+        self.index: dict[tuple, int] = {}
+        self.links: list[tuple] = []
+
+        self.samples = np.full((capacity, window), np.nan)
+        self.position = np.zeros(capacity, dtype=np.int64)
+        self.count = np.zeros(capacity, dtype=np.int64)
+        self.ewma = np.full(capacity, np.nan)
+
+    def __len__(self) -> int:
+        return len(self.links)
+
+    def __contains__(self, link: tuple) -> bool:
+        return link in self.index
+
+    def _row(self, link: tuple) -> int:
+        i = self.index.get(link, None)
+        if i is not None:
+            return i
+
+        i = len(self.links)
+        if i == len(self.samples):
+            # double the capacity, growing is amortized O(1) per link
+            grow = len(self.samples)
+            self.samples = np.vstack([self.samples, np.full((grow, self.window), np.nan)])
+            self.position = np.concatenate([self.position, np.zeros(grow, dtype=np.int64)])
+            self.count = np.concatenate([self.count, np.zeros(grow, dtype=np.int64)])
+            self.ewma = np.concatenate([self.ewma, np.full(grow, np.nan)])
+
+        self.index[link] = i
+        self.links.append(link)
+        return i
+
+    def add(self, src, dst, delay_ms: float):
+        i = self._row((src, dst))
+        self.samples[i, self.position[i]] = delay_ms
+        self.position[i] = (self.position[i] + 1) % self.window
+        self.count[i] = min(self.count[i] + 1, self.window)
+        self.ewma[i] = delay_ms if self.count[i] == 1 else self.alpha * delay_ms + (1 - self.alpha) * self.ewma[i]
+
+    def clear(self, src, dst):
+        """
+        Drops the samples of a link, e.g. because it went down
+        """
+        i = self.index.get((src, dst), None)
+        if i is None:
+            return
+        self.samples[i] = np.nan
+        self.position[i] = 0
+        self.count[i] = 0
+        self.ewma[i] = np.nan
+
+    def samples_of(self, src, dst) -> np.ndarray:
+        """
+        Samples of a link from the oldest to the newest
+        """
+        i = self.index.get((src, dst), None)
+        if i is None:
+            return np.empty(0)
+        return np.roll(self.samples[i], -self.position[i])[self.window - self.count[i]:]
+
+    def _rows(self) -> tuple[np.ndarray, np.ndarray]:
+        # NOTE: rows without any sample are skipped, nanmedian would warn about them
+        rows = self.samples[:len(self.links)]
+        return (rows, self.count[:len(self.links)] > 0)
+
+    def medians(self) -> np.ndarray:
+        """
+        Median delay of every link, in the order of links
+        """
+        (rows, sampled) = self._rows()
+        result = np.full(len(rows), np.nan)
+        result[sampled] = np.nanmedian(rows[sampled], axis=1)
+        return result
+
+    def percentiles(self, q: float) -> np.ndarray:
+        """
+        q-th percentile (0 to 100) of the delay of every link, in the order of links
+        """
+        (rows, sampled) = self._rows()
+        result = np.full(len(rows), np.nan)
+        result[sampled] = np.nanpercentile(rows[sampled], q, axis=1)
+        return result
+
+    def ewmas(self) -> np.ndarray:
+        return self.ewma[:len(self.links)]
+
+    def median(self, src, dst) -> float:
+        samples = self.samples_of(src, dst)
+        return float(np.median(samples)) if len(samples) else None
+
+    def percentile(self, src, dst, q: float) -> float:
+        samples = self.samples_of(src, dst)
+        return float(np.percentile(samples, q)) if len(samples) else None
+
+    def variance(self, src, dst) -> float:
+        samples = self.samples_of(src, dst)
+        return float(np.var(samples)) if len(samples) else None
+
+    def standard_error(self, src, dst) -> float:
+        """
+        Standard error of the mean delay of a link, None if it has less than two samples
+        """
+        samples = self.samples_of(src, dst)
+        if len(samples) < 2:
+            return None
+        return float(np.std(samples, ddof=1) / np.sqrt(len(samples)))
+
+    def ewma_of(self, src, dst) -> float:
+        i = self.index.get((src, dst), None)
+        if i is None or self.count[i] == 0:
+            return None
+        return float(self.ewma[i])
+
+    def estimate(self, src, dst, estimator='median') -> float:
+        """
+        Delay of a link according to estimator: 'median', 'ewma' or a percentile (0 to 100)
+        """
+        if estimator == 'median':
+            return self.median(src, dst)
+        if estimator == 'ewma':
+            return self.ewma_of(src, dst)
+        return self.percentile(src, dst, estimator)
@@ -0,0 +1,212 @@
+from os_ken.base import app_manager
+from os_ken.controller import ofp_event
+from os_ken.controller.controller import Datapath
+from os_ken.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER, set_ev_cls
+from os_ken.ofproto import ofproto_v1_3
+from os_ken.lib import hub
+
+from typing import Callable
+
+import util
+import logging
+logger = util.get_logger(__name__, logging.INFO, False)
+
+
+class InstalledFlow:
+    """
+    A flow that was sent to a switch. fields are the sorted (name, value) pairs of its match
+    """
+
+    __slots__ = ('priority', 'match', 'fields', 'actions', 'cookie', 'idle_timeout', 'hard_timeout')
+
+    def __init__(self, priority: int, match, actions: list, cookie: int, idle_timeout: int, hard_timeout: int):
+        self.priority = priority
+        self.match = match
+        self.fields: tuple = tuple(sorted(match.items()))
+        self.actions = actions
+        self.cookie = cookie
+        self.idle_timeout = idle_timeout
+        self.hard_timeout = hard_timeout
+
+    @property
+    def key(self) -> tuple:
+        # a flow with the same priority and match replaces this one
+        return (self.priority, self.fields)
+
+    def out_ports(self) -> frozenset[int]:
+        return frozenset(a.port for a in self.actions if hasattr(a, 'port'))
+
+    def same_as(self, other: 'InstalledFlow') -> bool:
+        return (self.cookie == other.cookie
+                and self.idle_timeout == other.idle_timeout
+                and self.hard_timeout == other.hard_timeout
+                and [str(a) for a in self.actions] == [str(a) for a in other.actions])
+
+
+class _FlowTable:
+    """
+    The flows installed at one connection of a switch and the flow mods that were not sent yet
+    """
+
+    def __init__(self, datapath: Datapath):
+        self.datapath = datapath
+        self.flows: dict[tuple, InstalledFlow] = {}
+        self.pending: list = []
+
+
+class FlowManager(app_manager.OSKenApp):
+    """
+    Installs the flows of all other apps. It keeps track of the flows of every switch, so that
+    identical flow mods are only sent once, and sends them in batches that end with a barrier.
+    Flows that became invalid (e.g. after a topology change) are deleted one by one with their cookie,
+    see revalidate
+    """
+
+    OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+
+    # flow mods are collected for this long before they are sent
+    BATCH_INTERVAL = 0.05
+
+    def __init__(self, *args, **kwargs):
+        super(FlowManager, self).__init__(*args, **kwargs)
+        self.name = 'flow_manager'
+
+        self.tables: dict[int, _FlowTable] = {}
+        self._flush_thread = None
+
+        # number of sent and skipped flow mods
+        self.sent_flow_mods: int = 0
+        self.skipped_flow_mods: int = 0
+
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev: ofp_event.EventOFPStateChange):
+        datapath: Datapath = ev.datapath
+        table = self.tables.get(datapath.id, None)
+
+        # NOTE: a reconnected switch is a new datapath object, its table is replaced in _table
+        if ev.state == DEAD_DISPATCHER and table is not None and table.datapath is datapath:
+            del self.tables[datapath.id]
+
+    @set_ev_cls(ofp_event.EventOFPFlowRemoved, MAIN_DISPATCHER)
+    def _flow_removed_handler(self, ev: ofp_event.EventOFPFlowRemoved):
+        msg = ev.msg
+        ofproto: ofproto_v1_3 = msg.datapath.ofproto
+        table = self.tables.get(msg.datapath.id, None)
+
+        # deleted flows were already forgotten and might have been added again since
+        if table is None or msg.reason == ofproto.OFPRR_DELETE:
+            return
+
+        key = (msg.priority, tuple(sorted(msg.match.items())))
+        flow = table.flows.get(key, None)
+        if flow is not None and flow.cookie == msg.cookie:
+            logger.debug(f"flow {key} expired at dp {msg.datapath.id}")
+            del table.flows[key]
+
+    def _table(self, datapath: Datapath) -> _FlowTable:
+        table = self.tables.get(datapath.id, None)
+        if table is None or table.datapath is not datapath:
+            # we don't know the flow table of a (re)connected switch
+            table = _FlowTable(datapath)
+            self.tables[datapath.id] = table
+        return table
+
+    def _queue(self, table: _FlowTable, msg):
+        table.pending.append(msg)
+        if self._flush_thread is None:
+            self._flush_thread = hub.spawn_after(self.BATCH_INTERVAL, self._flush_all)
+
+    def _flush_all(self):
+        self._flush_thread = None
+        self.flush()
+
+    def add_flow(self, datapath: Datapath, priority: int, match, actions: list, cookie: int = 0,
+                 idle_timeout: int = 0, hard_timeout: int = 0) -> bool:
+        """
+        Installs a flow that applies actions, unless the switch already has the same one.
+        Returns False if the flow mod was skipped
+        """
+        ofproto: ofproto_v1_3 = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        table = self._table(datapath)
+        flow = InstalledFlow(priority, match, actions, cookie, idle_timeout, hard_timeout)
+        installed = table.flows.get(flow.key, None)
+        if installed is not None and installed.same_as(flow):
+            self.skipped_flow_mods += 1
+            return False
+
+        # only flows that can expire are reported back, so that they are installed again afterwards
+        flags = ofproto.OFPFF_SEND_FLOW_REM if idle_timeout or hard_timeout else 0
+
+        # adding a flow with the same match and priority replaces the old one (and its cookie)
+        inst = [parser.OFPInstructionActions(ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        mod = parser.OFPFlowMod(datapath=datapath,
+                                cookie=cookie,
+                                priority=priority,
+                                match=match,
+                                idle_timeout=idle_timeout,
+                                hard_timeout=hard_timeout,
+                                flags=flags,
+                                instructions=inst)
+        self._queue(table, mod)
+        table.flows[flow.key] = flow
+        self.sent_flow_mods += 1
+        return True
+
+    def delete_flows(self, datapath: Datapath, flows: list[InstalledFlow]):
+        """
+        Deletes exactly the given flows, other flows with the same match but another cookie or priority
+        are not affected
+        """
+        ofproto: ofproto_v1_3 = datapath.ofproto
+        parser = datapath.ofproto_parser
+
+        table = self._table(datapath)
+        for flow in flows:
+            mod = parser.OFPFlowMod(datapath=datapath,
+                                    table_id=ofproto.OFPTT_ALL,
+                                    command=ofproto.OFPFC_DELETE_STRICT,
+                                    cookie=flow.cookie,
+                                    cookie_mask=0xFFFFFFFFFFFFFFFF,
+                                    priority=flow.priority,
+                                    match=flow.match,
+                                    out_port=ofproto.OFPP_ANY,
+                                    out_group=ofproto.OFPG_ANY)
+            self._queue(table, mod)
+            table.flows.pop(flow.key, None)
+            self.sent_flow_mods += 1
+
+    def get_flows(self, dpid: int, cookie: int = None) -> list[InstalledFlow]:
+        table = self.tables.get(dpid, None)
+        if table is None:
+            return []
+        return [flow for flow in table.flows.values() if cookie is None or flow.cookie == cookie]
+
+    def revalidate(self, cookie: int, is_valid: Callable[[int, InstalledFlow], bool]) -> int:
+        """
+        Deletes all flows with the given cookie for which is_valid(dpid, flow) is False.
+        Returns the number of deleted flows
+        """
+        deleted = 0
+        for (dpid, table) in list(self.tables.items()):
+            stale = [flow for flow in table.flows.values() if flow.cookie == cookie and not is_valid(dpid, flow)]
+            if stale:
+                logger.debug(f"deleting {len(stale)} stale flows with cookie {cookie:#x} at dp {dpid}")
+                self.delete_flows(table.datapath, stale)
+                deleted += len(stale)
+        return deleted
+
+    def flush(self, dpid: int = None):
+        """
+        Sends the pending flow mods of one or all switches, each batch is followed by a barrier so
+        that later messages are only processed once the flows are in place
+        """
+        tables = self.tables.values() if dpid is None else [self.tables[dpid]] if dpid in self.tables else []
+        for table in tables:
+            if not table.pending:
+                continue
+            (pending, table.pending) = (table.pending, [])
+            for msg in pending:
+                table.datapath.send_msg(msg)
+            table.datapath.send_msg(table.datapath.ofproto_parser.OFPBarrierRequest(table.datapath))
@@ -0,0 +1,100 @@
+import numpy as np
+import networkx as nx
+
+
+class GraphSnapshot:
+    """
+    Immutable copy of a graph (e.g. the clock graph) in compressed sparse row form: the nodes are numbered in
+    the order of the graph, the out edges of node i are the entries indptr[i]:indptr[i + 1] of indices
+    (sorted by target), delays, ports (at node i) and peer_ports (at the target), -1 if there is no port.
+    A snapshot is built once per graph version (any comparable value) and shared read-only, also with
+    other processes
+    """
+
+    NO_PORT = -1
+
+    def __init__(self, G: nx.DiGraph, version, mac_to_clockid: dict[str, int] = None):
+        self.version = version
+        self.nodes: tuple = tuple(G.nodes)
+        self.index: dict = {n: i for (i, n) in enumerate(self.nodes)}
+        N = len(self.nodes)
+
+        self.is_switch = np.fromiter((bool(s) for (_, s) in G.nodes(data='is_switch', default=False)),
+                                     dtype=bool, count=N)
+
+        # lookup tables, a mac address of a merged ptp clock maps to the node of its clock identity
+        self.dpid_to_id: dict[int, int] = {}
+        self.mac_to_id: dict[str, int] = {}
+        self.clockid_to_id: dict[int, int] = {}
+        for (i, n) in enumerate(self.nodes):
+            if self.is_switch[i]:
+                self.dpid_to_id[n] = i
+            elif isinstance(n, str):
+                self.mac_to_id[n] = i
+            else:
+                self.clockid_to_id[n] = i
+        for (mac, clock_id) in (mac_to_clockid or {}).items():
+            if clock_id in self.index:
+                self.mac_to_id[mac] = self.index[clock_id]
+
+        E = G.number_of_edges()
+        src = np.empty(E, dtype=np.int32)
+        dst = np.empty(E, dtype=np.int32)
+        delays = np.empty(E, dtype=np.float64)
+        ports = np.empty(E, dtype=np.int32)
+        peer_ports = np.empty(E, dtype=np.int32)
+        for (e, (u, v, attrs)) in enumerate(G.edges(data=True)):
+            src[e] = self.index[u]
+            dst[e] = self.index[v]
+            delays[e] = attrs.get('delay', 1)
+            edge_ports = attrs.get('ports', {})
+            ports[e] = edge_ports.get(u, self.NO_PORT)
+            peer_ports[e] = edge_ports.get(v, self.NO_PORT)
+
+        order = np.lexsort((dst, src))
+        self.indptr = np.zeros(N + 1, dtype=np.int32)
+        np.cumsum(np.bincount(src, minlength=N), out=self.indptr[1:])
+        self.indices = dst[order]
+        self.delays = delays[order]
+        self.ports = ports[order]
+        self.peer_ports = peer_ports[order]
+
+        for a in (self.is_switch, self.indptr, self.indices, self.delays, self.ports, self.peer_ports):
+            a.setflags(write=False)
+
+    def __len__(self) -> int:
+        return len(self.nodes)
+
+    def __contains__(self, n) -> bool:
+        return n in self.index
+
+    def id_of(self, n) -> int:
+        """
+        Id of a node given by its label, dpid, mac address or clock identity, None if it is unknown
+        """
+        i = self.index.get(n, None)
+        if i is None and isinstance(n, str):
+            i = self.mac_to_id.get(n, None)
+        return i
+
+    def neighbors(self, i: int) -> np.ndarray:
+        return self.indices[self.indptr[i]:self.indptr[i + 1]]
+
+    def edge_id(self, i: int, j: int) -> int:
+        """
+        Position of the edge i -> j in the edge arrays or -1 if there is none
+        """
+        (start, end) = (self.indptr[i], self.indptr[i + 1])
+        e = start + np.searchsorted(self.indices[start:end], j)
+        if e < end and self.indices[e] == j:
+            return int(e)
+        return -1
+
+    def port(self, u, v) -> int:
+        """
+        Port of u towards v, None if there is no such edge
+        """
+        e = self.edge_id(self.index[u], self.index[v]) if u in self.index and v in self.index else -1
+        if e < 0 or self.ports[e] == self.NO_PORT:
+            return None
+        return int(self.ports[e])
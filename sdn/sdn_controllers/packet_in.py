@@ -0,0 +1,105 @@
+import time
+from enum import Enum
+from functools import cached_property
+
+from os_ken.controller import event
+from os_ken.lib.packet import ethernet
+from os_ken.lib.packet.lldp import lldp
+from os_ken.lib.packet.packet import Packet
+
+from ptp.ptp_packet import PtpPacket
+from sdn_controllers.delay_probes import DelayProbe, DELAY_PROBE_ETH_TYPE
+from ptp.ptp_message_types import MessageType
+
+from util import is_multicast
+
+LLDP_ETH_TYPE = 0x88CC
+PTP_ETH_TYPE = 0x88F7
+
+
+class PacketKind(Enum):
+    LLDP = 0
+    PTP = 1
+    MULTICAST = 2
+    UNICAST = 3
+    DELAY_PROBE = 4
+
+
+class ParsedPacket:
+    """
+    The result of parsing a packet-in message once. Only the ethernet header is decoded eagerly,
+    the LLDP and PTP payloads are decoded on first access and then shared by all consumers
+    """
+
+    def __init__(self, msg):
+        self.recv_timestamp_ns: int = time.time_ns()
+
+        self.msg = msg
+        self.data: bytes = msg.data
+        self.datapath = msg.datapath
+        self.in_port: int = msg.match['in_port']
+
+        self.eth: ethernet.ethernet = ethernet.ethernet.parser(self.data)[0]
+        self.src: str = self.eth.src
+        self.dst: str = self.eth.dst
+        self.ethertype: int = self.eth.ethertype
+        self.is_multicast: bool = is_multicast(self.dst)
+
+        if self.ethertype == LLDP_ETH_TYPE:
+            self.kind = PacketKind.LLDP
+        elif self.ethertype == PTP_ETH_TYPE:
+            self.kind = PacketKind.PTP
+        elif self.ethertype == DELAY_PROBE_ETH_TYPE:
+            self.kind = PacketKind.DELAY_PROBE
+        elif self.is_multicast:
+            self.kind = PacketKind.MULTICAST
+        else:
+            self.kind = PacketKind.UNICAST
+
+    @property
+    def is_lldp(self) -> bool:
+        return self.kind == PacketKind.LLDP
+
+    @property
+    def is_ptp(self) -> bool:
+        return self.kind == PacketKind.PTP
+
+    @property
+    def is_delay_probe(self) -> bool:
+        return self.kind == PacketKind.DELAY_PROBE
+
+    @cached_property
+    def ptp(self) -> PtpPacket:
+        if not self.is_ptp:
+            return None
+        # the ptp packet is a view onto the packet-in data right after the ethernet header
+        return PtpPacket(self.data, ethernet.ethernet._MIN_LEN)
+
+    @cached_property
+    def ptp_message_type(self) -> MessageType:
+        if not self.is_ptp:
+            return None
+        return self.ptp.messageType
+
+    @cached_property
+    def lldp(self) -> lldp:
+        if not self.is_lldp:
+            return None
+        return Packet(self.data).get_protocol(lldp)
+
+    @cached_property
+    def delay_probe(self) -> DelayProbe:
+        if not self.is_delay_probe:
+            return None
+        return DelayProbe.parse(self.data, ethernet.ethernet._MIN_LEN)
+
+
+class EventPacketIn(event.EventBase):
+    """
+    Published by PTPSecApp for every EventOFPPacketIn with the (shared) parse result of the packet
+    """
+
+    def __init__(self, pkt: ParsedPacket):
+        super(EventPacketIn, self).__init__()
+        self.msg = pkt.msg
+        self.pkt = pkt
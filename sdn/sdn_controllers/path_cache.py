@@ -0,0 +1,196 @@
+import math
+
+import networkx as nx
+
+from sdn_controllers.clock_graph import ClockGraphChanges
+from util import get_n_redundant_paths
+from disjoint_paths import CompactGraph, disjoint_paths, path_delay
+
+import util
+import logging
+logger = util.get_logger(__name__, logging.INFO, False)
+
+
+def _delay(G: nx.DiGraph, u, v) -> float:
+    return max(G[u][v].get('delay', 1), 0)
+
+
+class CachedPaths:
+    """
+    The redundant paths between a master and a slave together with the clock graph version they
+    are valid for
+    """
+
+    __slots__ = ('paths', 'recommendations', 'version', 'stale', 'broken', 'path_nodes', 'path_edges',
+                 'edge_delays', 'total_delay')
+
+    def __init__(self, paths: list, recommendations: list, version: int, G: nx.DiGraph = None):
+        self.paths = paths
+        self.recommendations = recommendations
+        self.version = version
+        # the paths have to be computed from scratch
+        self.stale: bool = False
+        # indices of the paths that lost a node or an edge and have to be replaced
+        self.broken: set[int] = set()
+
+        # inner nodes and edges of every path, packets travel in both directions so both
+        # directions of an edge are needed
+        self.path_nodes: list[set] = [set(p[1:-1]) for p in paths]
+        self.path_edges: list[set[tuple]] = [{e for i in range(len(p) - 1)
+                                              for e in [(p[i], p[i + 1]), (p[i + 1], p[i])]}
+                                             for p in paths]
+
+        # delays the paths were computed with, without the graph every delay change counts
+        self.edge_delays: dict[tuple, float] = {}
+        self.total_delay: float = math.inf
+        if G is not None:
+            self.edge_delays = {e: _delay(G, *e) for edges in self.path_edges for e in edges if G.has_edge(*e)}
+            self.total_delay = sum(self.edge_delays.get((p[i], p[i + 1]), 0) for p in paths for i in range(len(p) - 1))
+
+
+class PathCache:
+    """
+    Caches the redundant paths of every (master, slave) pair. Only the pairs whose paths are affected
+    by a change of the clock graph are recomputed, paths that lost a node or edge are repaired by
+    searching replacements for the broken paths only.
+    Delay changes below delay_tolerance (relative) are ignored, so that the noise of the link delay
+    measurements does not cause recomputations
+    """
+
+    def __init__(self, n: int, max_delay_difference: float = None, delay_tolerance: float = 0.0):
+        self.n = n
+        self.max_delay_difference = max_delay_difference
+        self.delay_tolerance = delay_tolerance
+        self.entries: dict[tuple, CachedPaths] = {}
+        self.version: int = 0
+        # delay of every updated edge when its last relevant change was seen, slow drifts add up to a
+        # relevant change this way
+        self.reference_delays: dict[tuple, float] = {}
+
+    def _changed(self, old: float, new: float) -> bool:
+        return abs(new - old) > self.delay_tolerance * abs(old)
+
+    def invalidate(self, changes: ClockGraphChanges, G: nx.DiGraph):
+        """
+        Marks the entries that are affected by changes of G. Paths are recomputed if they lost an
+        endpoint, if a delay on them changed by more than the tolerance, or if a new edge or an edge
+        whose delay dropped could be part of paths with less total delay. Paths that only lost an inner
+        node or edge are repaired
+        """
+        if not changes:
+            return
+
+        self.version += 1
+
+        if changes.rebuilt:
+            self.entries.clear()
+            self.reference_delays.clear()
+            return
+
+        for edge in changes.removed_edges:
+            self.reference_delays.pop(edge, None)
+
+        # delays of the edges that dropped (or appeared) since they were last looked at
+        dropped: dict[tuple, float] = {}
+        for (edge, old) in changes.updated_edges.items():
+            if not G.has_edge(*edge):
+                continue
+            new = _delay(G, *edge)
+            reference = self.reference_delays.get(edge, max(old, 0))
+            if self._changed(reference, new):
+                self.reference_delays[edge] = new
+                if new < reference:
+                    dropped[edge] = new
+        for edge in changes.added_edges:
+            if G.has_edge(*edge):
+                dropped[edge] = _delay(G, *edge)
+
+        for ((master, slave), entry) in self.entries.items():
+            if master in changes.removed_nodes or slave in changes.removed_nodes:
+                entry.stale = True
+                continue
+
+            # more nodes or edges might allow more disjoint paths
+            if changes.grown and len(entry.paths) < self.n:
+                entry.stale = True
+                continue
+
+            # any set of paths that uses a cheaper edge has at least its delay
+            if any(delay < entry.total_delay for (edge, delay) in dropped.items()
+                   if not any(edge in edges for edges in entry.path_edges)):
+                entry.stale = True
+                continue
+
+            for i in range(len(entry.paths)):
+                # a different delay might change which paths are the best ones
+                if any(e not in entry.edge_delays or self._changed(entry.edge_delays[e], _delay(G, *e))
+                       for e in entry.path_edges[i].intersection(changes.updated_edges) if G.has_edge(*e)):
+                    entry.stale = True
+                    break
+                if (not entry.path_nodes[i].isdisjoint(changes.removed_nodes)
+                        or not entry.path_edges[i].isdisjoint(changes.removed_edges)):
+                    entry.broken.add(i)
+
+            # repairing only works if there were enough paths in the first place
+            if entry.broken and len(entry.paths) < self.n:
+                entry.stale = True
+
+    def refresh(self, G: nx.DiGraph, master, slave) -> bool:
+        """
+        Repairs the paths between master and slave if they were broken since the last call.
+        Returns whether the paths have to be computed from scratch
+        """
+        entry = self.entries.get((master, slave), None)
+
+        if entry is not None and not entry.stale and entry.broken:
+            entry = self._repair(G, master, slave, entry)
+
+        return entry is None or entry.stale
+
+    def put(self, master, slave, paths: list, recommendations: list, G: nx.DiGraph = None) -> CachedPaths:
+        """
+        Caches the paths between master and slave, G is the graph they were computed on
+        """
+        entry = CachedPaths(paths, recommendations, self.version, G)
+        self.entries[(master, slave)] = entry
+        return entry
+
+    def get(self, G: nx.DiGraph, master, slave) -> CachedPaths:
+        """
+        Returns the paths between master and slave, they are only recomputed if they were
+        invalidated since the last call
+        """
+        if self.refresh(G, master, slave):
+            return self.put(master, slave, *get_n_redundant_paths(G, master, slave, self.n,
+                                                                    max_delay_difference=self.max_delay_difference),
+                            G)
+
+        return self.entries[(master, slave)]
+
+    def _repair(self, G: nx.DiGraph, master, slave, entry: CachedPaths) -> CachedPaths:
+        intact = [p for (i, p) in enumerate(entry.paths) if i not in entry.broken]
+
+        # search replacements that are disjoint to the intact paths
+        excluded = {n for p in intact for n in p[1:-1]}
+        H = G.subgraph(n for n in G if n not in excluded)
+        if any(len(p) == 2 for p in intact):
+            H = nx.restricted_view(H, [], [(master, slave), (slave, master)])
+
+        try:
+            replacements = [path for (_, path) in disjoint_paths(CompactGraph(H), master, slave,
+                                                                 k=len(entry.broken))]
+        except nx.NetworkXException:
+            replacements = []
+
+        paths = sorted(intact + replacements, key=lambda p: (path_delay(G, p), len(p)))
+        if self.max_delay_difference is not None and paths:
+            shortest = path_delay(G, paths[0])
+            paths = [p for p in paths if path_delay(G, p) - shortest <= self.max_delay_difference]
+
+        if len(paths) < self.n:
+            # a full recomputation might still find enough paths
+            entry.stale = True
+            return entry
+
+        logger.debug(f"repaired {len(entry.broken)} paths between {master} and {slave}")
+        return self.put(master, slave, paths, [], G)
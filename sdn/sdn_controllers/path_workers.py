@@ -0,0 +1,93 @@
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from os_ken.lib import hub
+
+from util import get_n_redundant_paths
+from disjoint_paths import CompactGraph
+from sdn_controllers.graph_snapshot import GraphSnapshot
+
+import util
+import logging
+logger = util.get_logger(__name__, logging.INFO, False)
+
+
+def compute_paths(snapshot: GraphSnapshot, pairs: list[tuple], n: int,
+                  max_delay_difference: float = None) -> list[tuple[list, list]]:
+    """
+    Runs in a worker process, returns the redundant paths and recommendations of every pair
+    """
+    compact = CompactGraph.from_snapshot(snapshot)
+    return [get_n_redundant_paths(None, s, t, n, compact, max_delay_difference) for (s, t) in pairs]
+
+
+class PathWorkers:
+    """
+    Computes redundant paths in a pool of worker processes, so that the max-flow computations neither
+    block the eventlet hub (and with it the packet-in handling) nor are limited to a single core
+    """
+
+    POLL_INTERVAL = 0.01
+
+    def __init__(self, workers: int = None):
+        # 0 computes the paths in the calling green thread
+        self.workers: int = os.cpu_count() if workers is None else workers
+        self.pool: ProcessPoolExecutor = None
+
+    def _get_pool(self) -> ProcessPoolExecutor:
+        if self.pool is None:
+            # NOTE: forking the controller would copy the eventlet hub into the workers
+            self.pool = ProcessPoolExecutor(max_workers=self.workers,
+                                            mp_context=multiprocessing.get_context('spawn'))
+        return self.pool
+
+    def compute(self, snapshot: GraphSnapshot, pairs: list[tuple], n: int,
+                max_delay_difference: float = None) -> list[tuple[list, list]]:
+        """
+        Returns the result of get_n_redundant_paths for every (source, target) pair, in the order of pairs.
+        Only the snapshot of the graph is sent to the workers, the calling green thread yields to the hub
+        until all of them are done. Returns None if the computation failed
+        """
+        if not pairs:
+            return []
+
+        if self.workers == 0:
+            try:
+                return compute_paths(snapshot, pairs, n, max_delay_difference)
+            except Exception as e:
+                logger.exception(f"Path computation failed: {e}")
+                return None
+
+        # one chunk per worker, so that the snapshot is only sent once to each of them
+        chunks = [pairs[i::self.workers] for i in range(min(self.workers, len(pairs)))]
+        try:
+            futures = [self._get_pool().submit(compute_paths, snapshot, chunk, n, max_delay_difference)
+                       for chunk in chunks]
+            while not all(f.done() for f in futures):
+                hub.sleep(self.POLL_INTERVAL)
+            chunk_results = [f.result() for f in futures]
+        except BrokenProcessPool as e:
+            logger.error(f"Path computation worker died, computing paths in the controller: {e}")
+            self.pool = None
+            try:
+                return compute_paths(snapshot, pairs, n, max_delay_difference)
+            except Exception as e:
+                logger.exception(f"Path computation failed: {e}")
+                return None
+        except Exception as e:
+            # e.g. an exception raised by get_n_redundant_paths in a worker
+            logger.exception(f"Path computation failed: {e}")
+            return None
+
+        # undo the round robin distribution of the pairs
+        results = [None] * len(pairs)
+        for (i, chunk_result) in enumerate(chunk_results):
+            results[i::len(chunks)] = chunk_result
+        return results
+
+    def shutdown(self):
+        if self.pool is not None:
+            self.pool.shutdown(wait=False, cancel_futures=True)
+            self.pool = None
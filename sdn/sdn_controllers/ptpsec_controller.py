@@ -3,9 +3,8 @@ from os_ken.base import app_manager
 from os_ken.base.app_manager import lookup_service_brick
 from os_ken.controller import ofp_event
 from os_ken.controller.controller import Datapath
-from os_ken.controller.handler import MAIN_DISPATCHER, set_ev_cls
+from os_ken.controller.handler import MAIN_DISPATCHER, DEAD_DISPATCHER, set_ev_cls
 from os_ken.ofproto import ofproto_v1_3
-from os_ken.lib.packet import packet, ethernet
 from os_ken.lib import hub
 
 import networkx as nx
@@ -14,28 +13,37 @@ from ptp.ptp_host import PtpHost, PtpPath
 from ptp.ptp_packet import PtpPacket
 from ptp.ptp_message_types import MessageType, MeasurementType
 from sdn_controllers.topology_data import TopologyData
+from sdn_controllers.clock_graph import ClockGraph
+from sdn_controllers.path_cache import PathCache, CachedPaths
+from sdn_controllers.path_workers import PathWorkers
+from sdn_controllers.flow_manager import FlowManager, InstalledFlow
+from sdn_controllers.asymmetry_detector import AsymmetryDetector, EventAsymmetryAlarm
+from sdn_controllers.packet_in import EventPacketIn, ParsedPacket, PTP_ETH_TYPE
 
-from settings import REQUIRED_REDUNDANT_PATHS
-from util import get_n_redundant_paths
+from settings import REQUIRED_REDUNDANT_PATHS, PROACTIVE_PTPSEC_FLOWS, PATH_COMPUTATION_WORKERS, \
+    MAX_PATH_DELAY_DIFFERENCE, PATH_DELAY_TOLERANCE, ASYMMETRY_DETECTION, ASYMMETRY_WINDOW, ASYMMETRY_THRESHOLD_NS, \
+    ASYMMETRY_REBASELINE
 
 import util
 import logging
 logger = util.get_logger(__name__, logging.INFO, False)
 
-PTP_ETH_TYPE = 0x88F7
-
 class PTPSecController(app_manager.OSKenApp):
     """
     This controller handles all ptp (and especially ptpsec) packages and is responsible for
     monitoring the current network security aswell as routing the packages over redundant paths
     """
 
+    PTPSEC_FLOW_COOKIE = 0x1 << 2
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _EVENTS = [EventAsymmetryAlarm]
 
     def __init__(self, *args, **kwargs):
         super(PTPSecController, self).__init__(*args, **kwargs)
         self.name = 'ptpsec_controller'
 
+        self.datapaths: dict[int, Datapath] = {}
+
         # map from clock identity to host object
         self.ptp_hosts: dict[int, PtpHost] = {}
 
@@ -44,50 +52,75 @@ class PTPSecController(app_manager.OSKenApp):
         self.master_main_port: str = None
 
         self.topology_data: TopologyData = lookup_service_brick('topology_data')
+        self.flow_manager: FlowManager = lookup_service_brick('flow_manager')
 
-        self.clock_graph: nx.Digraph = nx.DiGraph()
+        # the clock graph is only modified by the info loop, the packet-in handler only records the
+        # newly learned mac addresses of ptp clocks
+        self.clocks: ClockGraph = ClockGraph()
+        self.clock_graph: nx.Digraph = self.clocks.graph
+        self.pending_clocks: dict[str, int] = {}
 
-        self.ptpsec_info_thread = hub.spawn(self._ptpsec_info_loop)
+        # redundant paths of every (master, slave) pair, recomputed only if the clock graph changed
+        self.path_cache: PathCache = PathCache(REQUIRED_REDUNDANT_PATHS, MAX_PATH_DELAY_DIFFERENCE,
+                                               PATH_DELAY_TOLERANCE)
+        self.path_workers: PathWorkers = PathWorkers(PATH_COMPUTATION_WORKERS)
+
+        # map from dpid to all hosts whose main path goes over this switch
+        self.main_path_hosts_at: dict[int, list[PtpHost]] = {}
 
-    def add_flow(self, datapath, priority, match, actions, cookie=0):
-        ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
+        # flows of the current paths per dpid: match fields -> out ports
+        self.path_flows: dict[int, dict[tuple, frozenset[int]]] = {}
 
-        # construct flow_mod message and send it
-        inst = [parser.OFPInstructionActions(
-            ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        # the measurements are copied to the controller by the first switch of their path
+        self.asymmetry_detector: AsymmetryDetector = AsymmetryDetector(
+            ASYMMETRY_WINDOW, ASYMMETRY_THRESHOLD_NS, ASYMMETRY_REBASELINE,
+            lambda alarm: self.send_event_to_observers(alarm, MAIN_DISPATCHER))
 
-        mod = parser.OFPFlowMod(datapath=datapath,
-                                cookie=cookie,
-                                priority=priority,
-                                match=match,
-                                instructions=inst)
+        self.ptpsec_info_thread = hub.spawn(self._ptpsec_info_loop)
 
-        datapath.send_msg(mod)
+    def stop(self):
+        self.path_workers.shutdown()
+        super(PTPSecController, self).stop()
 
-    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
-    def _packet_in_handler(self, ev):
-        msg = ev.msg
-        datapath: Datapath = ev.msg.datapath
-        ofproto: ofproto_v1_3 = datapath.ofproto
-        parser: os_ken.ofproto.ofproto_v1_3_parser = datapath.ofproto_parser
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev: ofp_event.EventOFPStateChange):
+        datapath: Datapath = ev.datapath
+        if datapath.id is None:
+            return
+
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[datapath.id] = datapath
+            # a (re)connected switch gets the flows of the current paths right away
+            if PROACTIVE_PTPSEC_FLOWS:
+                self.install_path_flows(datapath.id)
+        elif ev.state == DEAD_DISPATCHER:
+            self.datapaths.pop(datapath.id, None)
 
-        pkt: packet.Packet = packet.Packet(msg.data)
-        eth_pkt = pkt.get_protocol(ethernet.ethernet)
-        src_mac = eth_pkt.src
-        in_port = msg.match['in_port']
+    @set_ev_cls(EventPacketIn, MAIN_DISPATCHER)
+    def _packet_in_handler(self, ev: EventPacketIn):
+        msg = ev.msg
+        pkt: ParsedPacket = ev.pkt
 
         # ignore non ptp packets
-        if eth_pkt.ethertype != PTP_ETH_TYPE:
+        if not pkt.is_ptp:
             return
 
-        ptp_pkt = PtpPacket(pkt.protocols[-1])
+        datapath: Datapath = pkt.datapath
+        ofproto: ofproto_v1_3 = datapath.ofproto
+        parser: os_ken.ofproto.ofproto_v1_3_parser = datapath.ofproto_parser
+
+        src_mac = pkt.src
+        in_port = pkt.in_port
+
+        ptp_pkt: PtpPacket = pkt.ptp
         src_clockIdentity = ptp_pkt.sourceClockIdentity
 
         if src_clockIdentity not in self.ptp_hosts:
             self.ptp_hosts[src_clockIdentity] = PtpHost(src_clockIdentity)
 
         self.ptp_hosts[src_clockIdentity].mac_to_portid[src_mac] = ptp_pkt.sourcePortNumber
+        if self.clocks.label(src_mac) != src_clockIdentity:
+            self.pending_clocks[src_mac] = src_clockIdentity
 
         if ptp_pkt.messageType not in [MessageType.SYNC, MessageType.FOLLOW_UP,
                                        MessageType.DELAY_REQ, MessageType.DELAY_RESP,
@@ -101,136 +134,32 @@ class PTPSecController(app_manager.OSKenApp):
         logger.debug(f"ptp packet from {src_clockIdentity} of type {ptp_pkt.messageType} at dp {
             datapath.id} in port {in_port}")
 
+        meas_type: MeasurementType = None
         if ptp_pkt.messageType == MessageType.MEASUREMENT:
-            logger.debug(f"{ptp_pkt.msg.measType=}")
+            meas_type = ptp_pkt.msg.measType
+            logger.debug(f"{meas_type=}")
 
         # routing of the package
-        # NOTE TODO: this has A LOT of duplicat code that can be broken in to smaller functions
-        #            further more, the differentiation between main_path and all other paths might
-        #            not be neccessary.
-        actions = []
-        match = None
-        dbg_paths = []
-        if ptp_pkt.messageType in [MessageType.SYNC, MessageType.FOLLOW_UP]:
-            # sync and followup messages are ment for all slaves
-            for host in self.ptp_hosts.values():
-                host: PtpHost
-                if host.clock_identity == self.ptp_master or host.main_path is None:
-                    continue
-
-                out_port = self.get_out_port(datapath.id, host.main_path, True)
-
-                if out_port is not None:
-                    actions.append(parser.OFPActionOutput(out_port))
-                    match = parser.OFPMatch(in_port=in_port,
-                                            eth_type_nxm=PTP_ETH_TYPE,
-                                            ptp_msg_type=ptp_pkt.messageType.value)
-                    dbg_paths.append(host.main_path.path)
-
-        elif ptp_pkt.messageType == MessageType.DELAY_RESP:
-            # delay_resp messages are only ment for the requesting slave
-            host: PtpHost = self.ptp_hosts.get(ptp_pkt.msg.requestingClockIdentity, None)
-
-            if host is None or host.main_path is None:
-                return
-
-            out_port = self.get_out_port(datapath.id, host.main_path, True)
-
-            if out_port is not None:
-                actions.append(parser.OFPActionOutput(out_port))
-                match = parser.OFPMatch(in_port=in_port,
-                                        eth_type_nxm=PTP_ETH_TYPE,
-                                        ptp_msg_type=ptp_pkt.messageType.value,
-                                        ptp_dr_requesting_clock_id=ptp_pkt.msg.requestingClockIdentity)
-                dbg_paths.append(host.main_path.path)
+        rule: RoutingRule = ROUTING_TABLE.get(
+            (ptp_pkt.messageType, meas_type, src_clockIdentity == self.ptp_master), None)
+        if rule is None:
+            return
 
-        elif ptp_pkt.messageType == MessageType.DELAY_REQ:
-            # delay_request are ment for the master
-            host: PtpHost = self.ptp_hosts[src_clockIdentity]
+        paths: list[PtpPath] = rule.paths(self, ptp_pkt, datapath.id)
+        observed = ASYMMETRY_DETECTION and rule.observed and self._observe(ptp_pkt, datapath.id, rule, paths)
 
-            if host.main_path is None:
-                return
+        # copies of the flows below are only observed
+        if msg.reason == ofproto.OFPR_ACTION:
+            return
 
-            out_port = self.get_out_port(datapath.id, host.main_path, False)
+        actions = []
+        dbg_paths = []
+        for path in paths:
+            out_port = path.out_port(datapath.id, rule.from_master)
 
             if out_port is not None:
                 actions.append(parser.OFPActionOutput(out_port))
-                match = parser.OFPMatch(in_port=in_port,
-                                        eth_type_nxm=PTP_ETH_TYPE,
-                                        ptp_msg_type=ptp_pkt.messageType.value,
-                                        ptp_src_clock_id=src_clockIdentity)
-                dbg_paths.append(host.main_path.path)
-
-        elif ptp_pkt.messageType == MessageType.MEASUREMENT:
-            if ptp_pkt.msg.measType in [MeasurementType.MEAS_MEASUREMENT, MeasurementType.MEAS_FOLLOW_UP]:
-                if src_clockIdentity == self.ptp_master:
-                    host: PtpHost = self.ptp_hosts.get(ptp_pkt.msg.targetClockIdentity, None)
-
-                    if host is None:
-                        return
-
-                    path: PtpPath = None
-                    for p in host.meas_paths:
-                        if datapath.id in p.path:
-                            path = p
-                            break
-
-                    if path is not None:
-                        out_port = self.get_out_port(datapath.id, path, True)
-
-                        if out_port is not None:
-                            actions.append(parser.OFPActionOutput(out_port))
-                            match = parser.OFPMatch(in_port=in_port,
-                                                    eth_type_nxm=PTP_ETH_TYPE,
-                                                    ptp_msg_type=ptp_pkt.messageType.value,
-                                                    ptp_src_clock_id=src_clockIdentity,
-                                                    ptp_meas_type=ptp_pkt.msg.measType.value,
-                                                    ptp_meas_target_clock_id=ptp_pkt.msg.targetClockIdentity)
-                            dbg_paths.append(path.path)
-                else:
-                    # slave to master
-                    host: PtpHost = self.ptp_hosts[src_clockIdentity]
-                    path: PtpPath = None
-                    for p in host.meas_paths:
-                        if datapath.id in p.path:
-                            path = p
-                            break
-
-                    if path is not None:
-                        out_port = self.get_out_port(datapath.id, path, False)
-
-                        if out_port is not None:
-                            actions.append(parser.OFPActionOutput(out_port))
-                            match = parser.OFPMatch(in_port=in_port,
-                                                    eth_type_nxm=PTP_ETH_TYPE,
-                                                    ptp_msg_type=ptp_pkt.messageType.value,
-                                                    ptp_src_clock_id=src_clockIdentity,
-                                                    ptp_meas_type=ptp_pkt.msg.measType.value)
-                            dbg_paths.append(path.path)
-            elif ptp_pkt.msg.measType == MeasurementType.MEAS_TRANSPORT:
-                host: PtpHost = self.ptp_hosts.get(ptp_pkt.msg.targetClockIdentity, None)
-
-                if host is None:
-                    return
-
-                path: PtpPath = None
-                for p in host.meas_paths:
-                    if datapath.id in p.path:
-                        path = p
-                        break
-
-                if path is not None:
-                    out_port = self.get_out_port(datapath.id, path, True)
-
-                    if out_port is not None:
-                        actions.append(parser.OFPActionOutput(out_port))
-                        match = parser.OFPMatch(in_port=in_port,
-                                                eth_type_nxm=PTP_ETH_TYPE,
-                                                ptp_msg_type=ptp_pkt.messageType.value,
-                                                ptp_src_clock_id=src_clockIdentity,
-                                                ptp_meas_type=ptp_pkt.msg.measType.value,
-                                                ptp_meas_target_clock_id=ptp_pkt.msg.targetClockIdentity)
-                        dbg_paths.append(path.path)
+                dbg_paths.append(path.path)
 
         logger.debug(f"{actions=}")
         if not actions:
@@ -243,34 +172,85 @@ class PTPSecController(app_manager.OSKenApp):
                                   data=msg.data)
         datapath.send_msg(out)
 
-        if match is not None:
-            self.add_flow(datapath, 10, match, actions)
-
-    def get_out_port(self, dpid: int, ptp_path: PtpPath, from_master: bool):
-        inc = 1 if from_master else -1
-
-        try:
-            idx = ptp_path.path.index(dpid)
-        except ValueError:
-            return None
-
-        # NOTE: TODO: check if inress port is connected to previous node on path
-        next = ptp_path.path[idx + inc]
-
-        if not self.clock_graph.has_edge(dpid, next):
-            logger.error(f"NO EDGE {dpid} -- {next}\n{util.nx_to_graphviz(self.clock_graph)}")
-            return None
+        if observed:
+            actions = actions + [parser.OFPActionOutput(ofproto.OFPP_CONTROLLER)]
+        match = rule.match(parser, in_port, ptp_pkt)
+        self.flow_manager.add_flow(datapath, 10, match, actions, self.PTPSEC_FLOW_COOKIE)
+
+    def _observe(self, ptp_pkt: PtpPacket, dpid: int, rule: 'RoutingRule', paths: list[PtpPath]) -> bool:
+        """
+        Passes a message to the asymmetry detector if dpid is the first switch of one of its paths, every
+        message is only observed once there. Returns whether it was observed
+        """
+        first = [path for path in paths if path.path[1 if rule.from_master else -2] == dpid]
+        if not first:
+            return False
+
+        if ptp_pkt.messageType == MessageType.FOLLOW_UP:
+            self.asymmetry_detector.observe(ptp_pkt, self.ptp_master)
+            return True
+
+        slave = ptp_pkt.msg.targetClockIdentity if rule.from_master else ptp_pkt.sourceClockIdentity
+        host: PtpHost = self.ptp_hosts.get(slave, None)
+        if host is None or host.main_path is None:
+            return True
+        path = (tuple(host.main_path.path), tuple(first[0].path))
+        self.asymmetry_detector.observe(ptp_pkt, self.ptp_master, slave, path)
+        return True
+
+    def _slave_main_paths(self, ptp_pkt: PtpPacket, dpid: int) -> list[PtpPath]:
+        # sync and followup messages are ment for all slaves
+        return [host.main_path for host in self.main_path_hosts_at.get(dpid, ())
+                if host.clock_identity != self.ptp_master and host.main_path is not None]
+
+    def _requesting_main_path(self, ptp_pkt: PtpPacket, dpid: int) -> list[PtpPath]:
+        # delay_resp messages are only ment for the requesting slave
+        host: PtpHost = self.ptp_hosts.get(ptp_pkt.msg.requestingClockIdentity, None)
+        if host is None or host.main_path is None:
+            return []
+        return [host.main_path]
+
+    def _source_main_path(self, ptp_pkt: PtpPacket, dpid: int) -> list[PtpPath]:
+        # delay_request are ment for the master
+        host: PtpHost = self.ptp_hosts[ptp_pkt.sourceClockIdentity]
+        if host.main_path is None:
+            return []
+        return [host.main_path]
+
+    def _target_meas_path(self, ptp_pkt: PtpPacket, dpid: int) -> list[PtpPath]:
+        host: PtpHost = self.ptp_hosts.get(ptp_pkt.msg.targetClockIdentity, None)
+        if host is None or dpid not in host.meas_path_at:
+            return []
+        return [host.meas_path_at[dpid]]
+
+    def _source_meas_path(self, ptp_pkt: PtpPacket, dpid: int) -> list[PtpPath]:
+        # slave to master
+        host: PtpHost = self.ptp_hosts[ptp_pkt.sourceClockIdentity]
+        if dpid not in host.meas_path_at:
+            return []
+        return [host.meas_path_at[dpid]]
+
+    def update_path_index(self):
+        """
+        Precomputes which slaves have their main path over which switch. Has to be called whenever
+        the main_path of a host changes
+        """
+        main_path_hosts_at: dict[int, list[PtpHost]] = {}
+        for host in self.ptp_hosts.values():
+            if host.main_path is None:
+                continue
+            for dpid in host.main_path.path[1:-1]:
+                main_path_hosts_at.setdefault(dpid, []).append(host)
 
-        return self.clock_graph[dpid][next]['ports'][dpid]
+        self.main_path_hosts_at = main_path_hosts_at
 
     def _ptpsec_info_loop(self):
         INFO_LOOP_INTERVAL = 5
         while True:
             hub.sleep(INFO_LOOP_INTERVAL)
-            # TODO: figure out correct condition when to continue
-            self.topology_data.topology_change = False
-            self.clock_graph = self.get_clock_graph()
-            logger.info(f"Current clock graph:\n{util.nx_to_graphviz(self.clock_graph)}\n")
+            if self.update_clock_graph():
+                logger.info(f"Current clock graph:\n{util.nx_to_graphviz(self.clock_graph)}\n")
+                self.path_cache.invalidate(self.clocks.pop_changes(), self.clock_graph)
 
             if self.ptp_master is None:
                 logger.warn("Warning: No known ptp master")
@@ -279,36 +259,217 @@ class PTPSecController(app_manager.OSKenApp):
             if self.ptp_master not in self.clock_graph or self.master_main_port not in self.topology_data.graph:
                 continue
 
-            m_host = self.ptp_hosts[self.ptp_master]
-            for ptp_host in self.ptp_hosts.values():
+            # NOTE: the master can change while the paths are computed, the tick is skipped then
+            master = self.ptp_master
+            master_main_port = self.master_main_port
+            master_main_port_switch = list(self.topology_data.graph[master_main_port])[0]
+            slaves = [ptp_host for ptp_host in self.ptp_hosts.values()
+                      if ptp_host.clock_identity != master]
+
+            # paths that are not cached are computed by the workers, the hub keeps running meanwhile
+            pairs = [(master, ptp_host.clock_identity) for ptp_host in slaves
+                     if self.path_cache.refresh(self.clock_graph, master, ptp_host.clock_identity)]
+            results = self.path_workers.compute(self.clocks.snapshot(), pairs, REQUIRED_REDUNDANT_PATHS,
+                                                MAX_PATH_DELAY_DIFFERENCE)
+            if results is None:
+                continue
+            for ((source, slave), (paths, recommendations)) in zip(pairs, results):
+                self.path_cache.put(source, slave, paths, recommendations, self.clock_graph)
+
+            if self.ptp_master != master or self.master_main_port != master_main_port:
+                logger.info(f"ptp master changed to {self.ptp_master} during the path computation")
+                continue
+
+            paths_changed = False
+            for ptp_host in slaves:
                 ptp_host: PtpHost
-                if ptp_host.clock_identity == self.ptp_master:
+                cached: CachedPaths = self.path_cache.entries.get((master, ptp_host.clock_identity), None)
+                if cached is None:
                     continue
+                paths = cached.paths
 
-                (paths, recommendations) = get_n_redundant_paths(self.clock_graph.copy(),
-                                                                 m_host.clock_identity, ptp_host.clock_identity,
-                                                                 REQUIRED_REDUNDANT_PATHS)
-                logger.info(f"\n{paths=}\n{recommendations=}")
+                # nothing to do if the paths and the port of the master did not change
+                if (paths is ptp_host.paths and ptp_host.main_path is not None
+                        and ptp_host.main_path.path[1] == master_main_port_switch):
+                    continue
+
+                logger.info(f"\n{paths=}\n{cached.recommendations=}")
                 if len(paths) < REQUIRED_REDUNDANT_PATHS:
+                    links = ", ".join(f"{link} (path delay {delay:g})" for (delay, link) in cached.recommendations)
                     logger.warn(
                         f"Unable to fulfill path requirements between master {
-                            self.ptp_master} and slave {
-                                ptp_host.clock_identity}.\nRecommended links to add: {recommendations}")
+                            master} and slave {
+                                ptp_host.clock_identity}.\nRecommended links to add: {links}")
 
+                paths_changed = True
                 ptp_host.paths = paths
-                master_main_port_switch = list(self.topology_data.graph[self.master_main_port])[0]
-                for path in paths:
-                    if path[1] == master_main_port_switch:
-                        ptp_host.main_path = PtpPath(path)
-                        paths.remove(path)
-                        ptp_host.meas_paths = [PtpPath(p)
-                                               for p in paths][:REQUIRED_REDUNDANT_PATHS - 1]
-                        break
-
-    def get_clock_graph(self):
-        mac_to_clockid = {}
+                self.asymmetry_detector.forget(ptp_host.clock_identity)
+                main_path = next((p for p in paths if p[1] == master_main_port_switch), None)
+                if main_path is not None:
+                    meas_paths = [p for p in paths if p is not main_path][:REQUIRED_REDUNDANT_PATHS - 1]
+                    ptp_host.set_paths(PtpPath(main_path, self.clock_graph),
+                                       [PtpPath(p, self.clock_graph) for p in meas_paths])
+
+            if not paths_changed:
+                continue
+
+            self.update_path_index()
+            self.update_path_flows()
+
+    def get_path_flows(self) -> dict[int, dict[tuple, frozenset[int]]]:
+        """
+        Computes the flows of all switches on all paths, i.e. the flows that the packet-in handler
+        would install once the first packet of each type arrived.
+        Returns a map from dpid to the match fields of each flow and its out ports
+        """
+        flows: dict[int, dict[tuple, set[int]]] = {}
+
+        def add(path: PtpPath, from_master: bool, msg_type: MessageType, fields: dict, observed: bool = False):
+            in_ports = path.rev_ports if from_master else path.fwd_ports
+            out_ports = path.fwd_ports if from_master else path.rev_ports
+            first = path.path[1 if from_master else -2]
+            for (dpid, out_port) in out_ports.items():
+                if dpid not in in_ports:
+                    continue
+                match_fields = dict(fields, in_port=in_ports[dpid], eth_type_nxm=PTP_ETH_TYPE,
+                                    ptp_msg_type=msg_type.value)
+                key = tuple(sorted(match_fields.items()))
+                flows.setdefault(dpid, {}).setdefault(key, set()).add(out_port)
+                # the first switch also sends a copy to the asymmetry detector
+                if observed and ASYMMETRY_DETECTION and dpid == first:
+                    flows[dpid][key].add(ofproto_v1_3.OFPP_CONTROLLER)
+
         for host in self.ptp_hosts.values():
             host: PtpHost
-            for mac in host.mac_to_portid.keys():
-                mac_to_clockid[mac] = host.clock_identity
-        return nx.relabel_nodes(self.topology_data.graph, mac_to_clockid, copy=True)
+            if host.clock_identity == self.ptp_master or host.main_path is None:
+                continue
+
+            clock_id = host.clock_identity
+            add(host.main_path, True, MessageType.SYNC, {})
+            add(host.main_path, True, MessageType.FOLLOW_UP, {}, observed=True)
+            add(host.main_path, True, MessageType.DELAY_RESP, {'ptp_dr_requesting_clock_id': clock_id})
+            add(host.main_path, False, MessageType.DELAY_REQ, {'ptp_src_clock_id': clock_id})
+
+            for path in host.meas_paths:
+                for meas_type in [MeasurementType.MEAS_MEASUREMENT, MeasurementType.MEAS_FOLLOW_UP]:
+                    add(path, True, MessageType.MEASUREMENT, {'ptp_src_clock_id': self.ptp_master,
+                                                              'ptp_meas_type': meas_type.value,
+                                                              'ptp_meas_target_clock_id': clock_id})
+                    add(path, False, MessageType.MEASUREMENT, {'ptp_src_clock_id': clock_id,
+                                                               'ptp_meas_type': meas_type.value},
+                        observed=meas_type == MeasurementType.MEAS_MEASUREMENT)
+                add(path, True, MessageType.MEASUREMENT, {'ptp_src_clock_id': self.ptp_master,
+                                                          'ptp_meas_type': MeasurementType.MEAS_TRANSPORT.value,
+                                                          'ptp_meas_target_clock_id': clock_id}, observed=True)
+
+        return {dpid: {key: frozenset(ports) for (key, ports) in dp_flows.items()}
+                for (dpid, dp_flows) in flows.items()}
+
+    def update_path_flows(self):
+        """
+        Installs the flows of the current paths (only if PROACTIVE_PTPSEC_FLOWS) and deletes the ptpsec
+        flows that do not belong to them anymore, after the new flows are in place
+        """
+        self.path_flows = self.get_path_flows()
+
+        if PROACTIVE_PTPSEC_FLOWS:
+            for dpid in self.path_flows:
+                self.install_path_flows(dpid)
+            self.flow_manager.flush()
+
+        def is_valid(dpid: int, flow: InstalledFlow) -> bool:
+            return self.path_flows.get(dpid, {}).get(flow.fields, None) == flow.out_ports()
+
+        self.flow_manager.revalidate(self.PTPSEC_FLOW_COOKIE, is_valid)
+        self.flow_manager.flush()
+
+    def install_path_flows(self, dpid: int):
+        """
+        Proactively installs the flows of all ptp paths at a switch, the flow manager skips the flows
+        that are already installed
+        """
+        datapath: Datapath = self.datapaths.get(dpid, None)
+        if datapath is None:
+            return
+
+        parser: os_ken.ofproto.ofproto_v1_3_parser = datapath.ofproto_parser
+        for (key, out_ports) in self.path_flows.get(dpid, {}).items():
+            actions = [parser.OFPActionOutput(port) for port in sorted(out_ports)]
+            self.flow_manager.add_flow(datapath, 10, parser.OFPMatch(**dict(key)), actions, self.PTPSEC_FLOW_COOKIE)
+
+    def update_clock_graph(self) -> bool:
+        """
+        Applies the topology deltas and newly learned clocks to the clock graph.
+        Returns False if nothing changed
+        """
+        changed = False
+        topology = self.topology_data.graph
+
+        if self.topology_data.topology_change:
+            self.topology_data.topology_change = False
+            deltas = self.topology_data.get_deltas(self.clocks.version)
+            if deltas is None:
+                logger.debug("topology deltas are not available anymore, rebuilding clock graph")
+                self.clocks.rebuild(topology, self.topology_data.topology_version)
+            else:
+                self.clocks.apply_deltas(deltas, topology)
+            changed = True
+
+        pending_clocks, self.pending_clocks = self.pending_clocks, {}
+        for (mac, clock_id) in pending_clocks.items():
+            self.clocks.set_clock(mac, clock_id, topology)
+            changed = True
+
+        return changed
+
+
+class RoutingRule:
+    """
+    Describes how a ptp message is routed: the paths it follows from the current switch, in which
+    direction it travels along them and which fields the installed flow matches on. Observed messages
+    are also passed to the asymmetry detector
+    """
+
+    def __init__(self, paths, from_master: bool, match_fields: tuple = (), observed: bool = False):
+        self.paths = paths
+        self.from_master = from_master
+        self.match_fields = match_fields
+        self.observed = observed
+
+    def match(self, parser, in_port: int, ptp_pkt: PtpPacket):
+        fields = {name: get(ptp_pkt) for (name, get) in self.match_fields}
+        return parser.OFPMatch(in_port=in_port,
+                               eth_type_nxm=PTP_ETH_TYPE,
+                               ptp_msg_type=ptp_pkt.messageType.value,
+                               **fields)
+
+
+_SRC_CLOCK_ID = ('ptp_src_clock_id', lambda p: p.sourceClockIdentity)
+_DR_REQUESTING_CLOCK_ID = ('ptp_dr_requesting_clock_id', lambda p: p.msg.requestingClockIdentity)
+_MEAS_TYPE = ('ptp_meas_type', lambda p: p.msg.measType.value)
+_MEAS_TARGET_CLOCK_ID = ('ptp_meas_target_clock_id', lambda p: p.msg.targetClockIdentity)
+
+# (messageType, measType, sent by master) -> routing rule
+ROUTING_TABLE: dict[tuple, RoutingRule] = {}
+
+for from_master in [True, False]:
+    ROUTING_TABLE[(MessageType.SYNC, None, from_master)] = \
+        RoutingRule(PTPSecController._slave_main_paths, True)
+    ROUTING_TABLE[(MessageType.FOLLOW_UP, None, from_master)] = \
+        RoutingRule(PTPSecController._slave_main_paths, True, observed=True)
+    ROUTING_TABLE[(MessageType.DELAY_RESP, None, from_master)] = \
+        RoutingRule(PTPSecController._requesting_main_path, True, (_DR_REQUESTING_CLOCK_ID,))
+    ROUTING_TABLE[(MessageType.DELAY_REQ, None, from_master)] = \
+        RoutingRule(PTPSecController._source_main_path, False, (_SRC_CLOCK_ID,))
+    ROUTING_TABLE[(MessageType.MEASUREMENT, MeasurementType.MEAS_TRANSPORT, from_master)] = \
+        RoutingRule(PTPSecController._target_meas_path, True,
+                    (_SRC_CLOCK_ID, _MEAS_TYPE, _MEAS_TARGET_CLOCK_ID), observed=True)
+
+for meas_type in [MeasurementType.MEAS_MEASUREMENT, MeasurementType.MEAS_FOLLOW_UP]:
+    ROUTING_TABLE[(MessageType.MEASUREMENT, meas_type, True)] = \
+        RoutingRule(PTPSecController._target_meas_path, True,
+                    (_SRC_CLOCK_ID, _MEAS_TYPE, _MEAS_TARGET_CLOCK_ID))
+    # slave to master
+    ROUTING_TABLE[(MessageType.MEASUREMENT, meas_type, False)] = \
+        RoutingRule(PTPSecController._source_meas_path, False, (_SRC_CLOCK_ID, _MEAS_TYPE),
+                    observed=meas_type == MeasurementType.MEAS_MEASUREMENT)
@@ -3,15 +3,15 @@ from os_ken.base import app_manager
 from os_ken.base.app_manager import lookup_service_brick
 from os_ken.controller import ofp_event
 from os_ken.controller.controller import Datapath
-from os_ken.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, set_ev_cls
+from os_ken.controller.handler import CONFIG_DISPATCHER, MAIN_DISPATCHER, DEAD_DISPATCHER, set_ev_cls
 from os_ken.ofproto import ofproto_v1_3
-from os_ken.lib.packet import packet, ethernet
 
-from sdn_controllers.topology_data import TopologyData
-from ptp.ptp_packet import PtpPacket
-from ptp.ptp_message_types import MessageType
+import networkx as nx
 
-from util import is_multicast
+from sdn_controllers.topology_data import TopologyData, EventSpanningTreeChanged
+from sdn_controllers.flow_manager import FlowManager, InstalledFlow
+from sdn_controllers.packet_in import EventPacketIn, ParsedPacket, PTP_ETH_TYPE
+from ptp.ptp_message_types import MessageType
 
 import util
 import logging
@@ -25,6 +25,8 @@ class RegularSwitch(app_manager.OSKenApp):
 
     MULTICAST_FLOW_COOKIE = 0x1
     SIMPLE_SWITCH_FLOW_COOKIE = 0x1 << 1
+    # like the mac address aging time of a regular switch
+    FLOW_IDLE_TIMEOUT = 300
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
 
     def __init__(self, *args, **kwargs):
@@ -34,9 +36,21 @@ class RegularSwitch(app_manager.OSKenApp):
         self.mac_to_port = {}
 
         self.topology_data: TopologyData = lookup_service_brick('topology_data')
+        self.flow_manager: FlowManager = lookup_service_brick('flow_manager')
 
         self.TOPO_DISCOVERY_INIT_TIME = 10
 
+        self.datapaths: dict[int, Datapath] = {}
+
+        # spanning tree ports per dpid and output actions per (dpid, in_port), both are only computed
+        # once per version of the spanning tree
+        self.flood_version: int = None
+        self.tree_ports: dict[int, tuple[int, ...]] = {}
+        self.flood_actions: dict[tuple[int, int], list] = {}
+
+        # installed multicast groups per dpid: group id (= in_port) -> out ports
+        self.flood_groups: dict[int, dict[int, tuple[int, ...]]] = {}
+
     @set_ev_cls(ofp_event.EventOFPSwitchFeatures, CONFIG_DISPATCHER)
     def switch_features_handler(self, ev: ofp_event.EventOFPSwitchFeatures):
         datapath: Datapath = ev.msg.datapath
@@ -47,55 +61,113 @@ class RegularSwitch(app_manager.OSKenApp):
         match = parser.OFPMatch()
         actions = [parser.OFPActionOutput(
             ofproto.OFPP_CONTROLLER, ofproto.OFPCML_NO_BUFFER)]
-        self.add_flow(datapath, 0, match, actions, 0)
-
-    def add_flow(self, datapath, priority, match, actions, cookie=0):
-        ofproto = datapath.ofproto
-        parser = datapath.ofproto_parser
-
-        # construct flow_mod message and send it
-        inst = [parser.OFPInstructionActions(
-            ofproto.OFPIT_APPLY_ACTIONS, actions)]
+        self.flow_manager.add_flow(datapath, 0, match, actions, 0)
 
-        mod = parser.OFPFlowMod(datapath=datapath,
-                                cookie=cookie,
-                                priority=priority,
-                                match=match,
-                                instructions=inst)
+        # groups of a previous run would make adding the multicast groups fail
+        datapath.send_msg(parser.OFPGroupMod(datapath=datapath, command=ofproto.OFPGC_DELETE,
+                                             group_id=ofproto.OFPG_ALL))
+        self.flood_groups[datapath.id] = {}
 
-        datapath.send_msg(mod)
+    @set_ev_cls(ofp_event.EventOFPStateChange, [MAIN_DISPATCHER, DEAD_DISPATCHER])
+    def _state_change_handler(self, ev: ofp_event.EventOFPStateChange):
+        datapath: Datapath = ev.datapath
+        if datapath.id is None:
+            return
 
-    # from https://sourceforge.net/p/ryu/mailman/message/32333352/
-    def delete_all_flows(self, datapath: Datapath):
+        if ev.state == MAIN_DISPATCHER:
+            self.datapaths[datapath.id] = datapath
+        elif ev.state == DEAD_DISPATCHER:
+            self.datapaths.pop(datapath.id, None)
+            self.flood_groups.pop(datapath.id, None)
+
+    @set_ev_cls(EventSpanningTreeChanged, MAIN_DISPATCHER)
+    def _spanning_tree_handler(self, ev: EventSpanningTreeChanged):
+        # the multicast flows stay, only the groups they point to are changed
+        for (dpid, groups) in self.flood_groups.items():
+            datapath = self.datapaths.get(dpid, None)
+            if datapath is None:
+                continue
+            for in_port in list(groups):
+                self.install_flood_group(datapath, in_port)
+
+        self.revalidate_unicast_flows()
+
+    def get_flood_ports(self, dpid: int, in_port: int) -> tuple[int, ...]:
+        if self.flood_version != self.topology_data.mst_version:
+            self.flood_version = self.topology_data.mst_version
+            self.tree_ports.clear()
+            self.flood_actions.clear()
+
+        ports = self.tree_ports.get(dpid, None)
+        if ports is None:
+            mst = self.topology_data.min_spanning_tree
+            ports = tuple(edge['ports'][dpid] for edge in mst[dpid].values()) if dpid in mst else ()
+            self.tree_ports[dpid] = ports
+        return tuple(port for port in ports if port != in_port)
+
+    def get_flood_actions(self, datapath: Datapath, in_port: int) -> list:
+        ports = self.get_flood_ports(datapath.id, in_port)
+        actions = self.flood_actions.get((datapath.id, in_port), None)
+        if actions is None:
+            parser = datapath.ofproto_parser
+            actions = [parser.OFPActionOutput(port) for port in ports]
+            self.flood_actions[(datapath.id, in_port)] = actions
+        return actions
+
+    def install_flood_group(self, datapath: Datapath, in_port: int):
+        """
+        Installs (or updates) the group that floods multicast packets received on in_port along the
+        spanning tree, its group id is the port number. Only physical ports (up to OFPP_MAX) have a group
+        """
         ofproto = datapath.ofproto
         parser = datapath.ofproto_parser
 
-        empty_match = parser.OFPMatch()
-        instructions = []
-
-        logger.info(f"deleting flows for dpid {datapath.id}")
-
-        # mod = parser.OFPFlowMod(datapath=datapath,
-        #                         command=ofproto.OFPFC_DELETE,
-        #                         match=empty_match,
-        #                         priority=1,
-        #                         out_port=ofproto.OFPP_ANY,
-        #                         instructions=instructions)
-        # datapath.send_msg(mod)
-
-        mod = parser.OFPFlowMod(datapath=datapath,
-                                table_id=ofproto.OFPTT_ALL,
-                                command=ofproto.OFPFC_DELETE,
-                                cookie=self.MULTICAST_FLOW_COOKIE,  # | self.SIMPLE_SWITCH_FLOW_COOKIE,
-                                cookie_mask=self.MULTICAST_FLOW_COOKIE | self.SIMPLE_SWITCH_FLOW_COOKIE,
-                                priority=5,
-                                out_port=ofproto.OFPP_ANY,
-                                out_group=ofproto.OFPG_ANY)
-        # instructions=instructions)
-        datapath.send_msg(mod)
-
-    @set_ev_cls(ofp_event.EventOFPPacketIn, MAIN_DISPATCHER)
-    def _packet_in_handler(self, ev):
+        if in_port > ofproto.OFPP_MAX:
+            return
+
+        ports = self.get_flood_ports(datapath.id, in_port)
+        groups = self.flood_groups.setdefault(datapath.id, {})
+        if groups.get(in_port, None) == ports:
+            return
+
+        command = ofproto.OFPGC_ADD if in_port not in groups else ofproto.OFPGC_MODIFY
+        buckets = [parser.OFPBucket(actions=[parser.OFPActionOutput(port)]) for port in ports]
+        datapath.send_msg(parser.OFPGroupMod(datapath=datapath, command=command, type_=ofproto.OFPGT_ALL,
+                                             group_id=in_port, buckets=buckets))
+        groups[in_port] = ports
+
+    def revalidate_unicast_flows(self):
+        """
+        Deletes the unicast flows that do not follow the spanning tree anymore and forgets the mac
+        addresses they were learned for, so that they are flooded along the new tree until learned again
+        """
+        mst = self.topology_data.min_spanning_tree
+        graph = self.topology_data.graph
+        # next hop towards each destination, computed once per destination
+        next_hops: dict[str, dict] = {}
+
+        def is_valid(dpid: int, flow: InstalledFlow) -> bool:
+            (out_port,) = flow.out_ports() or (None,)
+            dst = flow.match.get('eth_dst')
+            if dst in mst and dpid in mst:
+                if dst not in next_hops:
+                    next_hops[dst] = dict(nx.bfs_predecessors(mst, dst))
+                hop = next_hops[dst].get(dpid, None)
+                valid = hop is not None and mst[dpid][hop]['ports'][dpid] == out_port
+            else:
+                # unknown hosts can only be behind ports of the tree or ports without a switch behind them
+                switch_ports = {edge['ports'][dpid] for (v, edge) in graph[dpid].items()
+                                if graph.nodes[v].get('is_switch', False)} if dpid in graph else set()
+                valid = out_port not in switch_ports or out_port in self.get_flood_ports(dpid, None)
+
+            if not valid:
+                self.mac_to_port.get(dpid, {}).pop(dst, None)
+            return valid
+
+        self.flow_manager.revalidate(self.SIMPLE_SWITCH_FLOW_COOKIE, is_valid)
+
+    @set_ev_cls(EventPacketIn, MAIN_DISPATCHER)
+    def _packet_in_handler(self, ev: EventPacketIn):
         msg = ev.msg
         datapath: Datapath = ev.msg.datapath
         ofproto: ofproto_v1_3 = datapath.ofproto
@@ -105,29 +177,31 @@ class RegularSwitch(app_manager.OSKenApp):
         dpid = datapath.id
         self.mac_to_port.setdefault(dpid, {})
 
-        # analyse the received packets using the packet library
-        pkt: packet.Packet = packet.Packet(msg.data)
-        eth_pkt: ethernet.ethernet = pkt.get_protocol(ethernet.ethernet)
-        dst = eth_pkt.dst
-        src = eth_pkt.src
+        # the packet has already been parsed by the ptpsec_app
+        pkt: ParsedPacket = ev.pkt
+        dst = pkt.dst
+        src = pkt.src
 
-        # ignore LLDP packages
-        if eth_pkt.ethertype == 0x88cc:
+        # ignore LLDP packages and delay probes
+        if pkt.is_lldp or pkt.is_delay_probe:
             return
 
         # get the received port number from packet_in message
-        in_port = msg.match['in_port']
+        in_port = pkt.in_port
 
         logger.debug("packet in %s %s %s %s", dpid, src, dst, in_port)
 
-        is_ptp: bool = eth_pkt.ethertype == 0x88F7
+        is_ptp: bool = pkt.is_ptp
 
         if is_ptp:
-            ptp_pkt: PtpPacket = PtpPacket(pkt.protocols[-1])
+            # copies of forwarded ptp packets for the asymmetry detector of the ptpsec_controller
+            if msg.reason == ofproto.OFPR_ACTION:
+                return
+
             # ignore these message types after the topology init phase as they will be handled by
             # the ptpsec_controller
             if (self.topology_data.topo_loop_uptime > self.TOPO_DISCOVERY_INIT_TIME
-                and (ptp_pkt.messageType in
+                and (pkt.ptp_message_type in
                      [MessageType.SYNC,
                       MessageType.FOLLOW_UP,
                       MessageType.DELAY_REQ,
@@ -139,20 +213,23 @@ class RegularSwitch(app_manager.OSKenApp):
         self.mac_to_port[dpid][src] = in_port
 
         # handle multicast packages with minimum spanning tree to avoid loops
-        if is_multicast(dst):
-            actions = []
-            if dpid in self.topology_data.min_spanning_tree:
-                for edge in self.topology_data.min_spanning_tree[dpid].values():
-                    port = edge['ports'][dpid]
-                    if port != in_port:
-                        actions.append(parser.OFPActionOutput(port))
-
-            # don't set a flow for ptp packages so that we keep receiving them
-            # also don't set flows if the topology discovery has not finished
-            if not is_ptp and self.topology_data.topo_loop_uptime > self.TOPO_DISCOVERY_INIT_TIME:
-                # import pdb; pdb.set_trace()
-                match = parser.OFPMatch(in_port=in_port, eth_dst=dst)
-                self.add_flow(datapath, 2, match, actions, self.MULTICAST_FLOW_COOKIE)
+        if pkt.is_multicast:
+            actions = self.get_flood_actions(datapath, in_port)
+
+            # don't set flows if the topology discovery has not finished, afterwards ptp packages are
+            # only forwarded in the data plane if the ptpsec_controller does not need to see them.
+            # Group ids are port numbers, packets from reserved ports (e.g. OFPP_LOCAL) are always
+            # flooded by packet out as their numbers exceed OFPG_MAX
+            if (self.topology_data.topo_loop_uptime > self.TOPO_DISCOVERY_INIT_TIME
+                    and in_port <= ofproto.OFPP_MAX):
+                self.install_flood_group(datapath, in_port)
+                if is_ptp:
+                    match = parser.OFPMatch(in_port=in_port, eth_dst=dst, eth_type_nxm=PTP_ETH_TYPE,
+                                            ptp_msg_type=pkt.ptp_message_type.value)
+                else:
+                    match = parser.OFPMatch(in_port=in_port, eth_dst=dst)
+                self.flow_manager.add_flow(datapath, 2, match, [parser.OFPActionGroup(in_port)],
+                                           self.MULTICAST_FLOW_COOKIE, self.FLOW_IDLE_TIMEOUT)
 
             if not actions:
                 return
@@ -178,7 +255,8 @@ class RegularSwitch(app_manager.OSKenApp):
         # install a flow to avoid packet_in next time
         if out_port != ofproto.OFPP_FLOOD:
             match = parser.OFPMatch(in_port=in_port, eth_dst=dst)
-            self.add_flow(datapath, 1, match, actions, self.SIMPLE_SWITCH_FLOW_COOKIE)
+            self.flow_manager.add_flow(datapath, 1, match, actions, self.SIMPLE_SWITCH_FLOW_COOKIE,
+                                       self.FLOW_IDLE_TIMEOUT)
 
         # construct packet_out message and send it
         out = parser.OFPPacketOut(datapath=datapath,
@@ -1,10 +1,15 @@
 from os_ken.base import app_manager
+from os_ken.controller.event import EventBase
 from os_ken.controller.handler import MAIN_DISPATCHER, set_ev_cls
 from os_ken.ofproto import ofproto_v1_3
 from os_ken.topology import event, switches
 from os_ken.topology.api import get_all_host, get_all_switch, get_all_link
 from os_ken.lib import hub
 
+from collections import deque
+from enum import Enum
+import time
+
 import networkx as nx
 
 import util
@@ -12,63 +17,339 @@ import logging
 logger = util.get_logger(__name__, logging.INFO, False)
 
 
+class DeltaType(Enum):
+    NODE_ADDED = 0
+    NODE_REMOVED = 1
+    EDGE_ADDED = 2
+    EDGE_REMOVED = 3
+    # the attributes (ports or delay) of an existing edge changed
+    EDGE_UPDATED = 4
+
+
+class TopologyDelta:
+    """
+    A single change of TopologyData.graph. v is None for node deltas
+    """
+
+    __slots__ = ('version', 'type', 'u', 'v')
+
+    def __init__(self, version: int, type: DeltaType, u, v=None):
+        self.version = version
+        self.type = type
+        self.u = u
+        self.v = v
+
+    def __repr__(self):
+        return f"TopologyDelta({self.version}, {self.type.name}, {self.u}, {self.v})"
+
+
+class EventSpanningTreeChanged(EventBase):
+    """
+    Published by TopologyData after a topology event or consistency check changed the spanning tree
+    """
+
+    def __init__(self, mst_version: int):
+        super(EventSpanningTreeChanged, self).__init__()
+        self.mst_version = mst_version
+
+
 class TopologyData(app_manager.OSKenApp):
 
     OFP_VERSIONS = [ofproto_v1_3.OFP_VERSION]
+    _EVENTS = [EventSpanningTreeChanged]
+
+    # number of deltas that are kept, consumers that fall further behind have to rebuild
+    MAX_DELTAS = 4096
 
     def __init__(self, *args, **kwargs):
         super(TopologyData, self).__init__(*args, **kwargs)
         self.name = 'topology_data'
 
-        # graphs of the network
+        # graphs of the network, all of them are updated in place by the topology events
         self.graph: nx.DiGraph = nx.DiGraph()
-        self.min_spanning_tree: nx.DiGraph = nx.DiGraph()
-
+        self.undirected_graph: nx.Graph = nx.Graph()
+        # NOTE: all links have the same weight, so any spanning tree (forest) is minimal
+        self.min_spanning_tree: nx.Graph = nx.Graph()
+        self.mst_version: int = 0
+        self.published_mst_version: int = 0
+
+        # connected component of every node in the spanning forest
+        self._component: dict = {}
+        self._component_nodes: dict[int, set] = {}
+        self._next_component: int = 0
+
+        self.start_time = time.time()
         self.topo_thread = hub.spawn(self._topo_loop)
 
+        # set whenever the graph changes, consumers reset it after they processed the changes
         self.topology_change: bool = False
-        self.topo_loop_uptime = 0
+
+        # every change of the graph increments the version and is logged as delta
+        self.topology_version: int = 0
+        self.deltas: deque[TopologyDelta] = deque(maxlen=self.MAX_DELTAS)
+
+    @property
+    def topo_loop_uptime(self) -> float:
+        return time.time() - self.start_time
 
     def _topo_loop(self):
-        UPDATE_TOPOLOGY_INTERVAL = 4
+        # the topology is kept up to date by the topology events, a full rebuild is only done to
+        # detect (and repair) missed events
+        CONSISTENCY_CHECK_INTERVAL = 30
         while True:
-            hub.sleep(UPDATE_TOPOLOGY_INTERVAL)
-            logger.debug("automatically updating topology")
+            hub.sleep(CONSISTENCY_CHECK_INTERVAL)
+            logger.debug("checking topology consistency")
             self.update_topology()
 
-            self.topo_loop_uptime += UPDATE_TOPOLOGY_INTERVAL
-
-    @set_ev_cls([event.EventSwitchEnter,
-                 event.EventSwitchLeave,
-                 event.EventLinkAdd,
-                 event.EventLinkDelete,
-                 event.EventHostAdd,
-                 event.EventHostDelete,
-                 event.EventHostMove],
-                MAIN_DISPATCHER)
-    def topology_change_hanlder(self, ev):
+    @set_ev_cls(event.EventSwitchEnter, MAIN_DISPATCHER)
+    def _switch_enter_handler(self, ev: event.EventSwitchEnter):
+        logger.info(type(ev))
+        self._add_node(ev.switch.dp.id, is_switch=True)
+        self._publish_spanning_tree()
+
+    @set_ev_cls(event.EventSwitchLeave, MAIN_DISPATCHER)
+    def _switch_leave_handler(self, ev: event.EventSwitchLeave):
+        logger.info(type(ev))
+        self._remove_node(ev.switch.dp.id)
+        self._publish_spanning_tree()
+
+    @set_ev_cls(event.EventLinkAdd, MAIN_DISPATCHER)
+    def _link_add_handler(self, ev: event.EventLinkAdd):
         logger.info(type(ev))
-        # self.update_topology()
+        link: switches.Link = ev.link
+        self._add_link(link)
+        self._publish_spanning_tree()
+
+    @set_ev_cls(event.EventLinkDelete, MAIN_DISPATCHER)
+    def _link_delete_handler(self, ev: event.EventLinkDelete):
+        logger.info(type(ev))
+        link: switches.Link = ev.link
+        self._remove_edge(link.src.dpid, link.dst.dpid)
+        self._publish_spanning_tree()
+
+    @set_ev_cls(event.EventHostAdd, MAIN_DISPATCHER)
+    def _host_add_handler(self, ev: event.EventHostAdd):
+        logger.info(type(ev))
+        self._add_host(ev.host)
+        self._publish_spanning_tree()
+
+    @set_ev_cls(event.EventHostDelete, MAIN_DISPATCHER)
+    def _host_delete_handler(self, ev: event.EventHostDelete):
+        logger.info(type(ev))
+        self._remove_node(ev.host.mac)
+        self._publish_spanning_tree()
+
+    @set_ev_cls(event.EventHostMove, MAIN_DISPATCHER)
+    def _host_move_handler(self, ev: event.EventHostMove):
+        logger.info(type(ev))
+        self._remove_node(ev.src.mac)
+        self._add_host(ev.dst)
+        self._publish_spanning_tree()
 
     def update_topology(self):
+        """
+        Rebuilds the graph from the switches module and applies the differences to the current graph
+        """
         logger.debug("update_topology")
         switch_list: list[switches.Switch] = get_all_switch(self)
         links: switches.LinkState = get_all_link(self)
         hosts_list: list[switches.Host] = get_all_host(self)
 
-        G, DG = self._get_graph(switch_list, hosts_list, links)
-        self.graph = DG
-        T = nx.minimum_spanning_tree(G)
-        self.min_spanning_tree = T
+        DG = self._get_graph(switch_list, hosts_list, links)
+        version = self.topology_version
+        self._apply_graph(DG)
+        if self.topology_version != version:
+            logger.info(f"topology was inconsistent, {self.topology_version - version} changes were missed")
+        self._publish_spanning_tree()
 
         logger.debug("calling print_graphviz_graph")
         self.print_graphviz_graph(switch_list, links, hosts_list)
 
-        logger.debug(f"Graph: \n{util.nx_to_graphviz(G)=}\n")
-        logger.debug(f"Minimum spanning tree:\n{util.nx_to_graphviz(T)=}\n")
+        logger.debug(f"Graph: \n{util.nx_to_graphviz(self.undirected_graph)=}\n")
+        logger.debug(f"Minimum spanning tree:\n{util.nx_to_graphviz(self.min_spanning_tree)=}\n")
+
+    def _publish_spanning_tree(self):
+        if self.mst_version != self.published_mst_version:
+            self.published_mst_version = self.mst_version
+            self.send_event_to_observers(EventSpanningTreeChanged(self.mst_version), MAIN_DISPATCHER)
 
+    def _add_delta(self, type: DeltaType, u, v=None):
+        self.topology_version += 1
+        self.deltas.append(TopologyDelta(self.topology_version, type, u, v))
         self.topology_change = True
 
+    def get_deltas(self, since_version: int) -> list[TopologyDelta]:
+        """
+        Returns all deltas after since_version or None if they are not logged anymore
+        """
+        if since_version >= self.topology_version:
+            return []
+        if not self.deltas or self.deltas[0].version > since_version + 1:
+            return None
+        return [d for d in self.deltas if d.version > since_version]
+
+    def _add_node(self, n, **attrs):
+        if n in self.graph:
+            self.graph.nodes[n].update(attrs)
+            return
+        self.graph.add_node(n, **attrs)
+        self.undirected_graph.add_node(n)
+        self._mst_add_node(n)
+        self._add_delta(DeltaType.NODE_ADDED, n)
+
+    def _remove_node(self, n):
+        if n not in self.graph:
+            return
+        for (u, v) in list(self.graph.out_edges(n)) + list(self.graph.in_edges(n)):
+            self._remove_edge(u, v)
+        self.graph.remove_node(n)
+        self.undirected_graph.remove_node(n)
+        self._mst_remove_node(n)
+        self._add_delta(DeltaType.NODE_REMOVED, n)
+
+    def _add_edge(self, u, v, **attrs):
+        if self.graph.has_edge(u, v):
+            if self.graph[u][v] != attrs:
+                self.graph[u][v].update(attrs)
+                self.undirected_graph[u][v]['ports'] = attrs['ports']
+                if self.min_spanning_tree.has_edge(u, v):
+                    self.min_spanning_tree[u][v]['ports'] = attrs['ports']
+                    self.mst_version += 1
+                self._add_delta(DeltaType.EDGE_UPDATED, u, v)
+            return
+
+        self._add_node(u)
+        self._add_node(v)
+        self.graph.add_edge(u, v, **attrs)
+        self._add_delta(DeltaType.EDGE_ADDED, u, v)
+
+        if not self.undirected_graph.has_edge(u, v):
+            self.undirected_graph.add_edge(u, v, ports=attrs['ports'])
+            self._mst_add_edge(u, v)
+
+    def _remove_edge(self, u, v):
+        if not self.graph.has_edge(u, v):
+            return
+        self.graph.remove_edge(u, v)
+        self._add_delta(DeltaType.EDGE_REMOVED, u, v)
+
+        # the undirected edge remains as long as there is a link in the other direction
+        if not self.graph.has_edge(v, u):
+            self.undirected_graph.remove_edge(u, v)
+            self._mst_remove_edge(u, v)
+
+    def _add_link(self, link: switches.Link):
+        src_id = link.src.dpid
+        dst_id = link.dst.dpid
+
+        delay = 1
+        if self.graph.has_edge(src_id, dst_id):
+            delay = self.graph[src_id][dst_id]['delay']
+        self._add_edge(src_id, dst_id, delay=delay,
+                       ports={src_id: link.src.port_no, dst_id: link.dst.port_no})
+
+    def _add_host(self, host: switches.Host):
+        self._add_node(host.mac, is_switch=False)
+        self._add_edge(host.port.dpid, host.mac, delay=1, ports={host.port.dpid: host.port.port_no})
+        self._add_edge(host.mac, host.port.dpid, delay=1, ports={host.port.dpid: host.port.port_no})
+
+    def _apply_graph(self, DG: nx.DiGraph):
+        """
+        Updates the graph in place to match DG and logs every difference as delta
+        """
+        for n in list(self.graph.nodes):
+            if n not in DG:
+                self._remove_node(n)
+
+        for (u, v) in list(self.graph.edges):
+            if not DG.has_edge(u, v):
+                self._remove_edge(u, v)
+
+        for (n, attrs) in DG.nodes(data=True):
+            self._add_node(n, **attrs)
+
+        for (u, v, attrs) in DG.edges(data=True):
+            self._add_edge(u, v, **attrs)
+
+    def set_link_delay(self, src, dst, delay_ms: float):
+        if not self.graph.has_edge(src, dst):
+            return
+        self.graph[src][dst]['delay'] = delay_ms
+        self._add_delta(DeltaType.EDGE_UPDATED, src, dst)
+
+    # The spanning forest is maintained incrementally: a new edge joins two trees if it connects
+    # different components. If a tree edge is removed, the smaller of the two resulting trees is
+    # searched for a replacement edge, otherwise the component is split.
+
+    def _mst_add_node(self, n):
+        self.min_spanning_tree.add_node(n)
+        self._component[n] = self._next_component
+        self._component_nodes[self._next_component] = {n}
+        self._next_component += 1
+
+    def _mst_remove_node(self, n):
+        # all edges of n are already removed at this point
+        self.min_spanning_tree.remove_node(n)
+        c = self._component.pop(n)
+        self._component_nodes[c].discard(n)
+        if not self._component_nodes[c]:
+            del self._component_nodes[c]
+
+    def _mst_add_edge(self, u, v):
+        cu = self._component[u]
+        cv = self._component[v]
+        if cu == cv:
+            return
+
+        self.min_spanning_tree.add_edge(u, v, **self.undirected_graph[u][v])
+        self.mst_version += 1
+
+        # relabel the smaller component
+        if len(self._component_nodes[cu]) < len(self._component_nodes[cv]):
+            (cu, cv) = (cv, cu)
+        for n in self._component_nodes[cv]:
+            self._component[n] = cu
+        self._component_nodes[cu] |= self._component_nodes.pop(cv)
+
+    def _mst_remove_edge(self, u, v):
+        if not self.min_spanning_tree.has_edge(u, v):
+            return
+
+        self.min_spanning_tree.remove_edge(u, v)
+        self.mst_version += 1
+
+        side = self._smaller_tree(u, v)
+        for x in side:
+            for y in self.undirected_graph[x]:
+                if y not in side:
+                    self.min_spanning_tree.add_edge(x, y, **self.undirected_graph[x][y])
+                    return
+
+        # no replacement edge, the component is split
+        c = self._component[u]
+        self._component_nodes[c] -= side
+        self._component_nodes[self._next_component] = side
+        for n in side:
+            self._component[n] = self._next_component
+        self._next_component += 1
+
+    def _smaller_tree(self, u, v) -> set:
+        """
+        Returns the nodes of the smaller of the two trees that contain u and v. Both trees are
+        traversed in lockstep so that only the smaller one is visited completely
+        """
+        visited = [{u}, {v}]
+        stacks = [[u], [v]]
+        while True:
+            for i in (0, 1):
+                if not stacks[i]:
+                    return visited[i]
+                x = stacks[i].pop()
+                for y in self.min_spanning_tree[x]:
+                    if y not in visited[i]:
+                        visited[i].add(y)
+                        stacks[i].append(y)
+
     def get_ip_graph(self) -> nx.DiGraph:
         mac_to_ip = {}
         for host in get_all_host(self):
@@ -78,26 +359,20 @@ class TopologyData(app_manager.OSKenApp):
 
     def _get_graph(
         self, switch_list: list[switches.Switch], hosts_list: list[switches.Host], links: switches.LinkState
-    ) -> nx.Graph:
+    ) -> nx.DiGraph:
         logger.debug("get_graph")
         DG = nx.DiGraph()
-        G = nx.Graph()
 
         for switch in switch_list:
-            G.add_node(switch.dp.id)
             DG.add_node(switch.dp.id, is_switch=True)
 
         for host in hosts_list:
-            G.add_node(host.mac)
-            G.add_edge(host.port.dpid, host.mac, ports={host.port.dpid: host.port.port_no})
-
             DG.add_node(host.mac, is_switch=False)
             DG.add_edge(host.port.dpid, host.mac, delay=1, ports={
                         host.port.dpid: host.port.port_no})
             DG.add_edge(host.mac, host.port.dpid, delay=1, ports={
                         host.port.dpid: host.port.port_no})
 
-        used_links = set()
         for link in links.keys():
             src_id = link.src.dpid
             dst_id = link.dst.dpid
@@ -108,14 +383,7 @@ class TopologyData(app_manager.OSKenApp):
             DG.add_edge(src_id, dst_id, delay=delay,
                         ports={src_id: link.src.port_no, dst_id: link.dst.port_no})
 
-            if (src_id, dst_id) in used_links or (dst_id, src_id) in used_links:
-                continue
-
-            G.add_edge(src_id, dst_id,
-                       ports={src_id: link.src.port_no, dst_id: link.dst.port_no})
-            used_links.add((src_id, dst_id))
-
-        return G, DG
+        return DG
 
     def print_graphviz_graph(
         self, switch_list: list[switches.Switch], links: switches.LinkState, hosts_list: list[switches.Host]
@@ -1 +1,43 @@
 REQUIRED_REDUNDANT_PATHS = 2
+
+# paths whose delay (ms) exceeds the one of the shortest path by more than this are not used, None
+# allows any difference
+MAX_PATH_DELAY_DIFFERENCE = None
+
+# relative change of a link delay below which the cached paths are not recomputed (0.1 = 10%)
+PATH_DELAY_TOLERANCE = 0.1
+
+# install the flows of all ptp paths as soon as they are computed instead of waiting for the first
+# packet of each type at every switch
+PROACTIVE_PTPSEC_FLOWS = True
+
+# number of processes that compute the redundant paths of the slaves, None uses one per cpu core and 0
+# computes them in the controller itself
+PATH_COMPUTATION_WORKERS = None
+
+# number of LLDP delay samples kept per link and the statistic of them that is used as link delay:
+# 'median', 'ewma' or a percentile (0 to 100)
+LINK_DELAY_WINDOW = 32
+LINK_DELAY_ESTIMATOR = 'median'
+
+# interval (s) of the echo requests that measure the round trip time between the controller and every
+# switch, half of it is subtracted from both ends of the LLDP link delays. None disables the compensation
+CONTROL_CHANNEL_ECHO_INTERVAL = 1
+
+# delay probes are sent over every link between DELAY_PROBE_MIN_INTERVAL and DELAY_PROBE_MAX_INTERVAL
+# seconds apart, more often while the variance or asymmetry of its delay rises. All links together send at
+# most DELAY_PROBE_MAX_RATE probes per second. Without probes, only the LLDP packets are used
+DELAY_PROBES = True
+DELAY_PROBE_MIN_INTERVAL = 0.1
+DELAY_PROBE_MAX_INTERVAL = 5
+DELAY_PROBE_MAX_RATE = 200
+
+# the controller checks the ptpsec round trip measurements while they pass through: an alarm is raised if
+# a measurement deviates from the last ASYMMETRY_WINDOW ones of the same paths by more than
+# ASYMMETRY_THRESHOLD_NS (and several standard deviations)
+ASYMMETRY_DETECTION = True
+ASYMMETRY_WINDOW = 64
+ASYMMETRY_THRESHOLD_NS = 1000
+# a deviation that lasts this many measurements in a row becomes the new normal and the alarm is cleared,
+# None keeps the alarm up until the measurements return to the old baseline
+ASYMMETRY_REBASELINE = 128
@@ -1,17 +1,22 @@
 #!/usr/bin/env python
 
 from sys import argv
+from typing import TYPE_CHECKING
 
-from mininet.cli import CLI
-from mininet.net import Mininet
-from mininet.node import RemoteController
-from mininet.link import TCULink
-from mininet.term import makeTerms
-from mininet.node import OVSSwitch
+# NOTE: mininet is only needed to start a topology, the offline tools (see redundancy_audit.py) pass a
+# recorder instead of the Mininet object and ignore the switch and link classes
+try:
+    from mininet.link import TCULink
+    from mininet.node import OVSSwitch
+except ImportError:
+    TCULink = OVSSwitch = None
+
+if TYPE_CHECKING:
+    from mininet.net import Mininet
 
 #import random
 
-def eval_topo(net: Mininet):
+def eval_topo(net: 'Mininet'):
     M = net.addHost('M')
     S = net.addHost('S')
 
@@ -59,7 +64,7 @@ def eval_topo(net: Mininet):
     net.addLink(s8, S)
     net.addLink(s12, S)
 
-def setup_ips(net: Mininet):
+def setup_ips(net: 'Mininet'):
     import re
     for host in net.hosts:
         for intf in host.intfList():
@@ -74,11 +79,17 @@ def setup_ips(net: Mininet):
             host.setIP(f'10.0.0.{host_id}', intf=intf)
 
 
+topos = {'A': eval_topo,
+        }
+
+
 if '__main__' == __name__:
-    DEFAULT_TOPO = eval_topo
+    import mininet.net
+    from mininet.cli import CLI
+    from mininet.node import RemoteController
+    from mininet.term import makeTerms
 
-    topos = {'A': eval_topo,
-            }
+    DEFAULT_TOPO = eval_topo
 
     topo = DEFAULT_TOPO
 
@@ -88,7 +99,7 @@ if '__main__' == __name__:
         else:
             print(f"Warning: {argv[1]} is an invalid topology name. Using default topology instead")
 
-    net = Mininet(controller=RemoteController)
+    net = mininet.net.Mininet(controller=RemoteController)
 
     c0 = net.addController('c0', port=6633)
 
@@ -1,6 +1,8 @@
 import logging
 import networkx as nx
 
+from disjoint_paths import CompactGraph, disjoint_paths, recommend_links
+
 
 def is_multicast(mac: str) -> bool:
     if mac is None:
@@ -39,9 +41,21 @@ def nx_to_graphviz(G: nx.Graph) -> str:
     s += "}"
     return s
 
-def get_n_redundant_paths(G: nx.DiGraph, s, t, n: int) -> (list, list):
+def get_n_redundant_paths(G: nx.DiGraph, s, t, n: int, compact: CompactGraph = None,
+                          max_delay_difference: float = None) -> (list, list):
+    """
+    Returns the maximum number of node-disjoint paths between s and t with minimal total delay (ordered
+    by delay), and if there are less than n of them the links that should be added as (delay of the new
+    path, link) tuples, best first.
+    G is not modified and not needed if compact, its CompactGraph (e.g. shared by multiple pairs), is passed
+    """
     try:
-        paths = list(nx.node_disjoint_paths(G, s, t))
+        if compact is None:
+            compact = CompactGraph(G)
+        paths = [path for (_, path) in disjoint_paths(compact, s, t,
+                                                      max_delay_difference=max_delay_difference)]
+        if not paths:
+            raise nx.NetworkXNoPath(f"no path between {s} and {t}")
     except Exception as e:
         logger.critical(e)
         return [], []
@@ -49,45 +63,7 @@ def get_n_redundant_paths(G: nx.DiGraph, s, t, n: int) -> (list, list):
     if len(paths) >= n:
         return paths, []
 
-    for path in paths:
-        G.remove_nodes_from(path[1:-1])
-
-        # delete edge between s and t if they are directly connected
-        if len(path) == 2:
-            if (s, t) in G.edges:
-                G.remove_edge(s, t)
-            if (t, s) in G.edges:
-                G.remove_edge(t, s)
-
-    recommended_edges = []
-    while len(paths) + len(recommended_edges) < n:
-        s_reach = nx.single_source_dijkstra_path_length(G, s, weight='delay')
-        t_reach = nx.single_source_dijkstra_path_length(G, t, weight='delay')
-
-        # search min reachable node
-        # TODO: this can be optimized, because the min reachable node is always the nearest neighbor
-        min_s_reach = None
-        for k in s_reach:
-            if k != s and (min_s_reach is None or s_reach[k] < s_reach[min_s_reach]):
-                min_s_reach = k
-
-        if not min_s_reach:
-            break
-
-        min_t_reach = None
-        for k in t_reach:
-            if k != t and (min_t_reach is None or t_reach[k] < s_reach[min_t_reach]):
-                min_t_reach = k
-
-        if not min_t_reach:
-            break
-
-        recommended_edges.append((min_s_reach, min_t_reach))
-
-        G.remove_nodes_from(nx.single_source_dijkstra(G, s, target=min_s_reach)[1:-1])
-        G.remove_nodes_from(nx.single_source_dijkstra(G, t, target=min_t_reach)[1:-1])
-
-    return (paths, recommended_edges)
+    return (paths, recommend_links(compact, s, t, n))
 
 
 #    4  5